@@ -10,4 +10,4 @@ class AppConfig(DjangoAppConfig):
     assignable_users_group = 'assignable users'
 
     def ready(self):
-        pass
+        from .models import signals  # noqa
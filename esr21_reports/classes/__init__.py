@@ -1,3 +1,20 @@
 from .covid_related_queries import COVIDRelatedQueries
 from .hiv_status_queries import HIVStatusQueries
 from .query_generation import QueryGeneration
+from .data_query_rules import DataQueryRule, data_query_rules
+from .data_query_runner import DataQueryRunner
+from .crf_matrix import CrfMatrix, MissingCrf
+from .duplicate_detector import DuplicateDetector
+from .date_constraint import DateConstraint
+from .exclusion_lists import ExclusionList, exclusion_lists
+from .query_profiler import QueryProfiler
+from .appointment_status_index import AppointmentStatusIndex
+from .vaccination_reconciliation import VaccinationMismatch, VaccinationReconciliation
+from .data_query_progress import DataQueryProgress
+from .anti_join_rule import AntiJoinRule
+from .anti_join_rules import anti_join_rules
+from .dashboard_statistics_store import DashboardStatisticsStore
+from .graph_materializer import GraphMaterializer
+from .report_counters import ReportCounters, report_counters
+from .subject_facts import SubjectFactsBuilder, SubjectFactsQuery
+from .site_crosstab import SiteCrosstab
@@ -0,0 +1,168 @@
+from django.apps import apps as django_apps
+from django.db import transaction
+from edc_base.utils import get_utcnow
+from edc_constants.constants import CLOSED, OPEN
+
+
+class ActionItemWriter:
+    """
+    Collects the action items flagged by a data query rule and writes them
+    with one lookup of the existing items and chunked bulk_create/bulk_update
+    statements inside a single transaction.
+
+    OPEN items of the rule's query names that were not flagged again are
+    stale, the problem having been fixed, and are set to `stale_status` with
+    chunked bulk UPDATEs.
+
+    With dry_run the items are compared against the existing ones and counted
+    but nothing is written.
+    """
+
+    action_item_model = 'edc_data_manager.dataactionitem'
+    update_fields = ['assigned', 'status', 'subject', 'comment', 'site']
+    chunk_size = 500
+    stale_status = CLOSED
+
+    def __init__(self, chunk_size=None, dry_run=False):
+        self.chunk_size = chunk_size or self.chunk_size
+        self.dry_run = dry_run
+        self.items = {}
+        self.query_names = set()
+        self.seen_query_names = set()
+
+    @property
+    def action_item_cls(self):
+        return django_apps.get_model(self.action_item_model)
+
+    def add_query_name(self, query_name=None):
+        self.query_names.add(query_name)
+        self.seen_query_names.add(query_name)
+
+    def add(self, subject_identifier=None, query_name=None, **values):
+        """
+        Queue an action item, the last values added for a subject and query
+        name win, as with update_or_create.
+        """
+        self.query_names.add(query_name)
+        self.seen_query_names.add(query_name)
+        self.items.update({(subject_identifier, query_name): values})
+
+    def existing_items(self):
+        """
+        Return {(subject_identifier, query_name): action item} of the queued
+        items' subjects only, whatever their site, the update setting it.
+        """
+        existing = {}
+        action_items = self.action_item_cls.objects.filter(
+            query_name__in=self.query_names,
+            subject_identifier__in={
+                subject_identifier for subject_identifier, _ in self.items})
+        for action_item in action_items:
+            key = (action_item.subject_identifier, action_item.query_name)
+            existing.setdefault(key, action_item)
+        return existing
+
+    @staticmethod
+    def normalize(value=None):
+        return None if value is None else str(value)
+
+    def changed(self, action_item, values):
+        """
+        Compare by string value, so e.g. a site id given as a string or a
+        number does not count as a change.
+        """
+        return any(
+            self.normalize(getattr(action_item, field)) != self.normalize(value)
+            for field, value in values.items())
+
+    def stale_item_ids(self, subject_identifiers=None, site_id=None):
+        """
+        Return the ids of the OPEN items of the query names that were not
+        flagged in this run, limited to the subjects and site the rule was
+        evaluated for.
+        """
+        open_items = self.action_item_cls.objects.filter(
+            query_name__in=self.query_names, status=OPEN)
+        if subject_identifiers is not None:
+            open_items = open_items.filter(
+                subject_identifier__in=subject_identifiers)
+        if site_id is not None:
+            open_items = open_items.filter(site_id=site_id)
+        return [
+            pk for pk, subject_identifier, query_name in open_items.values_list(
+                'pk', 'subject_identifier', 'query_name')
+            if (subject_identifier, query_name) not in self.items]
+
+    def close_unevaluated(self, subject_identifiers=None, site_id=None):
+        """
+        Close the OPEN items of all the query names flushed by this writer
+        whose subjects are not in `subject_identifiers`, e.g. subjects no
+        longer in a rule's input models after a full sweep. Returns the
+        number of items closed, or that would be with dry_run.
+        """
+        open_items = self.action_item_cls.objects.filter(
+            query_name__in=self.seen_query_names, status=OPEN)
+        if site_id is not None:
+            open_items = open_items.filter(site_id=site_id)
+        subject_identifiers = set(subject_identifiers or [])
+        stale_item_ids = [
+            pk for pk, subject_identifier in open_items.values_list(
+                'pk', 'subject_identifier')
+            if subject_identifier not in subject_identifiers]
+        if not self.dry_run:
+            modified = get_utcnow()
+            for index in range(0, len(stale_item_ids), self.chunk_size):
+                self.action_item_cls.objects.filter(
+                    pk__in=stale_item_ids[index:index + self.chunk_size]).update(
+                    status=self.stale_status, modified=modified)
+        return len(stale_item_ids)
+
+    def flush(self, subject_identifiers=None, site_id=None):
+        """
+        Write the queued action items, close the stale ones and return the
+        number of items created, updated, left unchanged and closed, or that
+        would be with dry_run.
+        """
+        to_create = []
+        to_update = []
+        unchanged = 0
+        closed = 0
+
+        if self.query_names:
+            with transaction.atomic():
+                existing = self.existing_items()
+                modified = get_utcnow()
+                for (subject_identifier, query_name), values in self.items.items():
+                    action_item = existing.get((subject_identifier, query_name))
+                    if not action_item:
+                        to_create.append(self.action_item_cls(
+                            subject_identifier=subject_identifier,
+                            query_name=query_name,
+                            **values))
+                    elif self.changed(action_item, values):
+                        for field, value in values.items():
+                            setattr(action_item, field, value)
+                        action_item.modified = modified
+                        to_update.append(action_item)
+                    else:
+                        unchanged += 1
+                stale_item_ids = self.stale_item_ids(
+                    subject_identifiers=subject_identifiers, site_id=site_id)
+                closed = len(stale_item_ids)
+                if not self.dry_run:
+                    self.action_item_cls.objects.bulk_create(
+                        to_create, batch_size=self.chunk_size)
+                    self.action_item_cls.objects.bulk_update(
+                        to_update, fields=[*self.update_fields, 'modified'],
+                        batch_size=self.chunk_size)
+                    for index in range(0, closed, self.chunk_size):
+                        self.action_item_cls.objects.filter(
+                            pk__in=stale_item_ids[index:index + self.chunk_size]).update(
+                            status=self.stale_status, modified=modified)
+
+        self.items = {}
+        self.query_names = set()
+        return dict(created=len(to_create),
+                    updated=len(to_update),
+                    unchanged=unchanged,
+                    closed=closed)
@@ -0,0 +1,133 @@
+from django.apps import apps as django_apps
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+
+
+class AntiJoinRule:
+    """
+    A declarative "present in A but missing in B" check: subjects with a row
+    in the source model (A), optionally also required to have rows in other
+    models, that have no row in the target model (B). Source and target
+    filters are dicts of lookups or Q objects.
+
+        AntiJoinRule(
+            name='female_missing_preg',
+            source_model='esr21_subject.vaccinationdetails',
+            source_filter={'received_dose': YES},
+            source_exists=[('esr21_subject.informedconsent',
+                            'subject_identifier', {'gender': 'F'})],
+            target_model='esr21_subject.pregnancystatus',
+            query_name='Gender is F and pregnancy status form is missing',
+            subject='Gender is F and pregnancy status form is missing',
+            comment='%(subject)s')
+
+    The rule compiles to a single query on the source model with an EXISTS
+    per required model and one NOT EXISTS on the target model, correlated on
+    the join keys.
+
+    With enrolment_visit_only both sides are limited to the participant's
+    enrolment (first) visit: the source rows to those of that visit and the
+    target rows to the source row's visit.
+    """
+
+    visit_model = 'esr21_subject.subjectvisit'
+
+    def __init__(self, name=None, source_model=None, source_filter=None,
+                 source_key='subject_visit__subject_identifier',
+                 source_exists=None, target_model=None, target_filter=None,
+                 target_key='subject_visit__subject_identifier',
+                 match_site=False, site_lookup='site_id',
+                 enrolment_visit_only=False, query_name=None, subject=None,
+                 comment=None):
+        self.name = name
+        self.source_model = source_model
+        self.source_filter = source_filter or {}
+        self.source_key = source_key
+        self.source_exists = source_exists or []
+        self.target_model = target_model
+        self.target_filter = target_filter or {}
+        self.target_key = target_key
+        self.match_site = match_site
+        self.site_lookup = site_lookup
+        self.enrolment_visit_only = enrolment_visit_only
+        self.query_name = query_name
+        self.subject = subject
+        self.comment = comment
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name})'
+
+    @property
+    def source_model_cls(self):
+        return django_apps.get_model(self.source_model)
+
+    @property
+    def target_model_cls(self):
+        return django_apps.get_model(self.target_model)
+
+    @property
+    def visit_model_cls(self):
+        return django_apps.get_model(self.visit_model)
+
+    def enrolment_visit(self):
+        """
+        Return the id of the first visit of the source row's participant.
+        """
+        return Subquery(self.visit_model_cls.objects.filter(
+            subject_identifier=OuterRef(self.source_key)).order_by(
+            'report_datetime').values('id')[:1])
+
+    @property
+    def action_item_comment(self):
+        return self.comment % {'subject': self.subject}
+
+    def required_rows(self):
+        """
+        Return an Exists expression per (model, key, filter) in source_exists.
+        """
+        expressions = []
+        for model, key, filters in self.source_exists:
+            model_cls = django_apps.get_model(model)
+            expressions.append(Exists(model_cls.objects.filter(
+                **{key: OuterRef(self.source_key)}, **filters)))
+        return expressions
+
+    @staticmethod
+    def as_q(filters):
+        return filters if isinstance(filters, Q) else Q(**filters)
+
+    def target_rows(self):
+        targets = self.target_model_cls.objects.filter(
+            self.as_q(self.target_filter),
+            **{self.target_key: OuterRef(self.source_key)})
+        if self.match_site:
+            targets = targets.filter(site_id=OuterRef(self.site_lookup))
+        if self.enrolment_visit_only:
+            targets = targets.filter(subject_visit_id=OuterRef('subject_visit_id'))
+        return targets
+
+    def queryset(self, **filters):
+        """
+        Return the source rows of the subjects missing a target row, further
+        filtered by `filters`, e.g. site_id.
+        """
+        queryset = self.source_model_cls.objects.filter(
+            *self.required_rows(), ~Exists(self.target_rows()),
+            self.as_q(self.source_filter), **filters)
+        if self.enrolment_visit_only:
+            queryset = queryset.filter(subject_visit_id=self.enrolment_visit())
+        return queryset
+
+    def offenders(self, **filters):
+        """
+        Return the distinct (subject identifier, site id) pairs.
+        """
+        return self.queryset(**filters).order_by().values_list(
+            self.source_key, self.site_lookup).distinct()
+
+    def counts_by_site(self, **filters):
+        """
+        Return {site_id: number of distinct subjects}.
+        """
+        return dict(self.queryset(**filters).order_by().values_list(
+            self.site_lookup).annotate(
+            total=Count(self.source_key, distinct=True)))
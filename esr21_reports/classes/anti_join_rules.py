@@ -0,0 +1,64 @@
+from django.db.models import Q
+from edc_constants.constants import YES
+
+from .anti_join_rule import AntiJoinRule
+
+
+vaccinated = ('esr21_subject.vaccinationdetails',
+              'subject_visit__subject_identifier', {'received_dose': YES})
+
+anti_join_rules = {rule.name: rule for rule in [
+    AntiJoinRule(
+        name='female_missing_preg',
+        source_model='esr21_subject.vaccinationdetails',
+        source_filter={'received_dose': YES},
+        source_exists=[('esr21_subject.informedconsent',
+                        'subject_identifier', {'gender': 'F'})],
+        target_model='esr21_subject.pregnancystatus',
+        query_name='Gender is F and pregnancy status form is missing',
+        subject='Gender is F and pregnancy status form is missing',
+        comment='%(subject)s'),
+    AntiJoinRule(
+        name='booster_dose_missing_vaccination_history',
+        source_model='esr21_subject.vaccinationdetails',
+        source_filter={'received_dose_before': 'booster_dose'},
+        target_model='esr21_subject.vaccinationhistory',
+        target_key='subject_identifier',
+        query_name='Booster missing vaccination history',
+        subject=('Participants with a booster dose but missing a vaccination'
+                 ' history data'),
+        comment='%(subject)s.'),
+    # Tests consented to, or a previous test reported, at the enrolment visit
+    # without any result keyed at that visit.
+    AntiJoinRule(
+        name='missing_hiv_test_results',
+        source_model='esr21_subject.rapidhivtesting',
+        source_filter=(Q(hiv_testing_consent=YES) | Q(prev_hiv_test=YES)),
+        source_exists=[vaccinated],
+        target_model='esr21_subject.rapidhivtesting',
+        target_filter=(Q(hiv_result__isnull=False)
+                       | Q(rapid_test_result__isnull=False)),
+        enrolment_visit_only=True,
+        query_name='Participant\'s HIV test result is missing.',
+        subject='Participant\'s HIV test result is missing.',
+        comment=('Participant\'s HIV test status is missing. This needs to '
+                 'be corrected/recaptured on the system')),
+    AntiJoinRule(
+        name='not_on_demographics',
+        source_model='esr21_subject.vaccinationdetails',
+        source_filter={'received_dose_before': 'first_dose'},
+        target_model='esr21_subject.demographicsdata',
+        match_site=True),
+    AntiJoinRule(
+        name='no_medical_history',
+        source_model='esr21_subject.vaccinationdetails',
+        source_filter={'received_dose_before': 'first_dose'},
+        target_model='esr21_subject.medicalhistory',
+        match_site=True),
+    AntiJoinRule(
+        name='no_hiv_results',
+        source_model='esr21_subject.vaccinationdetails',
+        source_filter={'received_dose_before': 'first_dose'},
+        target_model='esr21_subject.rapidhivtesting',
+        match_site=True),
+]}
@@ -0,0 +1,63 @@
+from django.apps import apps as django_apps
+from django.utils.functional import cached_property
+from edc_appointment.constants import NEW_APPT
+from edc_visit_schedule import site_visit_schedules
+
+
+class AppointmentStatusIndex:
+    """
+    The appt_status of the appointments of a set of subjects keyed by
+    (subject_identifier, schedule_name, visit_code, visit_code_sequence),
+    loaded with one query per appointment model.
+    """
+
+    def __init__(self, subject_identifiers=None, appointment_models=None):
+        self.subject_identifiers = subject_identifiers
+        self.appointment_models = appointment_models
+
+    def get_appointment_models(self):
+        """
+        Return the appointment models of the registered schedules.
+        """
+        if self.appointment_models:
+            return self.appointment_models
+        appointment_models = set()
+        for visit_schedule in site_visit_schedules.visit_schedules.values():
+            for schedule in visit_schedule.schedules.values():
+                appointment_models.add(schedule.appointment_model)
+        return sorted(appointment_models)
+
+    @cached_property
+    def index(self):
+        index = {}
+        for appointment_model in self.get_appointment_models():
+            appointment_model_cls = django_apps.get_model(appointment_model)
+            appointments = appointment_model_cls.objects.all()
+            if self.subject_identifiers is not None:
+                appointments = appointments.filter(
+                    subject_identifier__in=self.subject_identifiers)
+            index.update({
+                (subject_identifier, schedule_name, visit_code,
+                 visit_code_sequence): appt_status
+                for (subject_identifier, schedule_name, visit_code,
+                     visit_code_sequence, appt_status) in appointments.values_list(
+                    'subject_identifier', 'schedule_name', 'visit_code',
+                    'visit_code_sequence', 'appt_status')})
+        return index
+
+    def appt_status(self, subject_identifier=None, schedule_name=None,
+                    visit_code=None, visit_code_sequence=None):
+        return self.index.get(
+            (subject_identifier, schedule_name, visit_code, visit_code_sequence))
+
+    def started(self, subject_identifier=None, schedule_name=None,
+                visit_code=None, visit_code_sequence=None):
+        """
+        Return True if the appointment exists and is not a NEW_APPT.
+        """
+        appt_status = self.appt_status(
+            subject_identifier=subject_identifier,
+            schedule_name=schedule_name,
+            visit_code=visit_code,
+            visit_code_sequence=visit_code_sequence)
+        return appt_status is not None and appt_status != NEW_APPT
@@ -1,9 +1,9 @@
-import csv
-
 from django.apps import apps as django_apps
+from django.db.models import Exists, OuterRef
+from django.utils.functional import cached_property
 from edc_constants.constants import NO, YES, OPEN
 
-from django.conf import settings
+from .exclusion_lists import exclusion_lists
 from .query_generation import QueryGeneration
 
 
@@ -29,33 +29,33 @@ class COVIDRelatedQueries(QueryGeneration):
         """
         NOTE: exclude results from enrolment visits.
         """
-        subject = 'Missing symptomatic infections data, but has PCR results. ',
+        subject = 'Missing symptomatic infections data, but has PCR results. '
         comment = ('Participant has PCR results and %(issue_description)s at '
                    'visit(s) %(visits)s. This needs to be corrected/recaptured'
                    ' on the system.')
         query = self.create_query_name(
             query_name='Missing symptomatic infections data, but has PCR results.')
-        pcr_results = self.covid19_results_cls.objects.filter(site_id=self.site_id)
-
-        enrol_visits = [self.enrol_visit(subject_identifier=enrol).id for enrol in
-                        self.overall_enrols]
+        pcr_results = self.in_scope(
+            self.covid19_results_cls.objects.filter(**self.site_filter))
+        # {subject_visit_id: symptomatic_experiences} of the results' visits.
+        symptomatic_experiences = dict(
+            self.covid19infections_cls.objects.filter(
+                subject_visit__in=pcr_results.values('subject_visit')).values_list(
+                'subject_visit_id', 'symptomatic_experiences'))
 
         missing_infections = {}
         no_symptoms = {}
 
-        for result in pcr_results:
+        for result in self.stream(pcr_results, 'subject_visit', 'site'):
             subject_identifier = result.subject_visit.subject_identifier
             visit_code = result.subject_visit.visit_code
             visit_code_sequence = result.subject_visit.visit_code_sequence
 
             missing_visits = missing_infections.get(subject_identifier, [])
             symptom_visits = no_symptoms.get(subject_identifier, [])
-            try:
-                covid_infections = self.covid19infections_cls.objects.get(
-                    subject_visit=result.subject_visit)
-            except self.covid19infections_cls.DoesNotExist:
+            if result.subject_visit_id not in symptomatic_experiences:
                 vaccinated = result.subject_visit.subject_identifier in self.vaccinations
-                if vaccinated and not (result.subject_visit.id in enrol_visits):
+                if vaccinated and result.subject_visit_id not in self.enrol_visit_ids:
                     missing_visits.append(f'{visit_code}.{visit_code_sequence}')
                     missing_infections.update({f'{subject_identifier}': missing_visits})
                     # create action item
@@ -72,7 +72,7 @@ class COVIDRelatedQueries(QueryGeneration):
                                 'missing covid19symptomatic infections form'),
                             'visits': ', '.join(missing_visits), })
             else:
-                if covid_infections.symptomatic_experiences == NO:
+                if symptomatic_experiences.get(result.subject_visit_id) == NO:
                     symptom_visits.append(f'{visit_code}.{visit_code_sequence}')
                     no_symptoms.update({f'{subject_identifier}': symptom_visits})
                     # create action item
@@ -96,61 +96,60 @@ class COVIDRelatedQueries(QueryGeneration):
         7days after vaccination.
         """
         subject = ('Participant has symptomatic infections, but missing PCR '
-                   'results and requisition data. '),
+                   'results and requisition data. ')
         comment = ('Participant has symptomatic infections and no PCR results '
                    'and PCR requisition data at visit(s) %(visits)s. This '
                    'needs to be corrected/recaptured on the system')
         query = self.create_query_name(
             query_name='Missing PCR result data, but has symptomatic infections.')
+        pcr_results = self.covid19_results_cls.objects.filter(
+            subject_visit=OuterRef('subject_visit'))
         infections = self.covid19infections_cls.objects.filter(
-            symptomatic_experiences=YES, site_id=self.site_id).exclude(
-            subject_visit__subject_identifier__in=self.get_reactogenicities
-        )
+            ~Exists(pcr_results), symptomatic_experiences=YES,
+            **self.site_filter).exclude(
+            exclusion_lists.get('ae_reactogenicity').excluded(
+                dry_run=self.action_item_writer.dry_run))
+        infections = self.in_scope(infections)
         missing_pcr = {}
 
-        for infection in infections:
+        for infection in self.stream(infections, 'subject_visit', 'site'):
             subject_identifier = infection.subject_visit.subject_identifier
             visit_code = infection.subject_visit.visit_code
             visit_code_sequence = infection.subject_visit.visit_code_sequence
 
             pcr_visits = missing_pcr.get(subject_identifier, [])
-            try:
-                self.covid19_results_cls.objects.get(
-                    subject_visit=infection.subject_visit, )
-            except self.covid19_results_cls.DoesNotExist:
-                # account for reactogenicity, read pids and visit from file.
-                pcr_visits.append(f'{visit_code}.{visit_code_sequence}')
-                missing_pcr.update({f'{subject_identifier}': pcr_visits})
-                # create action item
-                assign = self.site_issue_assign_opts.get(infection.site.id)
-                self.create_action_item(
-                    site=infection.site,
-                    subject_identifier=subject_identifier,
-                    query_name=query.query_name,
-                    assign=assign,
-                    status=OPEN,
-                    subject=subject,
-                    comment=comment % {
-                        'visits': ', '.join(pcr_visits), })
+            pcr_visits.append(f'{visit_code}.{visit_code_sequence}')
+            missing_pcr.update({f'{subject_identifier}': pcr_visits})
+            # create action item
+            assign = self.site_issue_assign_opts.get(infection.site.id)
+            self.create_action_item(
+                site=infection.site,
+                subject_identifier=subject_identifier,
+                query_name=query.query_name,
+                assign=assign,
+                status=OPEN,
+                subject=subject,
+                comment=comment % {
+                    'visits': ', '.join(pcr_visits), })
 
     def no_infections_symptoms_specified(self):
         """
         Participant has no symptomatic infections, but the symptoms have been
         keyed.
         """
-        subject = 'Participant did not experience COVID symptoms, but symptoms keyed.',
+        subject = 'Participant did not experience COVID symptoms, but symptoms keyed.'
         comment = ('Participant did not experience COVID symptoms but their '
                    'symptoms have been captured at visit %(visits)s on the '
                    'covid19symptomatic infections form. This needs to be '
                    'corrected/recaptured on the system')
         query = self.create_query_name(
             query_name='Participant did not experience COVID symptoms, but symptoms keyed.')
-        infections = self.covid19infections_cls.objects.filter(
+        infections = self.in_scope(self.covid19infections_cls.objects.filter(
             symptomatic_experiences=NO, symptomatic_infections__isnull=False,
-            site_id=self.site_id)
+            **self.site_filter))
         no_infections = {}
 
-        for infection in infections:
+        for infection in self.stream(infections, 'subject_visit', 'site'):
             subject_identifier = infection.subject_visit.subject_identifier
             visit_code = infection.subject_visit.visit_code
             visit_code_sequence = infection.subject_visit.visit_code_sequence
@@ -176,61 +175,59 @@ class COVIDRelatedQueries(QueryGeneration):
         Participant has COVID symptoms during screening, but missing PCR
         results before vaccination.
         """
-        subject = 'Participant has COVID symptoms at screening, but no PCR results.',
+        subject = 'Participant has COVID symptoms at screening, but no PCR results.'
         comment = ('Participant has COVID symptoms during screening, but missing'
                    ' PCR results before getting vaccinated at %(visits)s . '
                    'This needs to be corrected/recaptured on the system')
         query = self.create_query_name(
             query_name='Participant has COVID symptoms at screening, but no PCR results.')
+        screening = self.screening_eligibility_cls.objects.filter(
+            subject_identifier=OuterRef('subject_visit__subject_identifier'),
+            symptomatic_infections_experiences=YES)
+        pcr_results = self.covid19_results_cls.objects.filter(
+            subject_visit=OuterRef('subject_visit'))
+        vaccinations = self.in_scope(self.vaccination_details_cls.objects.filter(
+            Exists(screening))).annotate(has_pcr=Exists(pcr_results)).order_by(
+            'subject_visit__subject_identifier', 'vaccination_date')
         missing_pcr = {}
+        checked = set()
+
+        for enrol_vacc in self.stream(vaccinations, 'subject_visit', 'site'):
+            subject_identifier = enrol_vacc.subject_visit.subject_identifier
+            # Only the earliest vaccination of each vaccinated participant.
+            if (subject_identifier in checked
+                    or subject_identifier not in self.vaccinations):
+                continue
+            checked.add(subject_identifier)
+            visit_code = enrol_vacc.subject_visit.visit_code
+            visit_code_sequence = enrol_vacc.subject_visit.visit_code_sequence
 
-        for enrol in self.vaccinations:
-            screening = self.screening_eligibility_cls.objects.filter(
-                subject_identifier=enrol,
-                symptomatic_infections_experiences=YES)
-            if screening:
-                enrol_vacc = self.vaccination_details_cls.objects.filter(
-                    subject_visit__subject_identifier=enrol).earliest(
-                    'vaccination_date')
-                subject_identifier = enrol_vacc.subject_visit.subject_identifier
-                visit_code = enrol_vacc.subject_visit.visit_code
-                visit_code_sequence = enrol_vacc.subject_visit.visit_code_sequence
-
-                pcr_visits = missing_pcr.get(subject_identifier, [])
-                try:
-                    self.covid19_results_cls.objects.get(
-                        subject_visit=enrol_vacc.subject_visit)
-                except self.covid19_results_cls.DoesNotExist:
-                    pcr_visits.append(f'{visit_code}.{visit_code_sequence}')
-                    missing_pcr.update({f'{subject_identifier}': pcr_visits})
-                    # create action item
-                    assign = self.site_issue_assign_opts.get(enrol_vacc.site.id)
-                    self.create_action_item(
-                        site=enrol_vacc.site,
-                        subject_identifier=subject_identifier,
-                        query_name=query.query_name,
-                        assign=assign,
-                        status=OPEN,
-                        subject=subject,
-                        comment=comment % {
-                            'visits': ', '.join(pcr_visits), })
+            pcr_visits = missing_pcr.get(subject_identifier, [])
+            if not enrol_vacc.has_pcr:
+                pcr_visits.append(f'{visit_code}.{visit_code_sequence}')
+                missing_pcr.update({f'{subject_identifier}': pcr_visits})
+                # create action item
+                assign = self.site_issue_assign_opts.get(enrol_vacc.site.id)
+                self.create_action_item(
+                    site=enrol_vacc.site,
+                    subject_identifier=subject_identifier,
+                    query_name=query.query_name,
+                    assign=assign,
+                    status=OPEN,
+                    subject=subject,
+                    comment=comment % {
+                        'visits': ', '.join(pcr_visits), })
 
-    @property
+    @cached_property
     def vaccinations(self):
-        vaccinations = self.vaccination_details_cls.objects.filter(
-            received_dose=YES, site=self.site_id).values_list(
-            'subject_visit__subject_identifier', flat=True).distinct()
-        return [vacc for vacc in vaccinations]
+        """
+        Return the set of vaccinated participants in scope.
+        """
+        return set(self.enrol_visits)
 
     def enrol_visit(self, subject_identifier=None):
-        return self.subject_visit_cls.objects.filter(
-            subject_identifier=subject_identifier).earliest('report_datetime')
+        return self.enrol_visits.get(subject_identifier)
 
     @property
     def get_reactogenicities(self):
-        csvreader = csv.reader(open(
-            f'{settings.BASE_DIR}/esr21/static/esr21_reports/reactogenicity/ae_reactogenicity.csv'))
-        rows = []
-        for row in csvreader:
-            rows.append(row[0])
-        return rows
+        return exclusion_lists.get('ae_reactogenicity').subject_identifiers
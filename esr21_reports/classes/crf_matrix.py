@@ -0,0 +1,96 @@
+from collections import Counter, namedtuple
+
+from django.apps import apps as django_apps
+from django.utils.functional import cached_property
+from edc_metadata.constants import REQUIRED
+
+
+MissingCrf = namedtuple(
+    'MissingCrf',
+    'subject_visit_id subject_identifier visit_code visit_code_sequence '
+    'schedule_name model site_id')
+
+
+class CrfMatrix:
+    """
+    Expected (REQUIRED CRF metadata) vs present CRFs for a set of subject
+    visits.
+
+    The REQUIRED metadata is loaded once and grouped by CRF model, then the
+    present subject_visit ids are fetched with one query per model class, the
+    missing (visit, model) pairs being the set difference.
+    """
+
+    crf_metadata_model = 'edc_metadata.crfmetadata'
+
+    def __init__(self, visits=None):
+        self.visits = visits
+
+    @property
+    def crf_metadata_cls(self):
+        return django_apps.get_model(self.crf_metadata_model)
+
+    @cached_property
+    def visit_ids(self):
+        """
+        Return a dict of subject visit ids keyed by (subject_identifier,
+        visit_code, visit_code_sequence).
+        """
+        visits = self.visits.values_list(
+            'id', 'subject_identifier', 'visit_code', 'visit_code_sequence')
+        return {(subject_identifier, visit_code, visit_code_sequence): visit_id
+                for visit_id, subject_identifier, visit_code, visit_code_sequence
+                in visits}
+
+    @cached_property
+    def expected(self):
+        """
+        Return the REQUIRED metadata as {model: {subject_visit_id: MissingCrf}}.
+        """
+        expected = {}
+        required_crfs = self.crf_metadata_cls.objects.filter(
+            entry_status=REQUIRED,
+            subject_identifier__in=self.visits.values('subject_identifier'),
+        ).values_list(
+            'subject_identifier', 'visit_code', 'visit_code_sequence',
+            'schedule_name', 'model', 'site_id')
+        for (subject_identifier, visit_code, visit_code_sequence,
+             schedule_name, model, site_id) in required_crfs:
+            visit_id = self.visit_ids.get(
+                (subject_identifier, visit_code, visit_code_sequence))
+            if visit_id:
+                expected.setdefault(model, {}).update({
+                    visit_id: MissingCrf(
+                        visit_id, subject_identifier, visit_code,
+                        visit_code_sequence, schedule_name, model, site_id)})
+        return expected
+
+    @cached_property
+    def present(self):
+        """
+        Return the captured subject_visit ids as {model: set(subject_visit_id)}.
+        """
+        present = {}
+        for model in self.expected:
+            model_cls = django_apps.get_model(model)
+            present.update({model: set(
+                model_cls.objects.filter(subject_visit__in=self.visits).values_list(
+                    'subject_visit_id', flat=True))})
+        return present
+
+    @cached_property
+    def missing(self):
+        missing = []
+        for model, expected_visits in self.expected.items():
+            missing_visit_ids = set(expected_visits) - self.present.get(model, set())
+            missing.extend(expected_visits.get(visit_id) for visit_id in missing_visit_ids)
+        return missing
+
+    def missing_by_site(self):
+        """
+        Return the number of missing forms per site id.
+        """
+        return Counter(missing_crf.site_id for missing_crf in self.missing)
+
+    def missing_by_model(self):
+        return Counter(missing_crf.model for missing_crf in self.missing)
@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Max
+from edc_base.utils import get_utcnow
+
+from ..models import DashboardGeneration, DashboardStatistics
+
+
+class DecodedStatistics:
+    """
+    Process-local, size-bounded LRU of decoded statistics keyed by
+    (generation, key), with the current generation number as its version.
+
+    Generations are never rewritten, so a decoded value stays valid for as
+    long as its generation is current. The current generation is re-checked
+    at most every `version_ttl` seconds, or right after invalidate(), e.g. on
+    publishing a generation or saving a statistics row in this process.
+    """
+
+    def __init__(self, maxsize=64, version_ttl=30):
+        self.maxsize = maxsize
+        self.version_ttl = version_ttl
+        self.lock = threading.Lock()
+        self.values = OrderedDict()
+        self.generation = None
+        self.checked = None
+
+    def current_generation(self, lookup=None):
+        """
+        Return the cached current generation, calling `lookup` for it when
+        stale.
+        """
+        with self.lock:
+            if (self.checked is not None
+                    and time.monotonic() - self.checked < self.version_ttl):
+                return self.generation
+        generation = lookup()
+        with self.lock:
+            self.generation = generation
+            self.checked = time.monotonic()
+        return generation
+
+    def get(self, generation=None, key=None, default=None):
+        with self.lock:
+            try:
+                self.values.move_to_end((generation, key))
+            except KeyError:
+                return default
+            return self.values.get((generation, key))
+
+    def set(self, generation=None, key=None, value=None):
+        with self.lock:
+            self.values[(generation, key)] = value
+            self.values.move_to_end((generation, key))
+            while len(self.values) > self.maxsize:
+                self.values.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.checked = None
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.checked = None
+
+
+decoded_statistics = DecodedStatistics()
+
+_missing = object()
+
+
+class DashboardStatisticsStore:
+    """
+    Generational store of the DashboardStatistics JSON values.
+
+    A refresh writes its keys as a new, unpublished generation, together with
+    the current generation's keys it does not overwrite (e.g. keys written
+    by other processes), and then publishes it with a single UPDATE. Readers always read the latest
+    published generation, so they never see a half-written refresh, and
+    resolve all of their keys in one query on the (generation, key) index.
+    Generations older than the last `keep` published ones are deleted.
+
+    Decoded values are kept in the process-local `decoded_statistics` LRU,
+    so repeat reads of the current generation neither query the database
+    nor decode the JSON again.
+    """
+
+    keep = 2
+    chunk_size = 500
+
+    def __init__(self, keep=None, chunk_size=None):
+        self.keep = keep or self.keep
+        self.chunk_size = chunk_size or self.chunk_size
+
+    @property
+    def published_generations(self):
+        return DashboardGeneration.objects.filter(
+            published__isnull=False).order_by('-generation')
+
+    @property
+    def current_generation(self):
+        """
+        Return the current generation number, None if none is published.
+        """
+        return self.published_generations.values_list(
+            'generation', flat=True).first()
+
+    def get_many(self, keys=None):
+        """
+        Return {key: decoded value} of the current generation.
+
+        If the cached current generation has none of the keys left, e.g. it
+        was superseded and garbage collected by another process within the
+        version TTL, the current generation is looked up again.
+        """
+        generation = decoded_statistics.current_generation(
+            lambda: self.current_generation)
+        values = self.read(generation, keys)
+        if generation is not None and keys and not values:
+            decoded_statistics.invalidate()
+            current = decoded_statistics.current_generation(
+                lambda: self.current_generation)
+            if current != generation:
+                values = self.read(current, keys)
+        return values
+
+    def read(self, generation=None, keys=None):
+        """
+        Return {key: decoded value} of the generation's keys, from the
+        decoded_statistics LRU or else the database.
+        """
+        if generation is None:
+            return {}
+        values = {}
+        for key in keys:
+            value = decoded_statistics.get(generation, key, default=_missing)
+            if value is not _missing:
+                values[key] = value
+        missing = [key for key in keys if key not in values]
+        if missing:
+            for key, value in DashboardStatistics.objects.filter(
+                    generation=generation, key__in=missing).values_list(
+                    'key', 'value'):
+                values[key] = json.loads(value)
+                decoded_statistics.set(generation, key, values[key])
+        return values
+
+    def get(self, key=None):
+        return self.get_many([key]).get(key)
+
+    def write(self, values=None):
+        """
+        Write {key: value} as a new generation, carrying forward the current
+        generation's other keys, publish it and return its number.
+        """
+        carried = DashboardStatistics.objects.filter(
+            generation=self.current_generation).exclude(
+            key__in=list(values)).values_list('key', 'value')
+        with transaction.atomic():
+            latest = DashboardGeneration.objects.aggregate(
+                latest=Max('generation')).get('latest')
+            generation = DashboardGeneration.objects.create(
+                generation=0 if latest is None else latest + 1)
+        DashboardStatistics.objects.bulk_create(
+            [DashboardStatistics(generation=generation.generation, key=key,
+                                 value=json.dumps(value, default=str))
+             for key, value in values.items()]
+            + [DashboardStatistics(generation=generation.generation, key=key,
+                                   value=value)
+               for key, value in carried],
+            batch_size=self.chunk_size)
+        self.publish(generation.generation)
+        self.collect_garbage()
+        return generation.generation
+
+    def publish(self, generation=None):
+        DashboardGeneration.objects.filter(generation=generation).update(
+            published=get_utcnow(), modified=get_utcnow())
+        decoded_statistics.invalidate()
+
+    def collect_garbage(self):
+        """
+        Delete the generations older than the last `keep` published ones,
+        including abandoned unpublished ones, and their statistics.
+        """
+        kept = list(self.published_generations.values_list(
+            'generation', flat=True)[:self.keep])
+        if len(kept) < self.keep:
+            return 0
+        with transaction.atomic():
+            DashboardStatistics.objects.filter(generation__lt=kept[-1]).delete()
+            deleted, _ = DashboardGeneration.objects.filter(
+                generation__lt=kept[-1]).delete()
+        return deleted
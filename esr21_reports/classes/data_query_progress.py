@@ -0,0 +1,59 @@
+from ..models.data_query_run import DONE, FAILED, PENDING, RUNNING, TIMED_OUT
+
+
+class DataQueryProgress:
+    """
+    Progress of a data query run, from its (rule, site) ledger entries, with
+    the action item counts aggregated per rule.
+    """
+
+    count_fields = ['created', 'updated', 'unchanged', 'closed']
+
+    def __init__(self, data_query_run=None):
+        self.data_query_run = data_query_run
+
+    @property
+    def rule_runs(self):
+        return self.data_query_run.dataqueryrulerun_set.order_by(
+            'rule_name', 'scope').values(
+            'rule_name', 'scope', 'status',
+            *[f'{field}_count' for field in self.count_fields])
+
+    def rule_status(self, statuses):
+        if statuses & {PENDING, RUNNING}:
+            return RUNNING
+        if statuses & {FAILED, TIMED_OUT}:
+            return FAILED
+        return DONE
+
+    def as_dict(self):
+        rules = {}
+        statuses = {}
+        completed = 0
+        failed = 0
+        for rule_run in self.rule_runs:
+            if rule_run.get('status') in [DONE, FAILED, TIMED_OUT]:
+                completed += 1
+            if rule_run.get('status') in [FAILED, TIMED_OUT]:
+                failed += 1
+            rule_name = rule_run.get('rule_name')
+            statuses.setdefault(rule_name, set()).add(rule_run.get('status'))
+            totals = rules.setdefault(
+                rule_name, {field: 0 for field in self.count_fields})
+            for field in self.count_fields:
+                totals[field] += rule_run.get(f'{field}_count')
+        for rule_name, totals in rules.items():
+            totals.update(status=self.rule_status(statuses.get(rule_name)))
+
+        subtasks = self.data_query_run.subtasks or len(self.rule_runs)
+        return dict(
+            run_id=str(self.data_query_run.id),
+            status=self.data_query_run.status,
+            started=self.data_query_run.started.isoformat(),
+            ended=(self.data_query_run.ended.isoformat()
+                   if self.data_query_run.ended else None),
+            subtasks=subtasks,
+            completed=completed,
+            failed=failed,
+            percent=round(100 * completed / subtasks, 1) if subtasks else 0,
+            rules=rules)
@@ -0,0 +1,218 @@
+import json
+
+from django.apps import apps as django_apps
+from django.db.models import Count, Max
+
+from .covid_related_queries import COVIDRelatedQueries
+from .hiv_status_queries import HIVStatusQueries
+from .query_generation import QueryGeneration
+
+
+class DataQueryRule:
+    """
+    A data query rule, i.e. a rule method on one of the query generation
+    classes and the models it reads from.
+    """
+
+    subject_lookups = {
+        'esr21_subject.adverseeventrecord': 'adverse_event__subject_visit__subject_identifier',
+    }
+
+    def __init__(self, name=None, queries_cls=None, input_models=None,
+                 message=None, incremental=True):
+        self.name = name
+        self.queries_cls = queries_cls
+        self.input_models = input_models or []
+        self.message = message
+        self.incremental = incremental
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name})'
+
+    def subject_lookup(self, input_model):
+        if input_model in self.subject_lookups:
+            return self.subject_lookups.get(input_model)
+        model_cls = django_apps.get_model(input_model)
+        field_names = [field.name for field in model_cls._meta.get_fields()]
+        if 'subject_identifier' in field_names:
+            return 'subject_identifier'
+        return 'subject_visit__subject_identifier'
+
+    def high_water_mark(self, fingerprint=None):
+        """
+        Return the max modified datetime across the input models.
+        """
+        fingerprint = fingerprint or self.fingerprint()
+        modified = [latest for _, latest in fingerprint.values() if latest]
+        return max(modified) if modified else None
+
+    @staticmethod
+    def model_fingerprint(input_model):
+        """
+        Return (row count, max modified) of an input model, from one aggregate
+        query. The count catches deletes the max modified does not.
+        """
+        model_cls = django_apps.get_model(input_model)
+        aggregates = model_cls.objects.aggregate(
+            count=Count('pk'), latest=Max('modified'))
+        return aggregates.get('count'), aggregates.get('latest')
+
+    def fingerprint(self):
+        return {input_model: self.model_fingerprint(input_model)
+                for input_model in self.input_models}
+
+    @staticmethod
+    def serialize_fingerprint(fingerprint):
+        return json.dumps(
+            {input_model: [count, latest.isoformat() if latest else None]
+             for input_model, (count, latest) in fingerprint.items()},
+            sort_keys=True)
+
+    def subjects(self, site_id=None):
+        """
+        Return the subject identifiers with rows in any of the input models,
+        only at `site_id` if given, for the input models that have a site.
+        """
+        subject_identifiers = set()
+        for input_model in self.input_models:
+            model_cls = django_apps.get_model(input_model)
+            queryset = model_cls.objects.all()
+            if site_id is not None and any(
+                    field.name == 'site' for field in model_cls._meta.get_fields()):
+                queryset = queryset.filter(site_id=site_id)
+            subject_identifiers.update(
+                queryset.order_by().values_list(
+                    self.subject_lookup(input_model), flat=True).distinct())
+        subject_identifiers.discard(None)
+        return subject_identifiers
+
+    def changed_subjects(self, since=None):
+        """
+        Return the subject identifiers with rows in any of the input models
+        created or modified after `since`.
+        """
+        subject_identifiers = set()
+        for input_model in self.input_models:
+            model_cls = django_apps.get_model(input_model)
+            subject_identifiers.update(
+                model_cls.objects.filter(modified__gt=since).values_list(
+                    self.subject_lookup(input_model), flat=True).distinct())
+        subject_identifiers.discard(None)
+        return subject_identifiers
+
+
+data_query_rules = [
+    DataQueryRule(
+        name='first_dose_second_dose_missing',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.vaccinationhistory'],
+        message='Generating queries for missing first dose'),
+    DataQueryRule(
+        name='ineligible_vaccinated_participant',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.screeningeligibility'],
+        message='Generating queries for vaccinated but not eligible participants'),
+    DataQueryRule(
+        name='male_child_bearing_potential',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.informedconsent',
+                      'esr21_subject.screeningeligibility'],
+        message='Generating queries for male with child bearing potential'),
+    DataQueryRule(
+        name='ae_data_issues',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.adverseeventrecord',
+                      'esr21_subject.vaccinationdetails'],
+        message='Generating queries with ae date before vaccination'),
+    DataQueryRule(
+        name='missing_enrol_forms',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.subjectvisit',
+                      'edc_metadata.crfmetadata',
+                      'edc_appointment.appointment'],
+        message='Generating queries for missing enrolment forms'),
+    DataQueryRule(
+        name='duplicate_subject_doses',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails'],
+        message='Generating queries for duplicate subject doses'),
+    DataQueryRule(
+        name='female_missing_preg',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.informedconsent',
+                      'esr21_subject.pregnancystatus'],
+        message='Generating queries for female missing pregnancy status'),
+    # AEs go stale with time rather than with data changes, always evaluate
+    # the full set.
+    DataQueryRule(
+        name='ae_not_resolved',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.adverseeventrecord'],
+        message='Generating ae stop date not resolved',
+        incremental=False),
+    DataQueryRule(
+        name='booster_dose_missing_second_dose',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.vaccinationhistory'],
+        message='Generating booster dose with missing second dose'),
+    DataQueryRule(
+        name='booster_dose_missing_vaccination_history',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.vaccinationhistory'],
+        message='Generating booster dose with missing vaccination history'),
+    DataQueryRule(
+        name='vaccination_history_vaccine_details_mismatch',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.vaccinationhistory'],
+        message='Generating Vaccination History Vaccine Details Mismatch'),
+    DataQueryRule(
+        name='duplicate_enrolment',
+        queries_cls=QueryGeneration,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.medicalhistory',
+                      'esr21_subject.demographicsdata',
+                      'esr21_subject.rapidhivtesting',
+                      'esr21_subject.covid19preventativebehaviours'],
+        message='Generating duplicate enrollment forms'),
+    DataQueryRule(
+        name='symptomaticinfections_missing',
+        queries_cls=COVIDRelatedQueries,
+        input_models=['esr21_subject.covid19results',
+                      'esr21_subject.covid19symptomaticinfections',
+                      'esr21_subject.vaccinationdetails',
+                      'esr21_subject.subjectvisit'],
+        message='Generating COVID related queries'),
+    # Subjects removed from the ae_reactogenicity exclusion list leave no
+    # row to pick them up incrementally, the rule re-checks the full set.
+    DataQueryRule(
+        name='pcr_results_missing',
+        queries_cls=COVIDRelatedQueries,
+        input_models=['esr21_subject.covid19results',
+                      'esr21_subject.covid19symptomaticinfections',
+                      'esr21_reports.exclusionlistentry'],
+        incremental=False),
+    DataQueryRule(
+        name='no_infections_symptoms_specified',
+        queries_cls=COVIDRelatedQueries,
+        input_models=['esr21_subject.covid19symptomaticinfections']),
+    DataQueryRule(
+        name='enrolment_covidsymptoms_pcr_missing',
+        queries_cls=COVIDRelatedQueries,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.screeningeligibility',
+                      'esr21_subject.covid19results']),
+    DataQueryRule(
+        name='missing_hiv_test_results',
+        queries_cls=HIVStatusQueries,
+        input_models=['esr21_subject.vaccinationdetails',
+                      'esr21_subject.subjectvisit',
+                      'esr21_subject.rapidhivtesting'],
+        message='Generating HIV related queries'),
+]
@@ -0,0 +1,415 @@
+import math
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import cached_property
+from edc_base.utils import get_utcnow
+
+from ..models import DataQueryRun, DataQueryRuleRun, DataQueryWatermark
+from ..models.data_query_run import DONE, FAILED, RUNNING, TIMED_OUT
+from .action_item_writer import ActionItemWriter
+from .data_query_rules import data_query_rules
+from .query_profiler import QueryProfiler
+
+
+class DataQueryTimeout(Exception):
+    pass
+
+
+@contextmanager
+def rule_timeout(seconds=None):
+    """
+    Raise DataQueryTimeout if the block runs for longer than `seconds`.
+    Only enforced in the main thread, where SIGALRM can be handled.
+    """
+    if not seconds or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def handler(signum, frame):
+        raise DataQueryTimeout(f'Timed out after {seconds}s')
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def set_statement_timeout(seconds=None):
+    """
+    Have the database cancel any single statement of this process that runs
+    for longer than `seconds`, which SIGALRM cannot interrupt.
+    """
+    if not seconds:
+        return
+    connection = connections['default']
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET statement_timeout = %s', [seconds * 1000])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SET SESSION max_execution_time = %s', [seconds * 1000])
+
+
+def run_rule_in_worker(rule_name=None, options=None):
+    """
+    Process pool entry point, evaluates a single rule by name.
+    """
+    set_statement_timeout(options.get('timeout'))
+    runner = DataQueryRunner(**options)
+    return runner.timed_run_rule(runner.get_rule(rule_name))
+
+
+class DataQueryRunner:
+    """
+    Evaluates the data query rules. Unless a full sweep is requested, a rule
+    only re-checks the subjects with rows created or modified in its input
+    models since the rule's last high-water mark.
+
+    With jobs > 1 the rules, which are independent of each other, run in a
+    process pool, each worker opening its own database connection.
+
+    With all_sites each rule is evaluated once across all sites instead of
+    for site_id, by default settings.SITE_ID, only.
+
+    With dry_run the rules are evaluated but neither the action items nor the
+    watermarks are written. With profile the number of SQL queries and rows
+    fetched by each rule, and its peak memory, are added to its result.
+
+    Each rule evaluates its subjects in chunks of chunk_size, recording its
+    status and the last subject identifier of each committed chunk in the
+    run ledger (DataQueryRun/DataQueryRuleRun). With resume the latest
+    unfinished run of the same rules for the scope is continued, skipping its completed rules
+    and picking up interrupted ones after their last committed chunk.
+
+    Incremental rules whose input models' fingerprints (row count, max
+    modified) match those of their last successful run are skipped.
+    """
+
+    chunk_size = 1000
+    timeout_grace = 30
+
+    def __init__(self, rules=None, full=False, jobs=1, timeout=None,
+                 all_sites=False, dry_run=False, profile=False, resume=False,
+                 chunk_size=None, run_id=None, site_id=None, stdout=None):
+        self.rules = rules or data_query_rules
+        self.full = full
+        self.all_sites = all_sites
+        self.dry_run = dry_run
+        self.profile = profile
+        self.resume = resume
+        self.chunk_size = chunk_size or self.chunk_size
+        self.run_id = run_id
+        self.site_id = site_id
+        self.model_fingerprints = {}
+        self.jobs = jobs or 1
+        self.timeout = timeout
+        self.stdout = stdout or sys.stdout
+
+    @property
+    def options(self):
+        """
+        Keyword arguments to re-create this runner in a pool worker.
+        """
+        return dict(full=self.full, timeout=self.timeout,
+                    all_sites=self.all_sites, dry_run=self.dry_run,
+                    profile=self.profile, resume=self.resume,
+                    chunk_size=self.chunk_size, run_id=self.data_query_run.id,
+                    site_id=self.site_id)
+
+    @property
+    def scope(self):
+        return 'all' if self.all_sites else str(self.site_id or settings.SITE_ID)
+
+    @property
+    def site_filter(self):
+        return {} if self.all_sites else {'site_id': self.site_id or settings.SITE_ID}
+
+    @property
+    def rule_names(self):
+        return ','.join(sorted(rule.name for rule in self.rules))
+
+    def get_rule(self, rule_name):
+        return next(rule for rule in data_query_rules if rule.name == rule_name)
+
+    @cached_property
+    def data_query_run(self):
+        """
+        Return the run ledger; with resume the latest unfinished run of the
+        same rules for the scope, otherwise a new one.
+        """
+        if self.dry_run:
+            return DataQueryRun(scope=self.scope, rule_names=self.rule_names)
+        if self.run_id:
+            return DataQueryRun.objects.get(id=self.run_id)
+        if self.resume:
+            data_query_run = DataQueryRun.objects.filter(
+                scope=self.scope, rule_names=self.rule_names).exclude(
+                status=DONE).order_by('-started').first()
+            if data_query_run:
+                self.stdout.write(
+                    f'Resuming run started {data_query_run.started}\n')
+                data_query_run.status = RUNNING
+                data_query_run.save()
+                return data_query_run
+        return DataQueryRun.objects.create(
+            scope=self.scope, rule_names=self.rule_names)
+
+    def get_rule_run(self, rule):
+        if self.dry_run:
+            return DataQueryRuleRun(
+                data_query_run=self.data_query_run, rule_name=rule.name,
+                scope=self.scope)
+        rule_run, _ = DataQueryRuleRun.objects.get_or_create(
+            data_query_run=self.data_query_run, rule_name=rule.name,
+            scope=self.scope)
+        return rule_run
+
+    def save_ledger(self, obj):
+        if not self.dry_run:
+            obj.save()
+
+    def run(self):
+        data_query_run = self.data_query_run
+        if self.jobs > 1:
+            results = self.run_parallel()
+        else:
+            results = {rule.name: self.timed_run_rule(rule) for rule in self.rules}
+        failed = any(result.get('status') != DONE for result in results.values())
+        data_query_run.status = FAILED if failed else DONE
+        data_query_run.ended = get_utcnow()
+        self.save_ledger(data_query_run)
+        self.write_summary(results)
+        return results
+
+    def run_parallel(self):
+        """
+        Evaluate the rules in a process pool. With a timeout, the rules still
+        without a result once every worker could have run its share of the
+        rules back to back are timed out and their workers terminated.
+        """
+        results = {}
+        deadline = None
+        if self.timeout:
+            deadline = time.monotonic() + self.timeout_grace + (
+                self.timeout * math.ceil(len(self.rules) / self.jobs))
+        # Forked workers must not share the parent's connections.
+        connections.close_all()
+        pool = multiprocessing.get_context('fork').Pool(processes=self.jobs)
+        try:
+            async_results = {
+                rule.name: pool.apply_async(
+                    run_rule_in_worker,
+                    kwds=dict(rule_name=rule.name, options=self.options))
+                for rule in self.rules}
+            for rule_name, async_result in async_results.items():
+                timeout = (None if deadline is None
+                           else max(0, deadline - time.monotonic()))
+                try:
+                    result = async_result.get(timeout=timeout)
+                except multiprocessing.TimeoutError:
+                    result = dict(status=TIMED_OUT, seconds=None,
+                                  error=f'No result after {self.timeout}s')
+                    try:
+                        rule_run = self.get_rule_run(self.get_rule(rule_name))
+                        rule_run.status = TIMED_OUT
+                        rule_run.error = result.get('error')
+                        self.save_ledger(rule_run)
+                    except Exception as e:
+                        result.update(error=f'{result.get("error")}; {e}')
+                except Exception as e:
+                    result = dict(status='failed', error=str(e), seconds=None)
+                results.update({rule_name: result})
+        finally:
+            # Also stops the workers of the timed out rules.
+            pool.terminate()
+            pool.join()
+        return {rule.name: results.get(rule.name) for rule in self.rules}
+
+    def timed_run_rule(self, rule):
+        """
+        Evaluate the rule and return its result, never raising, so that a
+        Celery chord's callback always runs.
+        """
+        start = time.monotonic()
+        try:
+            rule_run = self.get_rule_run(rule)
+        except Exception as e:
+            return dict(status='failed', error=str(e),
+                        seconds=round(time.monotonic() - start, 2))
+        if rule_run.status == DONE:
+            return dict(status='done', seconds=None, resumed=True,
+                        **rule_run.counts)
+        if rule.message:
+            self.stdout.write(f'{rule.message}\n')
+        result = dict(status='done')
+        profiler = QueryProfiler()
+        try:
+            with rule_timeout(self.timeout):
+                if self.profile:
+                    with profiler.profile():
+                        result.update(self.run_rule(rule, rule_run))
+                else:
+                    result.update(self.run_rule(rule, rule_run))
+        except DataQueryTimeout as e:
+            result.update(status='timed out', error=str(e))
+        except Exception as e:
+            result.update(status='failed', error=str(e))
+        if result.get('status') != DONE:
+            rule_run.status = result.get('status')
+            rule_run.error = result.get('error')
+            try:
+                self.save_ledger(rule_run)
+            except Exception as e:
+                result.update(error=f'{result.get("error")}; {e}')
+            result.update(rule_run.counts)
+        result.update(seconds=round(time.monotonic() - start, 2))
+        if self.profile:
+            result.update(profiler.stats)
+        return result
+
+    def subjects_in_scope(self, rule, watermark=None):
+        """
+        Return the subject identifiers to re-check, None for all subjects.
+        """
+        if self.full or not rule.incremental or not watermark.watermark:
+            return None
+        return rule.changed_subjects(since=watermark.watermark)
+
+    def get_watermark(self, rule):
+        if self.dry_run:
+            return (DataQueryWatermark.objects.filter(
+                rule_name=rule.name, scope=self.scope).first()
+                or DataQueryWatermark(rule_name=rule.name, scope=self.scope))
+        watermark, _ = DataQueryWatermark.objects.get_or_create(
+            rule_name=rule.name, scope=self.scope)
+        return watermark
+
+    def fingerprint(self, rule):
+        """
+        Return the rule's input model fingerprints, each model being
+        fingerprinted once per run however many rules read it.
+        """
+        fingerprint = {}
+        for input_model in rule.input_models:
+            if input_model not in self.model_fingerprints:
+                self.model_fingerprints.update(
+                    {input_model: rule.model_fingerprint(input_model)})
+            fingerprint.update({input_model: self.model_fingerprints.get(input_model)})
+        return fingerprint
+
+    def unchanged(self, rule, watermark=None, fingerprint=None):
+        """
+        Return True if none of the rule's input models changed since its last
+        successful run. Non-incremental rules are never skipped.
+        """
+        return (not self.full and rule.incremental
+                and watermark.fingerprint is not None
+                and watermark.fingerprint == fingerprint)
+
+    def run_rule(self, rule, rule_run=None):
+        """
+        Evaluate the rule chunk by chunk, after the ledger's cursor if the rule
+        was interrupted, and return the action item counts.
+        """
+        rule_run = rule_run or self.get_rule_run(rule)
+        watermark = self.get_watermark(rule)
+        if not rule_run.chunks:
+            # Fixed when the rule starts so that a resumed rule does not skip
+            # changes made while it was interrupted.
+            fingerprint = self.fingerprint(rule)
+            rule_run.fingerprint = rule.serialize_fingerprint(fingerprint)
+            rule_run.high_water_mark = rule.high_water_mark(fingerprint)
+            if self.unchanged(rule, watermark, rule_run.fingerprint):
+                rule_run.status = DONE
+                self.save_ledger(rule_run)
+                return dict(skipped=True, **rule_run.counts)
+        rule_run.status = RUNNING
+        self.save_ledger(rule_run)
+
+        subject_identifiers = self.subjects_in_scope(rule, watermark=watermark)
+        full_sweep = subject_identifiers is None
+        if full_sweep:
+            subject_identifiers = rule.subjects(site_id=self.site_filter.get('site_id'))
+        subject_identifiers = sorted(subject_identifiers)
+        pending = subject_identifiers
+        if rule_run.cursor:
+            pending = [
+                subject_identifier for subject_identifier in subject_identifiers
+                if subject_identifier > rule_run.cursor]
+
+        action_item_writer = ActionItemWriter(dry_run=self.dry_run)
+        # An empty chunk still registers the rule's query names, so that a
+        # full sweep of a rule without subjects closes its stale items.
+        chunks = [pending[index:index + self.chunk_size]
+                  for index in range(0, len(pending), self.chunk_size)] or [[]]
+        for chunk in chunks:
+            queries = rule.queries_cls(
+                action_item_writer=action_item_writer,
+                subject_identifiers=set(chunk),
+                all_sites=self.all_sites,
+                site_id=self.site_id)
+            rule_run.add_counts(queries.run_rule(rule.name))
+            if chunk:
+                rule_run.cursor = chunk[-1]
+                rule_run.chunks += 1
+            self.save_ledger(rule_run)
+
+        if full_sweep:
+            # Items of subjects that are no longer in the rule's input models
+            # are outside every chunk.
+            rule_run.add_counts(dict(closed=action_item_writer.close_unevaluated(
+                subject_identifiers=subject_identifiers,
+                site_id=self.site_filter.get('site_id'))))
+            self.save_ledger(rule_run)
+
+        if not self.dry_run:
+            watermark.watermark = rule_run.high_water_mark
+            watermark.fingerprint = rule_run.fingerprint
+            watermark.save()
+        rule_run.status = DONE
+        self.save_ledger(rule_run)
+        return rule_run.counts
+
+    def report(self, results):
+        """
+        Return the run's results as a JSON serializable dict.
+        """
+        return dict(
+            run_id=str(self.data_query_run.id) if self.data_query_run.id else None,
+            scope=self.scope,
+            full=self.full,
+            dry_run=self.dry_run,
+            jobs=self.jobs,
+            seconds=round(sum(result.get('seconds') or 0
+                              for result in results.values()), 2),
+            rules=results)
+
+    def write_summary(self, results):
+        columns = ['created', 'updated', 'unchanged', 'closed']
+        if self.profile:
+            columns += ['queries', 'rows', 'peak_mb', 'max_rss_mb']
+        width = max(len(name) for name in results) if results else 0
+        self.stdout.write(
+            f'{"Rule":<{width}}  {"Status":<10}  {"Seconds":>8}  '
+            + '  '.join(f'{column:>10}' for column in columns) + '\n')
+        for name, result in results.items():
+            seconds = result.get('seconds')
+            seconds = '' if seconds is None else f'{seconds:.2f}'
+            counts = '  '.join(
+                f'{"" if result.get(column) is None else result.get(column):>10}'
+                for column in columns)
+            status = 'skipped' if result.get('skipped') else result.get('status')
+            self.stdout.write(
+                f'{name:<{width}}  {status:<10}  {seconds:>8}  '
+                f'{counts}\n')
+            if result.get('error'):
+                self.stdout.write(f'    {result.get("error")}\n')
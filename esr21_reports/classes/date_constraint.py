@@ -0,0 +1,115 @@
+from django.apps import apps as django_apps
+from django.db.models import DateField, F, OuterRef, Q, Subquery, Value
+
+
+class DateConstraint:
+    """
+    A declarative date ordering constraint on a model's date field, checked
+    against either a fixed date or the date of the same subject's rows in a
+    reference model, e.g. AE start_date >= first dose vaccination_date:
+
+        DateConstraint(
+            model='esr21_subject.adverseeventrecord',
+            date_field='start_date',
+            operator='gte',
+            subject_lookup='adverse_event__subject_visit__subject_identifier',
+            visit_lookup='adverse_event__subject_visit',
+            reference_model='esr21_subject.vaccinationdetails',
+            reference_date_field='vaccination_date__date',
+            reference_filter={'received_dose_before': 'first_dose'})
+
+    The constraint compiles into a single query, the reference date being a
+    correlated Subquery annotation, that returns the violating rows.
+    """
+
+    violations_lookups = {
+        'gt': 'lte',
+        'gte': 'lt',
+        'lt': 'gte',
+        'lte': 'gt',
+    }
+    iterator_chunk_size = 2000
+
+    def __init__(self, model=None, date_field=None, operator=None,
+                 subject_lookup='subject_visit__subject_identifier',
+                 visit_lookup='subject_visit', reference_model=None,
+                 reference_date_field=None, reference_filter=None,
+                 reference_subject_lookup='subject_visit__subject_identifier',
+                 reference_date=None, filter_q=None):
+        if operator not in self.violations_lookups:
+            raise ValueError(
+                f'Invalid operator, expected one of '
+                f'{list(self.violations_lookups)}. Got {operator}.')
+        self.model = model
+        self.date_field = date_field
+        self.operator = operator
+        self.subject_lookup = subject_lookup
+        self.visit_lookup = visit_lookup
+        self.reference_model = reference_model
+        self.reference_date_field = reference_date_field
+        self.reference_filter = reference_filter or {}
+        self.reference_subject_lookup = reference_subject_lookup
+        self.reference_date = reference_date
+        self.filter_q = filter_q or Q()
+
+    @property
+    def model_cls(self):
+        return django_apps.get_model(self.model)
+
+    @property
+    def reference_model_cls(self):
+        return django_apps.get_model(self.reference_model)
+
+    @property
+    def reference_expression(self):
+        """
+        Return the expression for the date to compare against. For a lower
+        bound (gt/gte) the latest reference date is the binding one, for an
+        upper bound (lt/lte) the earliest.
+        """
+        if not self.reference_model:
+            return Value(self.reference_date, output_field=DateField())
+        # Order on the underlying field, e.g. vaccination_date rather than the
+        # vaccination_date__date transform.
+        ordering = self.reference_date_field
+        if ordering.endswith('__date'):
+            ordering = ordering[:-len('__date')]
+        if self.operator in ['gt', 'gte']:
+            ordering = f'-{ordering}'
+        references = self.reference_model_cls.objects.filter(
+            **{self.reference_subject_lookup: OuterRef(self.subject_lookup)},
+            **self.reference_filter).order_by(ordering).values(
+            self.reference_date_field)[:1]
+        return Subquery(references, output_field=DateField())
+
+    def violations(self, queryset=None):
+        """
+        Return the rows of `queryset`, by default all the model's rows,
+        that violate the constraint.
+        """
+        if queryset is None:
+            queryset = self.model_cls.objects.all()
+        violation_lookup = self.violations_lookups.get(self.operator)
+        return queryset.filter(self.filter_q).annotate(
+            reference_date=self.reference_expression).filter(
+            **{f'{self.date_field}__{violation_lookup}': F('reference_date')})
+
+    def violations_by_subject(self, queryset=None):
+        """
+        Return {subject_identifier: {'site_id': ..., 'visits': [...]}} for the
+        violating rows, visits formatted as `visit_code.visit_code_sequence`.
+        """
+        grouped = {}
+        violations = self.violations(queryset=queryset).order_by(
+            self.subject_lookup, f'{self.visit_lookup}__visit_code',
+            f'{self.visit_lookup}__visit_code_sequence').values_list(
+            self.subject_lookup, f'{self.visit_lookup}__visit_code',
+            f'{self.visit_lookup}__visit_code_sequence', 'site_id').iterator(
+            chunk_size=self.iterator_chunk_size)
+        for subject_identifier, visit_code, visit_code_sequence, site_id in violations:
+            subject = grouped.setdefault(
+                subject_identifier, dict(site_id=site_id, visits=[]))
+            visit = f'{visit_code}.{visit_code_sequence}'
+            if visit not in subject.get('visits'):
+                subject.get('visits').append(visit)
+        return grouped
@@ -0,0 +1,34 @@
+from django.db.models import Count, Q
+
+
+class DuplicateDetector:
+    """
+    Finds the groups of rows of a model sharing the same values for the
+    grouping fields with one aggregate (GROUP BY ... HAVING COUNT > 1) query.
+
+    e.g. DuplicateDetector(
+            model_cls=VaccinationDetails,
+            group_by=['subject_visit__subject_identifier', 'received_dose_before'],
+            filter_q=Q(received_dose=YES)).groups
+    """
+
+    def __init__(self, model_cls=None, group_by=None, filter_q=None,
+                 aggregates=None):
+        self.model_cls = model_cls
+        self.group_by = group_by or []
+        self.filter_q = filter_q or Q()
+        self.aggregates = aggregates or {}
+
+    @property
+    def queryset(self):
+        return self.model_cls.objects.filter(self.filter_q).order_by().values(
+            *self.group_by).annotate(
+            duplicates=Count('pk'), **self.aggregates).filter(duplicates__gt=1)
+
+    @property
+    def groups(self):
+        """
+        Return a list of dicts of the grouping values, the number of rows in
+        the group and any extra aggregates.
+        """
+        return list(self.queryset)
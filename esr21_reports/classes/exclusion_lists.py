@@ -0,0 +1,116 @@
+import csv
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from ..models import ExclusionListEntry
+
+
+class ExclusionList:
+    """
+    A CSV of subject identifiers (first column) excluded from a data query
+    rule.
+
+    The file is parsed once per process and only re-parsed when its mtime
+    changes. The ExclusionListEntry staging table is brought in line with it
+    the first time excluded() is used after a change, except for dry runs,
+    which write nothing and match the parsed file directly.
+    """
+
+    def __init__(self, name=None, path=None):
+        self.name = name
+        self.path = path
+        self.mtime = None
+        self.staged_mtime = None
+        self._subject_identifiers = frozenset()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name})'
+
+    @property
+    def file_path(self):
+        return os.path.join(settings.BASE_DIR, self.path)
+
+    @property
+    def subject_identifiers(self):
+        """
+        Return the excluded subject identifiers as a frozenset.
+        """
+        return self.load(stage=False)
+
+    def load(self, stage=True):
+        """
+        Re-parse the file, and with stage re-stage it, if its mtime changed
+        since the last load (or staging) in this process.
+        """
+        mtime = os.path.getmtime(self.file_path)
+        if mtime != self.mtime or (stage and mtime != self.staged_mtime):
+            with self._lock:
+                if mtime != self.mtime:
+                    self._subject_identifiers = self.read()
+                    self.mtime = mtime
+                if stage and mtime != self.staged_mtime:
+                    self.stage(self._subject_identifiers)
+                    self.staged_mtime = mtime
+        return self._subject_identifiers
+
+    def read(self):
+        with open(self.file_path, newline='') as f:
+            return frozenset(
+                row[0].strip() for row in csv.reader(f) if row and row[0].strip())
+
+    def stage(self, subject_identifiers):
+        """
+        Add the new and delete the removed identifiers in the staging table.
+        """
+        with transaction.atomic():
+            staged = set(ExclusionListEntry.objects.filter(
+                list_name=self.name).values_list('subject_identifier', flat=True))
+            ExclusionListEntry.objects.filter(
+                list_name=self.name,
+                subject_identifier__in=staged - subject_identifiers).delete()
+            ExclusionListEntry.objects.bulk_create(
+                [ExclusionListEntry(list_name=self.name,
+                                    subject_identifier=subject_identifier)
+                 for subject_identifier in subject_identifiers - staged],
+                batch_size=500, ignore_conflicts=True)
+
+    def excluded(self, subject_lookup='subject_visit__subject_identifier',
+                 dry_run=False):
+        """
+        Return an Exists expression, true for the rows whose subject is on
+        the list, e.g. queryset.exclude(exclusion_list.excluded()).
+
+        With dry_run the staging table is left as is and a Q on the parsed
+        identifiers is returned instead.
+        """
+        subject_identifiers = self.load(stage=not dry_run)
+        if dry_run:
+            return Q(**{f'{subject_lookup}__in': subject_identifiers})
+        return Exists(ExclusionListEntry.objects.filter(
+            list_name=self.name, subject_identifier=OuterRef(subject_lookup)))
+
+
+class ExclusionLists:
+
+    def __init__(self):
+        self.registry = {}
+
+    def register(self, exclusion_list):
+        self.registry.update({exclusion_list.name: exclusion_list})
+
+    def get(self, name):
+        return self.registry.get(name)
+
+
+exclusion_lists = ExclusionLists()
+exclusion_lists.register(ExclusionList(
+    name='ae_not_resolved',
+    path='esr21/static/esr21_reports/adverse_events/ae_not_resolved.csv'))
+exclusion_lists.register(ExclusionList(
+    name='ae_reactogenicity',
+    path='esr21/static/esr21_reports/reactogenicity/ae_reactogenicity.csv'))
@@ -0,0 +1,834 @@
+import json
+import statistics
+from collections import Counter, namedtuple
+from datetime import date, datetime
+
+import numpy as np
+from django.apps import apps as django_apps
+from django.contrib.sites.models import Site
+from django.db import transaction
+from django.utils.functional import cached_property
+from edc_base.utils import get_utcnow
+from dateutil.relativedelta import relativedelta
+from edc_constants.constants import FEMALE, IND, MALE, NEG, NO, POS, YES
+
+from .dashboard_statistics_store import DashboardStatisticsStore
+
+HOMOLOGOUS = 'homologous'
+HETEROLOGOUS = 'heterologous'
+
+PRODUCT_NAME = 'azd_1222'
+
+
+def history_series(history=None):
+    """
+    Return HOMOLOGOUS if the vaccination history, a (dose_quantity,
+    dose1_product_name, dose2_product_name, dose3_product_name) tuple, only
+    has AZD1222 doses, HETEROLOGOUS if not, None without a history.
+    """
+    if not history:
+        return None
+    dose_quantity, *products = history
+    dose_quantity = str(dose_quantity)
+    if dose_quantity in ['1', '2', '3'] and all(
+            product == PRODUCT_NAME for product in products[:int(dose_quantity)]):
+        return HOMOLOGOUS
+    return HETEROLOGOUS
+
+
+GRADES = ['mild', 'moderate', 'severe', 'life_threatening', 'fatal']
+
+AeRecord = namedtuple(
+    'AeRecord',
+    'subject_identifier site_id soc_name pt_name hlt_name ctcae_grade ae_rel')
+
+
+def grade_counts(records=None, counted=None):
+    """
+    Return the number of `counted` records and the number of records per
+    CTCAE grade.
+    """
+    counts = dict(total=sum(1 for record in records if counted(record)))
+    for grade in GRADES:
+        counts[grade] = sum(1 for record in records if record.ctcae_grade == grade)
+    return counts
+
+
+def soc_statistics(records=None, term='pt', counted=None, ignore_case=False):
+    """
+    Return the grade counts per system organ class of the AE records, each
+    with the grade counts per `term` (pt or hlt) of the class under `term`,
+    in the shape of the AE report tables. Classes differing only by case are
+    listed once with ignore_case.
+    """
+    socs = {}
+    terms = {}
+    for record in records:
+        socs.setdefault(record.soc_name, []).append(record)
+        terms.setdefault(
+            (record.soc_name, getattr(record, f'{term}_name')), []).append(record)
+    soc_stats = {
+        soc_name: dict(soc_name=soc_name, **grade_counts(
+            soc_records, lambda record: record.soc_name is not None))
+        for soc_name, soc_records in socs.items()}
+    overall = []
+    listed = set()
+    for (soc_name, term_name), term_records in sorted(
+            terms.items(), key=lambda item: (str(item[0][0]), str(item[0][1]))):
+        stats = soc_stats.get(soc_name)
+        stats.setdefault(term, []).append(
+            {f'{term}_name': term_name, **grade_counts(term_records, counted)})
+        key = soc_name.lower() if ignore_case and soc_name else soc_name
+        if key not in listed:
+            overall.append(stats)
+            listed.add(key)
+    return overall
+
+
+class GraphMaterializer:
+    """
+    Materializes the report snapshot models and the DashboardStatistics keys,
+    the latter published as a new generation of the DashboardStatisticsStore.
+
+    Each source table is loaded once, as plain tuples, and every snapshot row
+    is computed in memory from that load. The rows are then upserted with one
+    lookup of the existing rows and bulk_create/bulk_update, keyed on the
+    model's natural key (site_series or site); rows for keys no longer
+    produced are deleted.
+
+    The AE, SAE and demographics DashboardStatistics keys reproduce the
+    `*_statistics` properties of the view mixins that render them, from the
+    same load.
+    """
+
+    vaccination_details_model = 'esr21_subject.vaccinationdetails'
+    vaccination_history_model = 'esr21_subject.vaccinationhistory'
+    informed_consent_model = 'esr21_subject.informedconsent'
+    screening_eligibility_model = 'esr21_subject.screeningeligibility'
+    onschedule_model = 'esr21_subject.onschedule'
+    rapid_hiv_testing_model = 'esr21_subject.rapidhivtesting'
+    pregnancy_test_model = 'esr21_subject.pregnancytest'
+    pregnancy_outcome_model = 'esr21_subject.pregoutcome'
+    covid19_results_model = 'esr21_subject.covid19results'
+    medical_history_model = 'esr21_subject.medicalhistory'
+    ae_record_model = 'esr21_subject.adverseeventrecord'
+    sae_record_model = 'esr21_subject.seriousadverseeventrecord'
+    aesi_record_model = 'esr21_subject.specialinterestadverseeventrecord'
+    aesi_model = 'esr21_subject.specialinterestadverseevent'
+    demographics_data_model = 'esr21_subject.demographicsdata'
+
+    products = ['sinovac', 'pfizer', 'moderna', 'janssen', 'astrazeneca']
+
+    chunk_size = 500
+
+    def __init__(self, chunk_size=None, dry_run=False):
+        self.chunk_size = chunk_size or self.chunk_size
+        self.dry_run = dry_run
+
+    def get_model_cls(self, model):
+        return django_apps.get_model(model)
+
+    def values_list(self, model, *fields, flat=False, **filters):
+        return self.get_model_cls(model).objects.filter(
+            **filters).order_by().values_list(*fields, flat=flat)
+
+    @cached_property
+    def sites(self):
+        """
+        Return [(site_id, site name)] ordered by site id, the site name
+        without its country prefix.
+        """
+        return [(site_id, name.split('-')[1])
+                for site_id, name in Site.objects.order_by('id').values_list(
+                    'id', 'name')]
+
+    # Source tables, each loaded once.
+
+    @cached_property
+    def vaccinations(self):
+        """
+        Return [(subject_identifier, received_dose, received_dose_before,
+        vaccination_date, site_id, schedule_name)].
+        """
+        return list(self.values_list(
+            self.vaccination_details_model,
+            'subject_visit__subject_identifier', 'received_dose',
+            'received_dose_before', 'vaccination_date', 'site_id',
+            'subject_visit__schedule_name'))
+
+    @cached_property
+    def histories(self):
+        """
+        Return {subject_identifier: (dose_quantity, dose1_product_name,
+        dose2_product_name, dose3_product_name)}, the latest history winning.
+        """
+        histories = self.values_list(
+            self.vaccination_history_model, 'subject_identifier',
+            'dose_quantity', 'dose1_product_name', 'dose2_product_name',
+            'dose3_product_name').order_by('created')
+        return {history[0]: history[1:] for history in histories}
+
+    @cached_property
+    def consents(self):
+        """
+        Return {subject_identifier: (gender, dob)}.
+        """
+        return {subject_identifier: (gender, dob)
+                for subject_identifier, gender, dob in self.values_list(
+                    self.informed_consent_model, 'subject_identifier',
+                    'gender', 'dob')}
+
+    @cached_property
+    def screenings(self):
+        return list(self.values_list(
+            self.screening_eligibility_model, 'subject_identifier', 'site_id'))
+
+    @cached_property
+    def onschedules(self):
+        """
+        Return {subject_identifier: {schedule_name, ...}}.
+        """
+        onschedules = {}
+        for subject_identifier, schedule_name in self.values_list(
+                self.onschedule_model, 'subject_identifier', 'schedule_name'):
+            onschedules.setdefault(subject_identifier, set()).add(schedule_name)
+        return onschedules
+
+    @cached_property
+    def consent_sites(self):
+        return dict(self.values_list(
+            self.informed_consent_model, 'subject_identifier', 'site_id'))
+
+    @cached_property
+    def hiv_tests(self):
+        """
+        Return [(subject_identifier, site_id, hiv_result, rapid_test_result)].
+        """
+        return list(self.values_list(
+            self.rapid_hiv_testing_model, 'subject_visit__subject_identifier',
+            'site_id', 'hiv_result', 'rapid_test_result'))
+
+    @cached_property
+    def hiv_results(self):
+        """
+        Return {subject_identifier: {hiv_result, rapid_test_result, ...}}.
+        """
+        hiv_results = {}
+        for subject_identifier, _, hiv_result, rapid_test_result in self.hiv_tests:
+            hiv_results.setdefault(subject_identifier, set()).update(
+                [hiv_result, rapid_test_result])
+        return hiv_results
+
+    @cached_property
+    def demographics_data(self):
+        """
+        Return [(subject_identifier, site_id, ethnicity, ethnicity_other)].
+        """
+        return list(self.values_list(
+            self.demographics_data_model, 'subject_visit__subject_identifier',
+            'site_id', 'ethnicity', 'ethnicity_other'))
+
+    @cached_property
+    def pregnancies(self):
+        """
+        Return [(subject_identifier, site_id)] of the positive pregnancy tests.
+        """
+        return list(self.values_list(
+            self.pregnancy_test_model, 'subject_visit__subject_identifier',
+            'site_id', result=POS))
+
+    @cached_property
+    def pregnancy_outcomes(self):
+        return list(self.values_list(
+            self.pregnancy_outcome_model, 'subject_visit__subject_identifier',
+            'site_id'))
+
+    @cached_property
+    def covid_positives(self):
+        return list(self.values_list(
+            self.covid19_results_model, 'subject_visit__subject_identifier',
+            'site_id', covid_result=POS))
+
+    @cached_property
+    def diabetes(self):
+        return Counter(self.values_list(
+            self.medical_history_model, 'subject_visit__subject_identifier',
+            flat=True, diabetes=YES))
+
+    def record_counts(self, model, subject_lookup):
+        return Counter(self.values_list(model, subject_lookup, flat=True))
+
+    @cached_property
+    def adverse_events(self):
+        """
+        Return the AE, SAE and AESI record counts as three
+        {subject_identifier: count} Counters.
+        """
+        return (
+            self.record_counts(
+                self.ae_record_model,
+                'adverse_event__subject_visit__subject_identifier'),
+            self.record_counts(
+                self.sae_record_model,
+                'serious_adverse_event__subject_visit__subject_identifier'),
+            self.record_counts(
+                self.aesi_record_model,
+                'special_interest_adverse_event__subject_visit__subject_identifier'))
+
+    @cached_property
+    def ae_records(self):
+        return [AeRecord(*record) for record in self.values_list(
+            self.ae_record_model,
+            'adverse_event__subject_visit__subject_identifier', 'site_id',
+            'soc_name', 'pt_name', 'hlt_name', 'ctcae_grade', 'ae_rel')]
+
+    @cached_property
+    def sae_records(self):
+        """
+        Return [(subject_identifier, site_id)] of the SAE records.
+        """
+        return list(self.values_list(
+            self.sae_record_model,
+            'serious_adverse_event__subject_visit__subject_identifier', 'site_id'))
+
+    @cached_property
+    def aesis(self):
+        """
+        Return [(subject_identifier, site_id)] of the AESI reports.
+        """
+        return list(self.values_list(
+            self.aesi_model, 'subject_visit__subject_identifier', 'site_id'))
+
+    # Derived indexes.
+
+    @cached_property
+    def doses(self):
+        """
+        Return {subject_identifier: {received_dose_before: (vaccination_date,
+        site_id)}} of the doses received, the earliest of each dose winning.
+        """
+        doses = {}
+        for (subject_identifier, received_dose, received_dose_before,
+             vaccination_date, site_id, _) in sorted(
+                self.vaccinations, key=lambda v: (v[3] is None, v[3] or 0)):
+            if received_dose != YES:
+                continue
+            doses.setdefault(subject_identifier, {}).setdefault(
+                received_dose_before, (vaccination_date, site_id))
+        return doses
+
+    @cached_property
+    def enrolments(self):
+        """
+        Return {subject_identifier: (vaccination_date, site_id)} of each
+        vaccinated participant's first vaccination in the study.
+        """
+        enrolments = {}
+        for subject_identifier, doses in self.doses.items():
+            enrolments[subject_identifier] = min(
+                doses.values(), key=lambda d: (d[0] is None, d[0] or 0))
+        return enrolments
+
+    @cached_property
+    def vaccination_schedules(self):
+        schedules = {}
+        for subject_identifier, *_, schedule_name in self.vaccinations:
+            schedules.setdefault(subject_identifier, set()).add(schedule_name)
+        return schedules
+
+    def series(self, subject_identifier=None):
+        return history_series(self.histories.get(subject_identifier))
+
+    def elsewhere(self, subject_identifier=None):
+        """
+        Return the dose the participant was enrolled for after receiving
+        other products elsewhere, 'second_dose' or 'booster_dose', or None.
+        """
+        history = self.histories.get(subject_identifier)
+        if not history:
+            return None
+        dose_quantity, dose1, dose2, _ = history
+        dose_quantity = str(dose_quantity)
+        if dose_quantity == '1' and dose1 != PRODUCT_NAME:
+            return 'second_dose'
+        if dose_quantity == '2' and PRODUCT_NAME not in [dose1, dose2]:
+            return 'booster_dose'
+        return None
+
+    def per_site(self, counter=None):
+        """
+        Return [total, *per site count] of a {site_id: count} Counter.
+        """
+        totals = [counter.get(site_id, 0) for site_id, _ in self.sites]
+        return [sum(totals), *totals]
+
+    def subject_site_counts(self, rows=None, subjects=None, distinct=True):
+        """
+        Return {site_id: count} of (subject_identifier, site_id) rows,
+        optionally restricted to `subjects`.
+        """
+        if distinct:
+            rows = set(rows)
+        return Counter(site_id for subject_identifier, site_id in rows
+                       if subjects is None or subject_identifier in subjects)
+
+    @staticmethod
+    def month(vaccination_date=None):
+        return vaccination_date.strftime('%B %Y')
+
+    @staticmethod
+    def months(counter=None):
+        return json.dumps(dict(sorted(
+            counter.items(), key=lambda m: datetime.strptime(m[0], '%B %Y'))))
+
+    # Snapshot rows.
+
+    def screening_statistics(self):
+        screenings = Counter(
+            (site_id, self.elsewhere(subject_identifier))
+            for subject_identifier, site_id in self.screenings)
+        rows = []
+        for site_id, site in self.sites:
+            dose2 = screenings.get((site_id, 'second_dose'), 0)
+            dose3 = screenings.get((site_id, 'booster_dose'), 0)
+            dose1 = screenings.get((site_id, None), 0)
+            rows.append(dict(site=site, dose1=dose1, dose2=dose2, dose3=dose3,
+                             totals=dose1 + dose2 + dose3))
+        return rows
+
+    @cached_property
+    def site_series_subjects(self):
+        """
+        Return {(site_id, series): {subject_identifier, ...}} of the enrolled
+        participants by site of enrolment and series.
+        """
+        subjects = {}
+        for subject_identifier, (_, site_id) in self.enrolments.items():
+            series = self.series(subject_identifier)
+            if series:
+                subjects.setdefault((site_id, series), set()).add(subject_identifier)
+        return subjects
+
+    def site_series_rows(self, row_values=None):
+        rows = []
+        subjects = self.site_series_subjects
+        for series in [HOMOLOGOUS, HETEROLOGOUS]:
+            for site_id, site in self.sites:
+                values = row_values(subjects.get((site_id, series), set()))
+                rows.append(dict(site_series=f'{site}-{series}', site=site,
+                                 series=series, **values))
+        return rows
+
+    def enrollment_values(self, subjects=None):
+        genders = Counter(self.consents.get(s, (None, None))[0] for s in subjects)
+        schedules = [self.onschedules.get(s, set()) | self.vaccination_schedules.get(s, set())
+                     for s in subjects]
+        months = Counter(self.month(self.enrolments.get(s)[0]) for s in subjects
+                         if self.enrolments.get(s)[0])
+        return dict(
+            total=len(subjects),
+            male=genders.get('M', 0),
+            female=genders.get('F', 0),
+            main_cohort=str(len([s for s in schedules if any(
+                name.startswith(('esr21_enrol', 'esr21_fu', 'esr21_boost'))
+                for name in s if name)])),
+            sub_cohort=str(len([s for s in schedules if any(
+                name.startswith('esr21_sub') for name in s if name)])),
+            months=self.months(months))
+
+    def vaccination_values(self, subjects=None):
+        doses = Counter(dose for s in subjects for dose in self.doses.get(s, {}))
+        dose_1 = doses.get('first_dose', 0)
+        dose_2 = doses.get('second_dose', 0)
+        dose_3 = doses.get('booster_dose', 0)
+        return dict(dose_1=dose_1, dose_2=dose_2, dose_3=dose_3,
+                    overall=dose_1 + dose_2 + dose_3)
+
+    def adverse_event_values(self, subjects=None):
+        aes, saes, aesis = self.adverse_events
+        ae = sum(aes.get(s, 0) for s in subjects)
+        serious_ae = sum(saes.get(s, 0) for s in subjects)
+        special_ae = sum(aesis.get(s, 0) for s in subjects)
+        return dict(ae=ae, serious_ae=serious_ae, special_ae=special_ae,
+                    total=ae + serious_ae + special_ae)
+
+    def demographics_values(self, subjects=None):
+        genders = Counter(self.consents.get(s, (None, None))[0] for s in subjects)
+        hiv_results = [self.hiv_results.get(s, set()) for s in subjects]
+        pregnant = {s for s, _ in self.pregnancies}
+        covid = {s for s, _ in self.covid_positives}
+        return dict(
+            male=genders.get('M', 0),
+            female=genders.get('F', 0),
+            hiv_pos=len([r for r in hiv_results if POS in r]),
+            hiv_neg=len([r for r in hiv_results if NEG in r]),
+            hiv_ind=len([r for r in hiv_results if IND in r]),
+            pos_preg=len(subjects & pregnant),
+            pos_covid=len(subjects & covid),
+            pos_diabetes=len([s for s in subjects if self.diabetes.get(s)]))
+
+    def enrollment_statistics(self):
+        return self.site_series_rows(self.enrollment_values)
+
+    def vaccination_statistics(self):
+        return self.site_series_rows(self.vaccination_values)
+
+    def adverse_events_statistics(self):
+        return self.site_series_rows(self.adverse_event_values)
+
+    def demographics_statistics(self):
+        return self.site_series_rows(self.demographics_values)
+
+    @staticmethod
+    def age(enrolment_date=None, dob=None):
+        return enrolment_date.year - dob.year - (
+            (enrolment_date.month, enrolment_date.day) < (dob.month, dob.day))
+
+    def age_statistics(self):
+        """
+        Return the age at first dose distribution (box plot) per site.
+        """
+        rows = []
+        first_doses = {subject_identifier: doses.get('first_dose')
+                       for subject_identifier, doses in self.doses.items()
+                       if doses.get('first_dose')}
+        for site_id, site in self.sites:
+            ages = []
+            for subject_identifier, (vaccination_date, dose_site_id) in first_doses.items():
+                dob = self.consents.get(subject_identifier, (None, None))[1]
+                if dose_site_id == site_id and dob and vaccination_date:
+                    ages.append(self.age(vaccination_date, dob))
+            if not ages:
+                continue
+            lowerquartile = np.quantile(ages, .25)
+            upperquartile = np.quantile(ages, .75)
+            iqr = upperquartile - lowerquartile
+            inliers = [age for age in ages
+                       if lowerquartile - 1.5 * iqr < age < upperquartile + 1.5 * iqr]
+            rows.append(dict(
+                site=site,
+                min=min(inliers or ages),
+                lowerquartile=round(lowerquartile),
+                median=round(statistics.median(ages)),
+                upperquartile=round(upperquartile),
+                max=max(inliers or ages),
+                outlier=len(ages) - len(inliers)))
+        return rows
+
+    def vaccination_enrollments(self):
+        """
+        Return the second and booster dose enrolments by the products received
+        elsewhere before enrolment.
+        """
+        variables = {
+            'second_dose': 'Second dose(first dose elsewhere)',
+            'booster_dose': 'Booster dose (second dose elsewhere)',
+        }
+        rows = []
+        for dose, variable in variables.items():
+            products = Counter()
+            months = Counter()
+            for subject_identifier, doses in self.doses.items():
+                if dose not in doses or self.elsewhere(subject_identifier) != dose:
+                    continue
+                dose_quantity, *history_products = self.histories.get(subject_identifier)
+                products.update(set(history_products[:int(dose_quantity)]))
+                if doses.get(dose)[0]:
+                    months.update([self.month(doses.get(dose)[0])])
+            product_totals = {product: products.get(product, 0)
+                              for product in self.products}
+            rows.append(dict(site_series=dose, variable=variable,
+                             series=HETEROLOGOUS, months=self.months(months),
+                             totals=sum(product_totals.values()),
+                             **product_totals))
+        return rows
+
+    # DashboardStatistics keys.
+
+    def dose_counts(self, dose=None, subjects=None):
+        return self.per_site(Counter(
+            doses.get(dose)[1] for subject_identifier, doses in self.doses.items()
+            if dose in doses and (subjects is None or subject_identifier in subjects)))
+
+    def enrolled_statistics(self):
+        first_dose = self.dose_counts('first_dose')
+        second_dose = self.dose_counts('second_dose', subjects={
+            s for s in self.histories if self.elsewhere(s) == 'second_dose'})
+        booster_dose = self.dose_counts('booster_dose', subjects={
+            s for s in self.histories if self.elsewhere(s) == 'booster_dose'})
+        main_cohort = self.dose_counts('first_dose', subjects={
+            s for s, schedules in self.onschedules.items()
+            if 'esr21_enrol_schedule' in schedules})
+        sub_cohort = self.per_site(Counter(
+            site_id for s, (_, site_id) in self.enrolments.items()
+            if any(name.startswith('esr21_sub')
+                   for name in self.onschedules.get(s, set()))))
+        first_dose_subjects = {s for s, doses in self.doses.items()
+                               if 'first_dose' in doses}
+        return [
+            ['Enrolled', first_dose[0] + second_dose[0] + booster_dose[0],
+             *first_dose[1:]],
+            ['Main cohort', *main_cohort],
+            ['Sub cohort', *sub_cohort],
+            ['Pregnant Enrollment', *self.per_site(self.subject_site_counts(
+                self.pregnancies, subjects=first_dose_subjects))],
+            ['COVID Positives', *self.per_site(self.subject_site_counts(
+                self.covid_positives, distinct=False))],
+            ['Second dose at enrollment', *second_dose],
+            ['Booster dose at enrollment', *booster_dose],
+        ]
+
+    def vaccinated_statistics(self):
+        return [
+            ['First dose', *self.dose_counts('first_dose')],
+            ['Second dose', *self.dose_counts('second_dose')],
+            ['Booster dose', *self.dose_counts('booster_dose')],
+        ]
+
+    def pregnancy_statistics(self):
+        first_dose_subjects = {s for s, doses in self.doses.items()
+                               if 'first_dose' in doses}
+        return [
+            ['Total Pregnancies', *self.per_site(self.subject_site_counts(
+                self.pregnancies, distinct=False))],
+            ['Total Pregnancies after 1st dose', *self.per_site(
+                self.subject_site_counts(self.pregnancies, subjects=first_dose_subjects))],
+            ['Pregnancy Outcomes', *self.per_site(self.subject_site_counts(
+                self.pregnancy_outcomes, subjects=first_dose_subjects))],
+        ]
+
+    def site_counts_by_name(self, label=None, rows=None):
+        """
+        Return [label, total, *count per site] of (subject_identifier,
+        site_id) rows for the five sites in the AE report tables' order.
+        """
+        counts = Counter(site_id for _, site_id in rows)
+        totals = []
+        for name in ['Gaborone', 'Maun', 'Serowe', 'Francistown', 'Phikwe']:
+            site_id = next((site_id for site_id, site in self.sites
+                            if site.endswith(name)), None)
+            totals.append(counts.get(site_id, 0))
+        return [label, len(rows), *totals]
+
+    def subjects_with_hiv_status(self, status=None):
+        return {subject_identifier
+                for subject_identifier, results in self.hiv_results.items()
+                if status in results}
+
+    def subjects_with_dose(self, dose=None):
+        return {subject_identifier
+                for subject_identifier, _, received_dose_before, *_ in self.vaccinations
+                if received_dose_before == dose}
+
+    def ae_statistics(self):
+        """
+        The AdverseEventRecordViewMixin.ae_statistics values.
+        """
+        records = self.ae_records
+
+        def by_subjects(subjects):
+            return soc_statistics(
+                [r for r in records if r.subject_identifier in subjects],
+                counted=lambda r: r.pt_name is not None and r.hlt_name is not None)
+
+        def by_relation(choice):
+            return soc_statistics(
+                [r for r in records if r.ae_rel == choice],
+                counted=lambda r: r.pt_name is not None and r.hlt_name is not None)
+
+        return dict(
+            ae_overall_count=self.site_counts_by_name(
+                'Adverse Events',
+                [(r.subject_identifier, r.site_id) for r in records]),
+            overral_adverse_events=soc_statistics(
+                records, ignore_case=True,
+                counted=lambda r: r.pt_name is not None and r.soc_name is not None),
+            hiv_uninfected=by_subjects(self.subjects_with_hiv_status(NEG)),
+            hiv_infected=by_subjects(self.subjects_with_hiv_status(POS)),
+            received_first_dose=by_subjects(self.subjects_with_dose('first_dose')),
+            received_second_dose=by_subjects(self.subjects_with_dose('second_dose')),
+            related_ip=by_relation(YES),
+            not_related_ip=by_relation(NO),
+            received_first_dose_plus_28=None)
+
+    def sae_statistics(self):
+        """
+        The SeriousAdverseEventRecordViewMixin.sae_statistics values, the
+        breakdowns being by high level term.
+        """
+        records = self.ae_records
+
+        def by_hlt(selected):
+            return soc_statistics(
+                selected, term='hlt', ignore_case=True,
+                counted=lambda r: r.hlt_name is not None)
+
+        def by_subjects(subjects):
+            return by_hlt([r for r in records if r.subject_identifier in subjects])
+
+        sae_subjects = {subject_identifier
+                        for subject_identifier, _ in self.sae_records}
+        return dict(
+            sae_overall_count=self.site_counts_by_name(
+                'Serious Adverse Events', self.sae_records),
+            aei_overall=self.site_counts_by_name(
+                'AE of Special Interest', self.aesis),
+            sae_received_first_dose_plus_28=None,
+            sae_received_second_dose=by_subjects(self.subjects_with_dose('second_dose')),
+            sae_related_ip=by_hlt([r for r in records if r.ae_rel == YES]),
+            sae_not_related_ip=by_hlt([r for r in records if r.ae_rel == NO]),
+            sae_hiv_infected=by_subjects(self.subjects_with_hiv_status(POS)),
+            sae_received_first_dose=by_subjects(self.subjects_with_dose('first_dose')),
+            sae_overral_adverse_events=soc_statistics(
+                [r for r in records if r.subject_identifier in sae_subjects],
+                counted=lambda r: r.pt_name is not None and r.soc_name is not None),
+            sae_hiv_uninfected=by_subjects(self.subjects_with_hiv_status(NEG)))
+
+    def age_range_counts(self, subjects=None, lower=None, upper=None):
+        """
+        Return {site_id: count} of the subjects aged lower to upper today,
+        by consent date of birth and site.
+        """
+        today = date.today()
+        latest_dob = today - relativedelta(years=lower)
+        earliest_dob = today - relativedelta(years=upper) if upper else None
+        return Counter(
+            self.consent_sites.get(subject_identifier)
+            for subject_identifier in subjects
+            if self.consents.get(subject_identifier, (None, None))[1]
+            and self.consents.get(subject_identifier)[1] <= latest_dob
+            and (earliest_dob is None
+                 or self.consents.get(subject_identifier)[1] >= earliest_dob))
+
+    def demographics_dashboard_statistics(self):
+        """
+        The DemographicsMixin.demographics_statistics values.
+        """
+        enrolled = self.subjects_with_dose('first_dose')
+        consented = enrolled & set(self.consents)
+
+        def gender_row(label, gender):
+            return [label, *self.per_site(Counter(
+                self.consent_sites.get(s) for s in consented
+                if self.consents.get(s)[0] == gender))]
+
+        def hiv_row(label, status):
+            return [label, *self.per_site(Counter(
+                site_id for s, site_id, hiv_result, rapid_test_result in self.hiv_tests
+                if s in enrolled and status in (hiv_result, rapid_test_result)))]
+
+        def race_row(label, matches):
+            return [label, *self.per_site(Counter(
+                site_id for s, site_id, ethnicity, ethnicity_other
+                in self.demographics_data
+                if s in enrolled and matches(ethnicity, ethnicity_other)))]
+
+        males = {s for s, (gender, _) in self.consents.items() if gender == MALE}
+        return dict(
+            site_names=[site for _, site in self.sites],
+            age_stats={
+                key: self.per_site(self.age_range_counts(consented, lower, upper))
+                for key, lower, upper in [
+                    ('age_18_to_30', 18, 29), ('age_30_to_40', 30, 39),
+                    ('age_40_to_50', 40, 49), ('age_50_to_60', 50, 59),
+                    ('age_60_to_70', 60, 69), ('age_70_and_above', 70, None)]},
+            diabates_stats=['Diabetes', *self.per_site(Counter(
+                self.consent_sites.get(s) for s in enrolled & set(self.diabetes)))],
+            females_stats=gender_row('Females', FEMALE),
+            males_stats=gender_row('Males', MALE),
+            hiv_stats=[hiv_row('HIV Positive', POS),
+                       hiv_row('HIV Negative', NEG),
+                       hiv_row('Unknown', IND)],
+            pregnency_stats=['Pregnancies', *self.per_site(Counter(
+                site_id for s, site_id in self.pregnancies
+                if s in enrolled and s not in males))],
+            race_stats=[
+                race_row('Black African', lambda e, other: e == 'Black African'),
+                race_row('Asian', lambda e, other: e == 'Asian'),
+                race_row('Caucasian', lambda e, other: e == 'Caucasian'),
+                race_row('Other Race', lambda e, other: other is not None)])
+
+    def dashboard_statistics(self):
+        return dict(
+            enrolled_statistics=self.enrolled_statistics(),
+            vaccinated_statistics=self.vaccinated_statistics(),
+            pregnancy_statistics=self.pregnancy_statistics(),
+            ae_statistics=self.ae_statistics(),
+            sae_statistics=self.sae_statistics(),
+            demographics_statistics=self.demographics_dashboard_statistics())
+
+    # Writes.
+
+    @property
+    def snapshots(self):
+        """
+        Return [(model, key field, rows method, prune)] in write order.
+        """
+        return [
+            ('esr21_reports.screeningstatistics', 'site', self.screening_statistics, True),
+            ('esr21_reports.enrollmentstatistics', 'site_series', self.enrollment_statistics, True),
+            ('esr21_reports.vaccinationstatistics', 'site_series', self.vaccination_statistics, True),
+            ('esr21_reports.adverseevents', 'site_series', self.adverse_events_statistics, True),
+            ('esr21_reports.demographicsstatistics', 'site_series', self.demographics_statistics, True),
+            ('esr21_reports.agestatistics', 'site', self.age_statistics, True),
+            ('esr21_reports.vaccinationenrollments', 'site_series', self.vaccination_enrollments, True),
+        ]
+
+    def upsert(self, model_cls=None, key=None, rows=None, prune=True, scope=None):
+        """
+        Create or update the rows by `key` and, with prune, delete the rows
+        for keys not in `rows`, only among the rows matching the `scope`
+        lookups if given. Returns the number of rows created, updated and
+        deleted.
+        """
+        keys = [row.get(key) for row in rows]
+        existing = {}
+        for obj in model_cls.objects.filter(**{f'{key}__in': keys}):
+            existing.setdefault(getattr(obj, key), obj)
+        fields = sorted({field for row in rows for field in row if field != key})
+        modified = get_utcnow()
+        to_create = []
+        to_update = []
+        for row in rows:
+            obj = existing.get(row.get(key))
+            if not obj:
+                to_create.append(model_cls(**row))
+            elif any(getattr(obj, field) != value for field, value in row.items()):
+                for field, value in row.items():
+                    setattr(obj, field, value)
+                obj.modified = modified
+                to_update.append(obj)
+        stale = model_cls.objects.filter(**(scope or {})).exclude(
+            **{f'{key}__in': keys}) if prune else None
+        deleted = stale.count() if prune else 0
+        if not self.dry_run:
+            model_cls.objects.bulk_create(to_create, batch_size=self.chunk_size)
+            if to_update:
+                model_cls.objects.bulk_update(
+                    to_update, fields=[*fields, 'modified'],
+                    batch_size=self.chunk_size)
+            if prune:
+                stale.delete()
+        return dict(created=len(to_create), updated=len(to_update), deleted=deleted)
+
+    def materialize(self):
+        """
+        Compute every snapshot from the one load, write them in a single
+        transaction and publish the dashboard statistics as a new generation.
+        Returns {model: counts}.
+        """
+        rows = [(model, key, rows_method(), prune)
+                for model, key, rows_method, prune in self.snapshots]
+        dashboard_statistics = self.dashboard_statistics()
+        results = {}
+        with transaction.atomic():
+            for model, key, model_rows, prune in rows:
+                results[model] = self.upsert(
+                    model_cls=self.get_model_cls(model), key=key,
+                    rows=model_rows, prune=prune)
+        if not self.dry_run:
+            DashboardStatisticsStore(chunk_size=self.chunk_size).write(
+                dashboard_statistics)
+        results['esr21_reports.dashboardstatistics'] = dict(
+            created=len(dashboard_statistics), updated=0, deleted=0)
+        return results
@@ -1,7 +1,8 @@
 from django.apps import apps as django_apps
 from django.db.models import Q
-from edc_constants.constants import POS, YES, OPEN
+from edc_constants.constants import POS, OPEN
 
+from .anti_join_rules import anti_join_rules
 from .query_generation import QueryGeneration
 
 
@@ -18,31 +19,7 @@ class HIVStatusQueries(QueryGeneration):
         Participant's HIV test result status missing, i.e. rapid HIV test not
         performed and/or previous HIV status not keyed...
         """
-        subject = 'Participant\'s HIV test result is missing.',
-        comment = ('Participant\'s HIV test status is missing. This needs to '
-                   'be corrected/recaptured on the system')
-        query = self.create_query_name(
-            query_name='Participant\'s HIV test result is missing.')
-
-        for idx in self.overall_enrols:
-            enrol_visit = self.subject_visit_cls.objects.filter(
-                subject_identifier=idx, ).earliest(
-                    'report_datetime')
-            assign = self.site_issue_assign_opts.get(enrol_visit.site.id)
-            hiv_test = self.rapid_hiv_status_cls.objects.filter(
-                Q(hiv_testing_consent=YES) | Q(prev_hiv_test=YES),
-                subject_visit=enrol_visit,
-                hiv_result__isnull=True,
-                rapid_test_result__isnull=True)
-            if hiv_test:
-                self.create_action_item(
-                    site=enrol_visit.site,
-                    subject_identifier=idx,
-                    query_name=query.query_name,
-                    assign=assign,
-                    status=OPEN,
-                    subject=subject,
-                    comment=comment)
+        self.run_anti_join_rule(anti_join_rules.get('missing_hiv_test_results'))
 
     def neg_hiv_status_on_art(self):
         """
@@ -54,18 +31,18 @@ class HIVStatusQueries(QueryGeneration):
                    'medical history form at visit %(visit)s. This needs to be '
                    'corrected/recaptured on the system')
         query = self.create_query_name(
-            query_name='Participant\'s HIV test result is missing.')
+            query_name='Participant has negative HIV test status, but is on ART.')
 
         hiv_pos = self.rapid_hiv_status_cls.objects.filter(
             Q(hiv_result=POS) | Q(rapid_test_result=POS),
-            site_id=self.site_id).values_list(
+            **self.site_filter).values_list(
                 'subject_visit__subject_identifier', flat=True).distinct()
 
         medical_history = self.medical_history_cls.objects.filter(
                 comorbidities__name__in=['HIV']).exclude(
                     subject_visit__subject_identifier__in=hiv_pos)
 
-        for history in medical_history:
+        for history in self.stream(medical_history, 'subject_visit', 'site'):
             subject_identifier = history.subject_visit.subject_identifier
 
             assign = self.site_issue_assign_opts.get(history.site.id)
@@ -1,15 +1,28 @@
-import csv
+from collections import namedtuple
 
 from django.apps import apps as django_apps
-from django.db.models import Q
+from django.db.models import Exists, Max, OuterRef, Q
 from django.conf import settings
+from django.utils.functional import cached_property
 
-from edc_appointment.constants import NEW_APPT
 from edc_constants.constants import OPEN, YES
 
 from dateutil.relativedelta import relativedelta
 from edc_base.utils import get_utcnow
 
+from .action_item_writer import ActionItemWriter
+from .anti_join_rules import anti_join_rules
+from .appointment_status_index import AppointmentStatusIndex
+from .crf_matrix import CrfMatrix
+from .date_constraint import DateConstraint
+from .duplicate_detector import DuplicateDetector
+from .exclusion_lists import exclusion_lists
+from .query_profiler import QueryProfiler
+from .vaccination_reconciliation import MISSING_HISTORY, PRODUCT_MISMATCH
+from .vaccination_reconciliation import VaccinationReconciliation
+
+EnrolVisit = namedtuple('EnrolVisit', 'id site_id')
+
 
 class QueryGeneration:
     vaccination_details_model = 'esr21_subject.vaccinationdetails'
@@ -22,6 +35,14 @@ class QueryGeneration:
     medical_history_model = 'esr21_subject.medicalhistory'
     pregnancy_model = 'esr21_subject.pregnancystatus'
     subject_visit_model = 'esr21_subject.subjectvisit'
+    iterator_chunk_size = 2000
+
+    def __init__(self, action_item_writer=None, subject_identifiers=None,
+                 all_sites=False, site_id=None):
+        self.action_item_writer = action_item_writer or ActionItemWriter()
+        self.subject_identifiers = subject_identifiers
+        self.all_sites = all_sites
+        self._site_id = site_id
 
     @property
     def consent_model_cls(self):
@@ -71,23 +92,76 @@ class QueryGeneration:
     def action_item_cls(self):
         return django_apps.get_model('edc_data_manager.dataactionitem')
 
+    def scope_q(self, subject_lookup='subject_visit__subject_identifier'):
+        """
+        Return a Q object for the subjects in scope for this run, an empty Q
+        (all subjects) if no scope is set.
+        """
+        if self.subject_identifiers is None:
+            return Q()
+        return Q(**{f'{subject_lookup}__in': self.subject_identifiers})
+
+    def in_scope(self, queryset,
+                 subject_lookup='subject_visit__subject_identifier'):
+        """
+        Restrict a rule queryset to the subjects in scope for this run.
+        """
+        return queryset.filter(self.scope_q(subject_lookup=subject_lookup))
+
+    def stream(self, queryset, *related):
+        """
+        Iterate the queryset in chunks of iterator_chunk_size rows, joining in
+        the `related` foreign keys, instead of caching every model instance of
+        the result.
+        """
+        if related:
+            queryset = queryset.select_related(*related)
+        rows = queryset.iterator(chunk_size=self.iterator_chunk_size)
+        profiler = QueryProfiler.current()
+        return profiler.count_rows(rows) if profiler else rows
+
     @property
     def overall_enrols(self):
-        enrols = self.vaccination_details_cls.objects.filter(
-            received_dose=YES, site_id=self.site_id).values_list(
+        enrols = self.in_scope(self.vaccination_details_cls.objects.filter(
+            received_dose=YES, **self.site_filter)).values_list(
             'subject_visit__subject_identifier', flat=True).distinct()
         return [enrol for enrol in enrols]
 
+    @cached_property
+    def enrol_visits(self):
+        """
+        Return the first (enrolment) subject visit of each vaccinated
+        participant in scope as {subject_identifier: EnrolVisit(id, site_id)},
+        from a single ordered query.
+        """
+        enrols = self.in_scope(self.vaccination_details_cls.objects.filter(
+            received_dose=YES, **self.site_filter)).values(
+            'subject_visit__subject_identifier')
+        visits = self.subject_visit_cls.objects.filter(
+            subject_identifier__in=enrols).order_by(
+            'subject_identifier', 'report_datetime').values_list(
+            'subject_identifier', 'id', 'site_id')
+        enrol_visits = {}
+        for subject_identifier, visit_id, site_id in visits:
+            if subject_identifier not in enrol_visits:
+                enrol_visits.update(
+                    {subject_identifier: EnrolVisit(visit_id, site_id)})
+        return enrol_visits
+
+    @cached_property
+    def enrol_visit_ids(self):
+        return {enrol_visit.id for enrol_visit in self.enrol_visits.values()}
+
     @property
     def homologous_enrols(self):
         enrols = self.vaccination_details_cls.objects.filter(
-            received_dose_before='first_dose', site_id=self.site_id)
+            received_dose_before='first_dose', **self.site_filter)
         return [enrol for enrol in enrols]
 
     @property
     def heterologous_first_enrols(self):
         hist = self.vaccination_history_cls.objects.filter(
-            site_id=self.site_id).exclude(dose1_product_name='azd_1222').values_list(
+            **self.site_filter).exclude(dose1_product_name='azd_1222').values_list(
             'subject_identifier', flat=True)
 
         enrols = self.vaccination_details_cls.objects.filter(
@@ -98,7 +172,7 @@ class QueryGeneration:
     @property
     def heterologous_second_enrols(self):
         hist = self.vaccination_history_cls.objects.filter(
-            dose_quantity='2', site_id=self.site_id).exclude(
+            dose_quantity='2', **self.site_filter).exclude(
             Q(dose1_product_name='azd_1222') | Q(
                 dose2_product_name='azd_1222')).values_list(
             'subject_identifier', flat=True)
@@ -110,10 +184,24 @@ class QueryGeneration:
 
     @property
     def site_id(self):
-        return settings.SITE_ID
+        return self._site_id or settings.SITE_ID
+
+    @property
+    def site_filter(self):
+        """
+        Site lookup for rule querysets, empty when evaluating all sites in one
+        pass. Action items are then assigned per site from the row's site_id.
+        """
+        return {} if self.all_sites else {'site_id': self.site_id}
 
     def create_query_name(self, query_name=None):
-        obj, created = self.query_name_cls.objects.get_or_create(query_name=query_name)
+        if self.action_item_writer.dry_run:
+            obj = (self.query_name_cls.objects.filter(query_name=query_name).first()
+                   or self.query_name_cls(query_name=query_name))
+        else:
+            obj, created = self.query_name_cls.objects.get_or_create(
+                query_name=query_name)
+        self.action_item_writer.add_query_name(query_name=obj.query_name)
         return obj
 
     @property
@@ -129,69 +217,137 @@ class QueryGeneration:
 
     def create_action_item(
             self, site=None, subject_identifier=None, query_name=None,
-            assign=None, status=OPEN, subject=None, comment=None):
+            assign=None, status=OPEN, subject=None, comment=None, site_id=None):
         defaults = {
             'assigned': assign,
             'status': status,
             'subject': subject,
             'comment': comment,
-            'site': site
+            'site_id': site.id if site else site_id
         }
-        obj, created = self.action_item_cls.objects.update_or_create(
+        self.action_item_writer.add(
             subject_identifier=subject_identifier,
             query_name=query_name,
-            defaults=defaults
-        )
-        return obj
+            **defaults)
 
-    def check_appt_status(self, required_crf=None):
-        appointment_model_cls = django_apps.get_model(
-            required_crf.schedule.appointment_model)
-        try:
-            appt = appointment_model_cls.objects.get(
-                subject_identifier=required_crf.subject_identifier,
-                visit_code=required_crf.visit_code,
-                visit_code_sequence=required_crf.visit_code_sequence,
-                schedule_name=required_crf.schedule_name)
-        except appointment_model_cls.DoesNotExist:
-            return False
+    def run_rule(self, rule_name):
+        """
+        Evaluate a rule and write the action items it flagged in bulk.
+        """
+        rule = getattr(type(self), rule_name)
+        if isinstance(rule, property):
+            getattr(self, rule_name)
         else:
-            return False if appt.appt_status == NEW_APPT else True
+            getattr(self, rule_name)()
+        return self.action_item_writer.flush(
+            subject_identifiers=self.subject_identifiers,
+            site_id=self.site_filter.get('site_id'))
+
+    def offending_subjects(self, queryset,
+                           subject_lookup='subject_visit__subject_identifier'):
+        """
+        Return the distinct (subject_identifier, site_id) pairs of a set based
+        rule queryset, i.e. only the offending subjects.
+        """
+        queryset = self.in_scope(queryset, subject_lookup=subject_lookup)
+        return queryset.order_by().values_list(
+            subject_lookup, 'site_id').distinct()
+
+    def create_action_items(self, offenders=None, query_name=None,
+                            subject=None, comment=None):
+        for subject_identifier, site_id in offenders:
+            self.create_action_item(
+                site_id=site_id,
+                subject_identifier=subject_identifier,
+                query_name=query_name,
+                assign=self.site_issue_assign_opts.get(site_id),
+                subject=subject,
+                comment=comment)
+
+    def run_anti_join_rule(self, anti_join_rule):
+        """
+        Create an action item per subject flagged by an AntiJoinRule.
+        """
+        query = self.create_query_name(query_name=anti_join_rule.query_name)
+        offenders = self.offending_subjects(
+            anti_join_rule.queryset(**self.site_filter),
+            subject_lookup=anti_join_rule.source_key)
+        self.create_action_items(
+            offenders=offenders,
+            query_name=query.query_name,
+            subject=anti_join_rule.subject,
+            comment=anti_join_rule.action_item_comment)
+
+    def check_appt_status(self, required_crf=None):
+        """
+        Return True if the required CRF's appointment has started, i.e. is
+        not a NEW_APPT.
+        """
+        return self.appointment_status_index.started(
+            subject_identifier=required_crf.subject_identifier,
+            schedule_name=required_crf.schedule_name,
+            visit_code=required_crf.visit_code,
+            visit_code_sequence=required_crf.visit_code_sequence)
 
     @property
     def first_dose_second_dose_missing(self):
         """
         First dose missing and second dose not missing
         """
-        subject = 'Missing first dose data',
+        subject = 'Missing first dose data'
         comment = ('The data for the fist dose for the participant is missing.'
                    ' This needs to be recaptured on the system')
         query = self.create_query_name(
             query_name='Missing First Dose Data')
 
         first_doses = self.vaccination_details_cls.objects.filter(
-            received_dose_before='first_dose', site_id=self.site_id).values_list(
-            'subject_visit__subject_identifier', flat=True).distinct()
+            received_dose_before='first_dose',
+            subject_visit__subject_identifier=OuterRef(
+                'subject_visit__subject_identifier'))
+
+        first_dose_history = self.vaccination_history_cls.objects.filter(
+            subject_identifier=OuterRef('subject_visit__subject_identifier'),
+            dose1_product_name__isnull=False,
+            dose1_date__isnull=False)
 
         second_doses = self.vaccination_details_cls.objects.filter(
-            received_dose_before='second_dose', site_id=self.site_id).exclude(
-            subject_visit__subject_identifier__in=first_doses)
-
-        for dose in second_doses:
-            try:
-                self.vaccination_history_cls.objects.get(
-                    subject_identifier=dose.subject_visit.subject_identifier,
-                    dose1_product_name__isnull=False,
-                    dose1_date__isnull=False, )
-            except self.vaccination_history_cls.DoesNotExist:
-                assign = self.site_issue_assign_opts.get(dose.site.id)
-                self.create_action_item(
-                    site=dose.site,
-                    subject_identifier=dose.subject_visit.subject_identifier,
-                    query_name=query.query_name,
-                    assign=assign,
-                    subject=subject,
-                    comment=comment)
+            ~Exists(first_doses), ~Exists(first_dose_history),
+            received_dose_before='second_dose', **self.site_filter)
+
+        self.create_action_items(
+            offenders=self.offending_subjects(second_doses),
+            query_name=query.query_name,
+            subject=subject,
+            comment=comment)
+
+    @property
+    def ae_after_first_dose(self):
+        """
+        AE start_date >= first dose vaccination_date.
+        """
+        return DateConstraint(
+            model=self.ae_model,
+            date_field='start_date',
+            operator='gte',
+            subject_lookup='adverse_event__subject_visit__subject_identifier',
+            visit_lookup='adverse_event__subject_visit',
+            reference_model=self.vaccination_details_model,
+            reference_date_field='vaccination_date__date',
+            reference_filter={'received_dose_before': 'first_dose'})
+
+    @property
+    def ae_resolved_within_three_months(self):
+        """
+        AE start_date >= 3 months ago, unless the AE has a stop date.
+        """
+        return DateConstraint(
+            model=self.ae_model,
+            date_field='start_date',
+            operator='gte',
+            subject_lookup='adverse_event__subject_visit__subject_identifier',
+            visit_lookup='adverse_event__subject_visit',
+            reference_date=(get_utcnow() - relativedelta(months=3)).date(),
+            filter_q=Q(stop_date__isnull=True))
 
     @property
     def ae_data_issues(self):
@@ -203,76 +359,68 @@ class QueryGeneration:
         subject = 'The adverse even start date is before the first dose.'
         comment = ('The participant adverse even start date is before the '
                    'participant was vaccinated at visit(s) %(visits)s')
-        aes = self.ae_model_cls.objects.filter(site_id=self.site_id)
-        erroneous_aes = {}
-
-        for aer in aes:
-            ae = aer.adverse_event
-            subject_identifier = ae.subject_visit.subject_identifier
-            visit_code = ae.subject_visit.visit_code
-            visit_code_sequence = ae.subject_visit.visit_code_sequence
-            ae_start_date = aer.start_date
-
-            ae_visits = erroneous_aes.get(subject_identifier, [])
-            try:
-                vaccination = self.vaccination_details_cls.objects.get(
-                    received_dose_before='first_dose',
-                    subject_visit__subject_identifier=subject_identifier,
-                    vaccination_date__date__gt=ae_start_date)
-            except self.vaccination_details_cls.DoesNotExist:
-                pass
-            else:
-                ae_visits.append(f'{visit_code}.{visit_code_sequence}')
-                erroneous_aes.update({f'{subject_identifier}': ae_visits})
-                assign = self.site_issue_assign_opts.get(vaccination.site.id)
-                self.create_action_item(
-                    site=vaccination.site,
-                    subject_identifier=vaccination.subject_visit.subject_identifier,
-                    query_name=query.query_name,
-                    assign=assign,
-                    status=OPEN,
-                    subject=subject,
-                    comment=comment % {'visits': ', '.join(ae_visits)}
-                )
+        aes = self.in_scope(
+            self.ae_model_cls.objects.filter(**self.site_filter),
+            subject_lookup='adverse_event__subject_visit__subject_identifier')
+
+        erroneous_aes = self.ae_after_first_dose.violations_by_subject(aes)
+        for subject_identifier, violation in erroneous_aes.items():
+            assign = self.site_issue_assign_opts.get(violation.get('site_id'))
+            self.create_action_item(
+                site_id=violation.get('site_id'),
+                subject_identifier=subject_identifier,
+                query_name=query.query_name,
+                assign=assign,
+                status=OPEN,
+                subject=subject,
+                comment=comment % {'visits': ', '.join(violation.get('visits'))}
+            )
+
+    @cached_property
+    def crf_matrix(self):
+        """
+        Expected vs present CRFs for the scheduled visits of the vaccinated
+        participants in scope.
+        """
+        vax = self.in_scope(self.vaccination_details_cls.objects.filter(
+            received_dose=YES, **self.site_filter)).values(
+            'subject_visit__subject_identifier')
+
+        visits = self.subject_visit_cls.objects.filter(
+            subject_identifier__in=vax, reason='scheduled')
+        return CrfMatrix(visits=visits)
+
+    @cached_property
+    def appointment_status_index(self):
+        """
+        Appointment statuses of the vaccinated participants in scope.
+        """
+        return AppointmentStatusIndex(
+            subject_identifiers=self.crf_matrix.visits.values('subject_identifier'))
 
     @property
     def missing_enrol_forms(self):
         """
         Missing required forms, e.g. demographic data form
         """
-        crfmetadata = django_apps.get_model('edc_metadata.crfmetadata')
         query = self.create_query_name(
             query_name='Missing Visit Forms data')
-        vax = self.vaccination_details_cls.objects.filter(
-            received_dose='Yes', site_id=self.site_id).values_list(
-            'subject_visit__subject_identifier', flat=True).distinct()
 
-        visits = self.subject_visit_cls.objects.filter(
-            subject_identifier__in=vax, reason='scheduled')
-        for visit in visits:
-            required_crfs = crfmetadata.objects.filter(
-                subject_identifier=visit.subject_identifier,
-                visit_code=visit.visit_code,
-                entry_status='REQUIRED')
-
-            for missing_crf in required_crfs:
-                model_cls = django_apps.get_model(missing_crf.model)
-                try:
-                    model_cls.objects.get(subject_visit=visit, )
-                except model_cls.DoesNotExist:
-                    assign = self.site_issue_assign_opts.get(missing_crf.site.id)
-                    model = missing_crf.model
-                    model = model.split('.')[1]
-                    visit_code = missing_crf.visit_code
-                    subject = f'Participant is missing {model} data for visit {visit_code}.'
-                    comment = f'{subject} Please complete the missing data for the form'
-                    self.create_action_item(
-                        site=missing_crf.site,
-                        subject_identifier=missing_crf.subject_identifier,
-                        query_name=query.query_name,
-                        assign=assign,
-                        subject=subject,
-                        comment=comment, )
+        for missing_crf in self.crf_matrix.missing:
+            if not self.check_appt_status(required_crf=missing_crf):
+                continue
+            assign = self.site_issue_assign_opts.get(missing_crf.site_id)
+            model = missing_crf.model.split('.')[1]
+            visit_code = missing_crf.visit_code
+            subject = f'Participant is missing {model} data for visit {visit_code}.'
+            comment = f'{subject} Please complete the missing data for the form'
+            self.create_action_item(
+                site_id=missing_crf.site_id,
+                subject_identifier=missing_crf.subject_identifier,
+                query_name=query.query_name,
+                assign=assign,
+                subject=subject,
+                comment=comment, )
 
     @property
     def male_child_bearing_potential(self):
@@ -284,20 +432,18 @@ class QueryGeneration:
         subject = 'Male participant with child bearing potential.'
         comment = f'{subject}. Please correct an update the screening accordingly'
         male_consents = self.consent_model_cls.objects.filter(
-            gender='M', site_id=self.site_id).values_list('subject_identifier', flat=True)
+            gender='M', subject_identifier=OuterRef('subject_identifier'))
         screening_eligibility = self.screening_eligibility_cls.objects.filter(
-            subject_identifier__in=male_consents,
-            childbearing_potential='Yes')
-        for eligibility in screening_eligibility:
-            assign = self.site_issue_assign_opts.get(eligibility.site.id)
-            self.create_action_item(
-                site=eligibility.site,
-                subject_identifier=eligibility.subject_identifier,
-                query_name=query.query_name,
-                assign=assign,
-                subject=subject,
-                comment=comment
-            )
+            Exists(male_consents),
+            childbearing_potential='Yes',
+            **self.site_filter)
+
+        self.create_action_items(
+            offenders=self.offending_subjects(
+                screening_eligibility, subject_lookup='subject_identifier'),
+            query_name=query.query_name,
+            subject=subject,
+            comment=comment)
 
     @property
     def ineligible_vaccinated_participant(self):
@@ -309,76 +455,56 @@ class QueryGeneration:
         subject = 'Participant who is not eligible but has been vaccinated.'
         comment = f'{subject}. Please re-evaluate the screening criteria'
 
-        subject_identifiers = self.screening_eligibility_cls.objects.filter(
-            is_eligible=False, site_id=self.site_id).values_list('subject_identifier',
-                                                                 flat=True)
+        ineligible = self.screening_eligibility_cls.objects.filter(
+            is_eligible=False,
+            subject_identifier=OuterRef('subject_visit__subject_identifier'))
         participant_list = self.vaccination_details_cls.objects.filter(
-            subject_visit__subject_identifier__in=subject_identifiers,
-            received_dose=YES)
+            Exists(ineligible), received_dose=YES, **self.site_filter)
 
-        for ineligibles in participant_list:
-            assign = self.site_issue_assign_opts.get(ineligibles.site.id)
-            self.create_action_item(
-                site=ineligibles.site,
-                subject_identifier=ineligibles.subject_visit.subject_identifier,
-                query_name=query.query_name,
-                assign=assign,
-                subject=subject,
-                comment=comment)
+        self.create_action_items(
+            offenders=self.offending_subjects(participant_list),
+            query_name=query.query_name,
+            subject=subject,
+            comment=comment)
 
     @property
     def duplicate_subject_doses(self):
-        enrolled_identifiers = self.vaccination_details_cls.objects.filter(
-            received_dose=YES, site_id=self.site_id).values_list(
-            'subject_visit__subject_identifier', flat=True)
-        enrolled_identifiers = list(set(enrolled_identifiers))
+        """
+        Subjects who received a dose at the site and have more than one
+        record of the same dose, counted across all sites.
+        """
         doses = ['first_dose', 'second_dose', 'booster_dose']
         query = self.create_query_name(
             query_name='Subject has duplicate doses')
         comment = f'%(subject)s. Please re-evaluate the screening criteria'
 
-        for enrol in enrolled_identifiers:
-            for dose in doses:
-                duplicated = ' '.join(dose.split('_'))
-                subject = f'Subject has duplicate {duplicated}'
-                vaccinations = self.vaccination_details_cls.objects.filter(
-                    subject_visit__subject_identifier=enrol,
-                    received_dose_before=dose)
-                if vaccinations.count() > 1:
-                    assign = self.site_issue_assign_opts.get(vaccinations[0].site.id)
-                    self.create_action_item(
-                        site=vaccinations[0].site,
-                        subject_identifier=vaccinations[
-                            0].subject_visit.subject_identifier,
-                        query_name=query.query_name,
-                        assign=assign,
-                        subject=subject,
-                        comment=comment % {'subject': subject})
+        received = self.vaccination_details_cls.objects.filter(
+            received_dose=YES,
+            subject_visit__subject_identifier=OuterRef(
+                'subject_visit__subject_identifier'),
+            **self.site_filter)
+        duplicate_doses = DuplicateDetector(
+            model_cls=self.vaccination_details_cls,
+            group_by=['subject_visit__subject_identifier', 'received_dose_before'],
+            filter_q=(Q(Exists(received), received_dose_before__in=doses)
+                      & self.scope_q()),
+            aggregates={'group_site_id': Max('site_id')})
+
+        for group in duplicate_doses.groups:
+            duplicated = ' '.join(group.get('received_dose_before').split('_'))
+            subject = f'Subject has duplicate {duplicated}'
+            assign = self.site_issue_assign_opts.get(group.get('group_site_id'))
+            self.create_action_item(
+                site_id=group.get('group_site_id'),
+                subject_identifier=group.get('subject_visit__subject_identifier'),
+                query_name=query.query_name,
+                assign=assign,
+                subject=subject,
+                comment=comment % {'subject': subject})
 
     @property
     def female_missing_preg(self):
-        female_consents = self.consent_model_cls.objects.filter(
-            gender='F', site_id=self.site_id).values_list('subject_identifier', flat=True)
-        enrolled = self.vaccination_details_cls.objects.filter(
-            subject_visit__subject_identifier__in=female_consents,
-            received_dose=YES)
-        query = self.create_query_name(
-            query_name='Gender is F and pregnancy status form is missing')
-        subject = 'Gender is F and pregnancy status form is missing'
-        comment = 'Gender is F and pregnancy status form is missing'
-
-        for enrol in enrolled:
-            pregnancies = self.pregnancy_status_cls.objects.filter(
-                subject_visit__subject_identifier=enrol.subject_visit.subject_identifier)
-            if not pregnancies:
-                assign = self.site_issue_assign_opts.get(enrol.site.id)
-                self.create_action_item(
-                    site=enrol.site,
-                    subject_identifier=enrol.subject_visit.subject_identifier,
-                    query_name=query.query_name,
-                    assign=assign,
-                    subject=subject,
-                    comment=comment % {'subject': subject})
+        self.run_anti_join_rule(anti_join_rules.get('female_missing_preg'))
 
     @property
     def ae_not_resolved(self):
@@ -391,61 +517,31 @@ class QueryGeneration:
         subject = 'Participants with AE not resolved.'
         comment = (f'{subject} at visits %(visits)s. Please re-evaluate the '
                    'Adverse Event Record')
-        aes = self.ae_model_cls.objects.filter(site_id=self.site_id).exclude(
-            adverse_event__subject_visit__subject_identifier__in=self.get_aes_not_resolved
-        )
-
-        threshold_date = (get_utcnow() - relativedelta(months=3)).date()
-
-        erroneous_aes = {}
-
-        for aer in aes:
-            ae = aer.adverse_event
-            subject_identifier = ae.subject_visit.subject_identifier
-            visit_code = ae.subject_visit.visit_code
-            visit_code_sequence = ae.subject_visit.visit_code_sequence
-            ae_start_date = aer.start_date
-            ae_stop_date = aer.stop_date
-
-            ae_visits = erroneous_aes.get(subject_identifier, [])
-            if ae_start_date < threshold_date and ae_stop_date is None:
-                ae_visits.append(f'{visit_code}.{visit_code_sequence}')
-                erroneous_aes.update({f'{subject_identifier}': ae_visits})
-                assign = self.site_issue_assign_opts.get(ae.site.id)
-                self.create_action_item(
-                    site=ae.site,
-                    subject_identifier=subject_identifier,
-                    query_name=query.query_name,
-                    assign=assign,
-                    subject=subject,
-                    comment=comment % {'visits': ', '.join(ae_visits)})
+        aes = self.ae_model_cls.objects.filter(**self.site_filter).exclude(
+            exclusion_lists.get('ae_not_resolved').excluded(
+                subject_lookup='adverse_event__subject_visit__subject_identifier',
+                dry_run=self.action_item_writer.dry_run))
+        aes = self.in_scope(
+            aes, subject_lookup='adverse_event__subject_visit__subject_identifier')
+
+        erroneous_aes = self.ae_resolved_within_three_months.violations_by_subject(aes)
+        for subject_identifier, violation in erroneous_aes.items():
+            assign = self.site_issue_assign_opts.get(violation.get('site_id'))
+            self.create_action_item(
+                site_id=violation.get('site_id'),
+                subject_identifier=subject_identifier,
+                query_name=query.query_name,
+                assign=assign,
+                subject=subject,
+                comment=comment % {'visits': ', '.join(violation.get('visits'))})
 
     @property
     def booster_dose_missing_vaccination_history(self):
         """
         Participants with a booster dose but missing a vaccination history
         """
-        query = self.create_query_name(
-            query_name='Booster missing vaccination history')
-        subject = ('Participants with a booster dose but missing a vaccination'
-                   ' history data')
-        comment = f'{subject}.'
-        booster_identifiers = self.vaccination_details_cls.objects.filter(
-            received_dose_before='booster_dose', site_id=self.site_id)
-        for booster in booster_identifiers:
-            subject_identifier = booster.subject_visit.subject_identifier
-            try:
-                self.vaccination_history_cls.objects.get(
-                    subject_identifier=subject_identifier, )
-            except self.vaccination_history_cls.DoesNotExist:
-                assign = self.site_issue_assign_opts.get(booster.site.id)
-                self.create_action_item(
-                    site=booster.site,
-                    subject_identifier=subject_identifier,
-                    query_name=query.query_name,
-                    assign=assign,
-                    subject=subject,
-                    comment=comment)
+        self.run_anti_join_rule(
+            anti_join_rules.get('booster_dose_missing_vaccination_history'))
 
     @property
     def booster_dose_missing_second_dose(self):
@@ -458,89 +554,64 @@ class QueryGeneration:
         subject = 'Participants with a booster dose but missing second dose data'
         comment = f'{subject}. Please re-evaluate the Vaccination History'
         second_doses = self.vaccination_details_cls.objects.filter(
-            received_dose_before='second_dose', site_id=self.site_id).values_list(
-            'subject_visit__subject_identifier').distinct()
+            received_dose_before='second_dose', **self.site_filter,
+            subject_visit__subject_identifier=OuterRef(
+                'subject_visit__subject_identifier'))
+
+        second_dose_history = self.vaccination_history_cls.objects.filter(
+            subject_identifier=OuterRef('subject_visit__subject_identifier'),
+            dose2_product_name__isnull=False,
+            dose2_date__isnull=False)
 
         booster_doses = self.vaccination_details_cls.objects.filter(
-            received_dose_before='booster_dose', site_id=self.site_id).exclude(
-            subject_visit__subject_identifier__in=second_doses)
-
-        for booster in booster_doses:
-            try:
-                self.vaccination_history_cls.objects.get(
-                    subject_identifier=booster.subject_visit.subject_identifier,
-                    dose2_product_name__isnull=False,
-                    dose2_date__isnull=False, )
-            except self.vaccination_history_cls.DoesNotExist:
-                subject_identifier = booster.subject_visit.subject_identifier
-                assign = self.site_issue_assign_opts.get(booster.site.id)
-                self.create_action_item(
-                    site=booster.site,
-                    subject_identifier=subject_identifier,
-                    query_name=query.query_name,
-                    assign=assign,
-                    subject=subject,
-                    comment=comment)
+            ~Exists(second_doses), ~Exists(second_dose_history),
+            received_dose_before='booster_dose', **self.site_filter)
+
+        self.create_action_items(
+            offenders=self.offending_subjects(booster_doses),
+            query_name=query.query_name,
+            subject=subject,
+            comment=comment)
 
     def vaccination_history_vaccine_details_mismatch(self):
-        all_vacs = self.vaccination_details_cls.objects.filter(
-            site_id=self.site_id, received_dose=YES)
-        for subject_identifier in self.overall_enrols:
-            sub_vax = all_vacs.filter(
-                subject_visit__subject_identifier=subject_identifier)
-            query = self.create_query_name(
-                query_name='Vaccination History Vaccine Details Mismatch')
-            assign = self.site_issue_assign_opts.get(self.site_id)
-            try:
-                vh_obj = self.vaccination_history_cls.objects.get(
-                    subject_identifier=subject_identifier,
-                    received_vaccine=YES)
-            except self.vaccination_history_cls.DoesNotExist:
-                query = self.create_query_name(
-                    query_name='Missing vaccination history')
+        missing_history_query = self.create_query_name(
+            query_name='Missing vaccination history')
+        query = self.create_query_name(
+            query_name='Vaccination History Vaccine Details Mismatch')
+
+        reconciliation = VaccinationReconciliation(
+            vaccinations=self.in_scope(self.vaccination_details_cls.objects.filter(
+                received_dose=YES, **self.site_filter)))
+
+        for mismatch in reconciliation.mismatches:
+            if mismatch.mismatch == MISSING_HISTORY:
                 subject = ('Participant is vaccinated but is missing vaccination '
                            'history data')
                 comment = f'{subject}. Please complete the Vaccination History data'
                 self.create_action_item(
-                    site=sub_vax[0].site,
-                    subject_identifier=subject_identifier,
-                    query_name=query.query_name,
-                    assign=assign,
+                    site_id=mismatch.site_id,
+                    subject_identifier=mismatch.subject_identifier,
+                    query_name=missing_history_query.query_name,
+                    assign=self.site_issue_assign_opts.get(mismatch.site_id),
                     subject=subject,
                     comment=comment)
             else:
-                for vax in sub_vax:
-                    self.create_vaccination_mismatch_item(
-                        query, assign, vac_obj=vax, vach_obj=vh_obj)
-
-    def create_vaccination_mismatch_item(self, query, assign, vac_obj=None, vach_obj=None):
-        dose_match = {'first_dose': '1',
-                      'second_dose': '2',
-                      'booster_dose': '3'}
-        subject_identifier = vach_obj.subject_identifier
-        attr = dose_match.get(vac_obj.received_dose_before)
-        if getattr(vach_obj, f'dose{attr}_product_name') != 'azd_1222':
-            subject = (
-                'vaccination history missing first dose data')
-            comment = f'{subject}.Please re-evaluate the Vaccination History'
-            self.create_action_item(
-                site=vac_obj.site,
-                subject_identifier=subject_identifier,
-                query_name=query.query_name,
-                assign=assign,
-                subject=subject,
-                comment=comment)
-        if getattr(vach_obj, f'dose{attr}_date') != vac_obj.vaccination_date.date():
-            subject = (
-                'vaccination history first dose date mismatched')
-            comment = f'{subject}.Please re-evaluate the Vaccination History'
-            self.create_action_item(
-                site=vac_obj.site,
-                subject_identifier=subject_identifier,
-                query_name=query.query_name,
-                assign=assign,
-                subject=subject,
-                comment=comment)
+                self.create_vaccination_mismatch_item(query, mismatch)
+
+    def create_vaccination_mismatch_item(self, query, mismatch):
+        dose = ' '.join(mismatch.dose.split('_'))
+        if mismatch.mismatch == PRODUCT_MISMATCH:
+            subject = f'vaccination history missing {dose} data'
+        else:
+            subject = f'vaccination history {dose} date mismatched'
+        comment = f'{subject}.Please re-evaluate the Vaccination History'
+        self.create_action_item(
+            site_id=mismatch.site_id,
+            subject_identifier=mismatch.subject_identifier,
+            query_name=query.query_name,
+            assign=self.site_issue_assign_opts.get(mismatch.site_id),
+            subject=subject,
+            comment=comment)
 
     def duplicate_enrolment(self):
         enrolment_forms = [
@@ -549,39 +620,34 @@ class QueryGeneration:
             'rapidhivtesting',
             'covid19preventativebehaviours',
         ]
+        query = self.create_query_name(
+            query_name='Duplicate enrollment form')
+
+        participants = self.vaccination_details_cls.objects.filter(
+            subject_visit__subject_identifier=OuterRef(
+                'subject_visit__subject_identifier'),
+            **self.site_filter)
 
-        all_participants = self.vaccination_details_cls.objects.filter(
-            site_id=self.site_id, ).values_list('subject_visit__subject_identifier',
-                                                flat=True).distinct()
         for form in enrolment_forms:
-            for sub in all_participants:
-                enrolled_participant = self.vaccination_details_cls.objects.filter(
-                    subject_visit__subject_identifier=sub).latest('report_datetime')
-                model_cls = django_apps.get_model(f'esr21_subject.{form}')
-                try:
-                    model_cls.objects.get(
-                        subject_visit__subject_identifier=enrolled_participant.subject_identifier)
-                except model_cls.DoesNotExist:
-                    pass
-                except model_cls.MultipleObjectsReturned:
-                    query = self.create_query_name(
-                        query_name='Duplicate enrollment form')
-                    subject = f'has duplicate {form}'
-                    comment = f'{subject}. Please re-evaluate the Vaccination History'
-                    assign = self.site_issue_assign_opts.get(self.site_id)
-                    self.create_action_item(
-                        site=enrolled_participant.site,
-                        subject_identifier=enrolled_participant.subject_identifier,
-                        query_name=query.query_name,
-                        assign=assign,
-                        subject=subject,
-                        comment=comment)
+            model_cls = django_apps.get_model(f'esr21_subject.{form}')
+            duplicate_forms = DuplicateDetector(
+                model_cls=model_cls,
+                group_by=['subject_visit__subject_identifier'],
+                filter_q=Q(Exists(participants)) & self.scope_q(),
+                aggregates={'group_site_id': Max('site_id')})
+
+            for group in duplicate_forms.groups:
+                subject = f'has duplicate {form}'
+                comment = f'{subject}. Please re-evaluate the Vaccination History'
+                assign = self.site_issue_assign_opts.get(group.get('group_site_id'))
+                self.create_action_item(
+                    site_id=group.get('group_site_id'),
+                    subject_identifier=group.get('subject_visit__subject_identifier'),
+                    query_name=query.query_name,
+                    assign=assign,
+                    subject=subject,
+                    comment=comment)
 
     @property
     def get_aes_not_resolved(self):
-        csvreader = csv.reader(open(
-            f'{settings.BASE_DIR}/esr21/static/esr21_reports/adverse_events/ae_not_resolved.csv'))
-        rows = []
-        for row in csvreader:
-            rows.append(row[0])
-        return rows
+        return exclusion_lists.get('ae_not_resolved').subject_identifiers
@@ -0,0 +1,94 @@
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.db import connections
+
+_local = threading.local()
+
+
+class QueryProfiler:
+    """
+    Counts the SQL statements executed and the rows they fetched on a
+    connection, using a Django execute wrapper.
+
+    Rows are taken from the cursor's rowcount. Backends and server-side
+    cursors that do not report it for SELECTs (e.g. sqlite, or Postgres for
+    QuerySet.iterator()) only have the rows passed through count_rows()
+    counted; rows is None if none were.
+
+    The peak memory allocated by Python while profiling is traced with
+    tracemalloc (peak_mb); max_rss_mb is the process' resident set size
+    high-water mark, which is not reset between profiles.
+    """
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.queries = 0
+        self.rows = None
+        self.seconds = None
+        self.peak_mb = None
+        self.max_rss_mb = None
+
+        self.uncounted = False
+
+    @staticmethod
+    def current():
+        """
+        Return the profiler active in this thread, if any.
+        """
+        return getattr(_local, 'profiler', None)
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        if sql.lstrip()[:6].upper() == 'SELECT':
+            rowcount = getattr(context.get('cursor'), 'rowcount', -1)
+            self.uncounted = rowcount < 0
+            if not self.uncounted:
+                self.rows = (self.rows or 0) + rowcount
+        return result
+
+    def count_rows(self, rows):
+        """
+        Yield the rows of a queryset iterator, counting them if the cursor
+        did not report its rowcount.
+        """
+        uncounted = None
+        for row in rows:
+            if uncounted is None:
+                # The first chunk is fetched right after the SELECT executes.
+                uncounted = self.uncounted
+            if uncounted:
+                self.rows = (self.rows or 0) + 1
+            yield row
+
+    @contextmanager
+    def profile(self):
+        start = time.monotonic()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        previous, _local.profiler = self.current(), self
+        with connections[self.using].execute_wrapper(self):
+            try:
+                yield self
+            finally:
+                _local.profiler = previous
+                self.seconds = round(time.monotonic() - start, 2)
+                _, peak = tracemalloc.get_traced_memory()
+                self.peak_mb = round(peak / 2 ** 20, 1)
+                if not tracing:
+                    tracemalloc.stop()
+                # ru_maxrss is in kilobytes on Linux.
+                self.max_rss_mb = round(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10, 1)
+
+    @property
+    def stats(self):
+        return dict(queries=self.queries, rows=self.rows,
+                    peak_mb=self.peak_mb, max_rss_mb=self.max_rss_mb)
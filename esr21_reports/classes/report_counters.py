@@ -0,0 +1,275 @@
+from collections import Counter, namedtuple
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db import transaction
+from django.db.models import F
+from edc_base.utils import get_utcnow
+from edc_constants.constants import POS, YES
+
+from ..models import ReportCounter
+from .graph_materializer import history_series
+
+CounterSource = namedtuple(
+    'CounterSource', 'model subject_lookup fields metric distinct',
+    defaults=[False])
+
+
+def vaccination_metric(values):
+    if values.get('received_dose') == YES:
+        return values.get('received_dose_before')
+    return None
+
+
+def pregnancy_metric(values):
+    return 'pregnancy_pos' if values.get('result') == POS else None
+
+
+def hiv_metric(values):
+    result = values.get('hiv_result') or values.get('rapid_test_result')
+    return f'hiv_{result}'.lower() if result else None
+
+
+def consent_metric(values):
+    return f'consent_{values.get("gender")}'.lower() if values.get('gender') else None
+
+
+class ReportCounters:
+    """
+    Headline counts per (metric, site, series) kept up to date with +1/-1
+    deltas from the esr21_subject save and delete signals, when
+    settings.ESR21_REPORT_COUNTERS is True.
+
+    A source row counts once towards the metric returned by its source's
+    metric function, if any. Deltas are applied when the transaction that
+    saved or deleted the row commits. Changes the deltas cannot see, e.g. a
+    vaccination history changing a participant's series, are corrected by
+    reconcile(), which recounts every metric from scratch.
+
+    The rows of a `distinct` source count once per participant and metric,
+    e.g. a re-consent or a duplicate dose record does not count the
+    participant again.
+
+    With the counters enabled, headline_statistics() replaces the headline
+    counts of the dashboard statistics with the live counts.
+    """
+
+    ae_report_sites = ['Gaborone', 'Maun', 'Serowe', 'Francistown', 'Phikwe']
+
+    vaccination_history_model = 'esr21_subject.vaccinationhistory'
+
+    sources = [
+        CounterSource(
+            'esr21_subject.vaccinationdetails',
+            'subject_visit__subject_identifier',
+            ['received_dose', 'received_dose_before'], vaccination_metric, True),
+        CounterSource(
+            'esr21_subject.adverseeventrecord',
+            'adverse_event__subject_visit__subject_identifier',
+            [], lambda values: 'ae'),
+        CounterSource(
+            'esr21_subject.seriousadverseeventrecord',
+            'serious_adverse_event__subject_visit__subject_identifier',
+            [], lambda values: 'sae'),
+        CounterSource(
+            'esr21_subject.specialinterestadverseeventrecord',
+            'special_interest_adverse_event__subject_visit__subject_identifier',
+            [], lambda values: 'aesi'),
+        CounterSource(
+            'esr21_subject.pregnancytest',
+            'subject_visit__subject_identifier',
+            ['result'], pregnancy_metric),
+        CounterSource(
+            'esr21_subject.rapidhivtesting',
+            'subject_visit__subject_identifier',
+            ['hiv_result', 'rapid_test_result'], hiv_metric),
+        CounterSource(
+            'esr21_subject.informedconsent',
+            'subject_identifier',
+            ['gender'], consent_metric, True),
+    ]
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'ESR21_REPORT_COUNTERS', False)
+
+    def get_source(self, model=None):
+        for source in self.sources:
+            if source.model == model:
+                return source
+        return None
+
+    def history(self, subject_identifier=None):
+        return django_apps.get_model(self.vaccination_history_model).objects.filter(
+            subject_identifier=subject_identifier).order_by('-created').values_list(
+            'dose_quantity', 'dose1_product_name', 'dose2_product_name',
+            'dose3_product_name').first()
+
+    def source_rows(self, source=None, **filters):
+        """
+        Return the (subject_identifier, site_id, metric) of the source's rows.
+        """
+        model_cls = django_apps.get_model(source.model)
+        rows = model_cls.objects.filter(**filters).order_by().values(
+            source.subject_lookup, 'site_id', *source.fields)
+        for values in rows.iterator():
+            metric = source.metric(values)
+            if metric:
+                yield values.get(source.subject_lookup), values.get('site_id'), metric
+
+    def counted_elsewhere(self, source=None, subject_identifier=None,
+                          metric=None, pk=None):
+        """
+        Return True if another row of the participant counts towards the
+        metric.
+        """
+        model_cls = django_apps.get_model(source.model)
+        rows = model_cls.objects.filter(
+            **{source.subject_lookup: subject_identifier}).exclude(pk=pk).values(
+            *source.fields)
+        return any(source.metric(values) == metric for values in rows)
+
+    def keys(self, model=None, pk=None):
+        """
+        Return the [(metric, site_id, series)] a saved row counts towards.
+        """
+        source = self.get_source(model)
+        return [(metric, site_id, history_series(self.history(subject_identifier)) or '')
+                for subject_identifier, site_id, metric in self.source_rows(source, pk=pk)
+                if not (source.distinct and self.counted_elsewhere(
+                    source, subject_identifier, metric, pk))]
+
+    def on_commit(self, deltas=None):
+        """
+        Apply the deltas when the current transaction commits.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if deltas:
+            transaction.on_commit(lambda: self.apply(deltas))
+
+    def apply(self, deltas=None):
+        """
+        Add {(metric, site_id, series): delta} to the counters.
+        """
+        with transaction.atomic():
+            for (metric, site_id, series), delta in deltas.items():
+                ReportCounter.objects.get_or_create(
+                    metric=metric, site_id=site_id, series=series)
+                ReportCounter.objects.filter(
+                    metric=metric, site_id=site_id, series=series).update(
+                    value=F('value') + delta, modified=get_utcnow())
+
+    @staticmethod
+    def deltas(old_keys=None, new_keys=None):
+        deltas = Counter(new_keys or [])
+        deltas.subtract(Counter(old_keys or []))
+        return dict(deltas)
+
+    def recount(self):
+        """
+        Return {(metric, site_id, series): count} recounted from the source
+        tables.
+        """
+        histories = {}
+        for history in django_apps.get_model(
+                self.vaccination_history_model).objects.order_by(
+                'created').values_list(
+                'subject_identifier', 'dose_quantity', 'dose1_product_name',
+                'dose2_product_name', 'dose3_product_name'):
+            histories[history[0]] = history[1:]
+        counts = Counter()
+        for source in self.sources:
+            counted = set()
+            for subject_identifier, site_id, metric in self.source_rows(source):
+                if source.distinct:
+                    if (subject_identifier, metric) in counted:
+                        continue
+                    counted.add((subject_identifier, metric))
+                series = history_series(histories.get(subject_identifier)) or ''
+                counts[(metric, site_id, series)] += 1
+        return counts
+
+    def reconcile(self):
+        """
+        Correct the counters that differ from a full recount and return
+        {(metric, site_id, series): (counter value, recounted value)} of the
+        corrected ones.
+        """
+        counts = self.recount()
+        existing = {(counter.metric, counter.site_id, counter.series): counter
+                    for counter in ReportCounter.objects.all()}
+        corrected = {}
+        to_create = []
+        to_update = []
+        modified = get_utcnow()
+        for key in set(counts) | set(existing):
+            counter = existing.get(key)
+            value = counts.get(key, 0)
+            if not counter:
+                to_create.append(ReportCounter(
+                    metric=key[0], site_id=key[1], series=key[2], value=value))
+                corrected[key] = (None, value)
+            elif counter.value != value:
+                corrected[key] = (counter.value, value)
+                counter.value = value
+                counter.modified = modified
+                to_update.append(counter)
+        with transaction.atomic():
+            ReportCounter.objects.bulk_create(to_create)
+            ReportCounter.objects.bulk_update(to_update, fields=['value', 'modified'])
+        return corrected
+
+    def totals(self, metric=None, series=None):
+        """
+        Return {site_id: value} of the metric, for all series unless one is
+        given.
+        """
+        counters = ReportCounter.objects.filter(metric=metric)
+        if series is not None:
+            counters = counters.filter(series=series)
+        totals = Counter()
+        for site_id, value in counters.values_list('site_id', 'value'):
+            totals[site_id] += value
+        return dict(totals)
+
+    def site_row(self, label=None, metric=None, site_ids=None):
+        """
+        Return [label, total, *count per site] of the metric.
+        """
+        totals = self.totals(metric)
+        return [label, sum(totals.values()),
+                *[totals.get(site_id, 0) for site_id in site_ids]]
+
+    def headline_statistics(self, statistics=None):
+        """
+        Return the dashboard statistics, {key: value}, with the doses
+        received and the AE and SAE counts replaced by the live counters
+        when enabled.
+        """
+        if not self.enabled:
+            return statistics
+        statistics = dict(statistics)
+        sites = list(Site.objects.order_by('id').values_list('id', 'name'))
+        site_ids = [site_id for site_id, _ in sites]
+        named_site_ids = [
+            next((site_id for site_id, name in sites if name.endswith(site)), None)
+            for site in self.ae_report_sites]
+        statistics.update(vaccinated_statistics=[
+            self.site_row('First dose', 'first_dose', site_ids),
+            self.site_row('Second dose', 'second_dose', site_ids),
+            self.site_row('Booster dose', 'booster_dose', site_ids)])
+        if statistics.get('ae_statistics'):
+            statistics.update(ae_statistics=dict(
+                statistics.get('ae_statistics'),
+                ae_overall_count=self.site_row(
+                    'Adverse Events', 'ae', named_site_ids)))
+        if statistics.get('sae_statistics'):
+            statistics.update(sae_statistics=dict(
+                statistics.get('sae_statistics'),
+                sae_overall_count=self.site_row(
+                    'Serious Adverse Events', 'sae', named_site_ids)))
+        return statistics
+
+
+report_counters = ReportCounters()
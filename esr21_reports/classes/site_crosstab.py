@@ -0,0 +1,147 @@
+import pandas as pd
+from django.apps import apps as django_apps
+from django.contrib.sites.models import Site
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django_pandas.io import read_frame
+from edc_constants.constants import IND, MALE, NEG, POS
+
+from .graph_materializer import PRODUCT_NAME
+
+
+class SiteCrosstab:
+    """
+    Builds the site-stratified report tables, [label, total, *per site count]
+    rows, from a single DataFrame load per source table.
+
+    Each metric is a boolean Series over the frame's rows and all of a table's
+    metrics are counted per site with one groupby, instead of one count query
+    per (metric, site).
+    """
+
+    vaccination_model = 'esr21_subject.vaccinationdetails'
+    vaccination_history_model = 'esr21_subject.vaccinationhistory'
+    consent_model = 'esr21_subject.informedconsent'
+    rapid_hiv_testing_model = 'esr21_subject.rapidhivtesting'
+    demographics_data_model = 'esr21_subject.demographicsdata'
+    pregnancy_test_model = 'esr21_subject.pregnancytest'
+
+    def __init__(self, site_ids=None):
+        if site_ids is None:
+            site_ids = Site.objects.order_by('id').values_list('id', flat=True)
+        self.site_ids = list(site_ids)
+
+    def get_model_cls(self, model):
+        return django_apps.get_model(model)
+
+    @cached_property
+    def enrolled_pids(self):
+        return self.get_model_cls(self.vaccination_model).objects.filter(
+            received_dose_before='first_dose').values_list(
+            'subject_visit__subject_identifier', flat=True).distinct()
+
+    def frame(self, model, subject_lookup, *fieldnames, enrolled=True,
+              exclude=None, **filters):
+        """
+        Return a DataFrame of the subject_identifier, site_id and `fieldnames`
+        of the model's rows matching the filters, by default only of the
+        enrolled participants.
+        """
+        queryset = self.get_model_cls(model).objects.filter(**filters)
+        if enrolled:
+            queryset = queryset.filter(
+                **{f'{subject_lookup}__in': self.enrolled_pids})
+        if exclude:
+            queryset = queryset.exclude(**exclude)
+        df = read_frame(
+            queryset.order_by(), fieldnames=[subject_lookup, 'site_id', *fieldnames],
+            verbose=False)
+        return df.rename(columns={subject_lookup: 'subject_identifier'})
+
+    def table(self, df=None, metrics=None, distinct=False):
+        """
+        Return the [label, total, *per site count] rows of the `metrics`,
+        {label: boolean Series over df}, counting the matching rows, or the
+        matching participants with distinct.
+        """
+        matches = pd.DataFrame(metrics, index=df.index).fillna(False).astype(bool)
+        if distinct:
+            matches = matches.groupby(
+                [df['site_id'], df['subject_identifier']]).any()
+            matches.index = matches.index.get_level_values('site_id')
+        else:
+            matches.index = df['site_id']
+        counts = matches.groupby(level=0).sum().reindex(
+            self.site_ids, fill_value=0).astype(int)
+        return [[label, int(counts[label].sum()), *counts[label].tolist()]
+                for label in metrics]
+
+    @staticmethod
+    def every(df=None):
+        return pd.Series(True, index=df.index)
+
+    def hiv_statistics(self):
+        df = self.frame(
+            self.rapid_hiv_testing_model, 'subject_visit__subject_identifier',
+            'hiv_result', 'rapid_test_result')
+
+        def status(value):
+            return (df['hiv_result'] == value) | (df['rapid_test_result'] == value)
+
+        return self.table(df, {
+            'HIV Positive': status(POS),
+            'HIV Negative': status(NEG),
+            'Unknown': status(IND)})
+
+    def race_statistics(self):
+        df = self.frame(
+            self.demographics_data_model, 'subject_visit__subject_identifier',
+            'ethnicity', 'ethnicity_other')
+        return self.table(df, {
+            'Black African': df['ethnicity'] == 'Black African',
+            'Asian': df['ethnicity'] == 'Asian',
+            'Caucasian': df['ethnicity'] == 'Caucasian',
+            'Other Race': df['ethnicity_other'].notna()})
+
+    def pregnancy_statistics(self):
+        """
+        Positive pregnancy tests, excluding any of male participants.
+        """
+        male_consents = self.get_model_cls(self.consent_model).objects.filter(
+            gender=MALE).values_list('subject_identifier', flat=True)
+        df = self.frame(
+            self.pregnancy_test_model, 'subject_visit__subject_identifier',
+            result=POS,
+            exclude={'subject_visit__subject_identifier__in': male_consents})
+        return self.table(df, {'Pregnancies': self.every(df)})[0]
+
+    def pregnant_enrollment(self):
+        df = self.frame(
+            self.pregnancy_test_model, 'subject_visit__subject_identifier',
+            result=POS)
+        return self.table(
+            df, {'Pregnant Enrollment': self.every(df)}, distinct=True)[0]
+
+    def dose_at_enrollment(self, label=None, dose=None, history=None):
+        """
+        Participants enrolled for `dose` with a vaccination history matching
+        the `history` Q.
+        """
+        ids = self.get_model_cls(self.vaccination_history_model).objects.filter(
+            history).values_list('subject_identifier', flat=True)
+        df = self.frame(
+            self.vaccination_model, 'subject_visit__subject_identifier',
+            enrolled=False, received_dose_before=dose,
+            subject_visit__subject_identifier__in=ids)
+        return self.table(df, {label: self.every(df)}, distinct=True)[0]
+
+    def second_dose_at_enrollment(self):
+        return self.dose_at_enrollment(
+            'Second dose at enrollment', 'second_dose',
+            Q(dose_quantity=1) & ~Q(dose1_product_name=PRODUCT_NAME))
+
+    def booster_dose_at_enrollment(self):
+        return self.dose_at_enrollment(
+            'Booster dose at enrollment', 'booster_dose',
+            Q(dose_quantity=2) & ~(Q(dose1_product_name=PRODUCT_NAME)
+                                   | Q(dose2_product_name=PRODUCT_NAME)))
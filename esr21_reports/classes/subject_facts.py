@@ -0,0 +1,206 @@
+from collections import Counter
+
+from django.contrib.sites.models import Site
+from django.db import transaction
+from django.db.models import Count
+from django.utils.functional import cached_property
+from edc_base.utils import get_utcnow
+from edc_constants.constants import IND, NEG, POS
+
+from ..models import DataQueryWatermark, SubjectFacts
+from .graph_materializer import GraphMaterializer
+
+
+class SubjectFactsBuilder(GraphMaterializer):
+    """
+    Rebuilds the SubjectFacts rows from the same bulk loads as the graph
+    materializer, restricted to `subject_identifiers` when given.
+
+    Every loader of GraphMaterializer selects the subject lookup as its first
+    field, which is what values_list() filters on here.
+    """
+
+    watermark_name = 'subject_facts'
+    refresh_chunk_size = 1000
+
+    fact_sources = [
+        ('esr21_subject.vaccinationdetails', 'subject_visit__subject_identifier'),
+        ('esr21_subject.vaccinationhistory', 'subject_identifier'),
+        ('esr21_subject.informedconsent', 'subject_identifier'),
+        ('esr21_subject.onschedule', 'subject_identifier'),
+        ('esr21_subject.rapidhivtesting', 'subject_visit__subject_identifier'),
+        ('esr21_subject.pregnancytest', 'subject_visit__subject_identifier'),
+        ('esr21_subject.medicalhistory', 'subject_visit__subject_identifier'),
+    ]
+
+    def __init__(self, subject_identifiers=None, chunk_size=None, dry_run=False):
+        super().__init__(chunk_size=chunk_size, dry_run=dry_run)
+        self.subject_identifiers = subject_identifiers
+
+    def values_list(self, model, *fields, flat=False, **filters):
+        if self.subject_identifiers is not None:
+            filters[f'{fields[0]}__in'] = self.subject_identifiers
+        return super().values_list(model, *fields, flat=flat, **filters)
+
+    def hiv_status(self, subject_identifier=None):
+        results = self.hiv_results.get(subject_identifier, set())
+        for status in [POS, NEG, IND]:
+            if status in results:
+                return status
+        return None
+
+    def cohort(self, subject_identifier=None):
+        schedules = (self.onschedules.get(subject_identifier, set())
+                     | self.vaccination_schedules.get(subject_identifier, set()))
+        schedules = [name for name in schedules if name]
+        if any(name.startswith('esr21_sub') for name in schedules):
+            return 'sub'
+        if any(name.startswith(('esr21_enrol', 'esr21_fu', 'esr21_boost'))
+               for name in schedules):
+            return 'main'
+        return None
+
+    def facts(self):
+        """
+        Return a SubjectFacts row (dict) per consented or vaccinated
+        participant.
+        """
+        pregnant = {subject_identifier for subject_identifier, _ in self.pregnancies}
+        first_dose_enrolled = self.subjects_with_dose('first_dose')
+        rows = []
+        for subject_identifier in sorted(
+                set(self.consents) | {v[0] for v in self.vaccinations}):
+            gender, dob = self.consents.get(subject_identifier, (None, None))
+            enrolment_date, enrolment_site_id = self.enrolments.get(
+                subject_identifier, (None, None))
+            doses = self.doses.get(subject_identifier, {})
+            dose_quantity, *products = (
+                self.histories.get(subject_identifier) or (None, None, None, None))
+            enrolled = subject_identifier in first_dose_enrolled
+            rows.append(dict(
+                subject_identifier=subject_identifier,
+                site_id=self.consent_sites.get(subject_identifier) or enrolment_site_id,
+                gender=gender,
+                dob=dob,
+                enrolled=enrolled,
+                enrolment_dose=(self.elsewhere(subject_identifier)
+                                or ('first_dose' if enrolled else None)),
+                enrolment_date=enrolment_date,
+                enrolment_age=(self.age(enrolment_date, dob)
+                               if enrolment_date and dob else None),
+                first_dose_date=doses.get('first_dose', (None, None))[0],
+                second_dose_date=doses.get('second_dose', (None, None))[0],
+                booster_dose_date=doses.get('booster_dose', (None, None))[0],
+                dose1_product_name=products[0],
+                dose2_product_name=products[1],
+                dose3_product_name=products[2],
+                series=self.series(subject_identifier),
+                cohort=self.cohort(subject_identifier),
+                hiv_status=self.hiv_status(subject_identifier),
+                pregnant=subject_identifier in pregnant,
+                diabetes=bool(self.diabetes.get(subject_identifier))))
+        return rows
+
+    def build(self):
+        """
+        Upsert the facts of the subjects, deleting the rows of subjects that
+        no longer have any.
+        """
+        scope = None
+        if self.subject_identifiers is not None:
+            scope = {'subject_identifier__in': self.subject_identifiers}
+        rows = self.facts()
+        with transaction.atomic():
+            return self.upsert(
+                model_cls=SubjectFacts, key='subject_identifier', rows=rows,
+                prune=True, scope=scope)
+
+    def changed_subjects(self, since=None):
+        """
+        Return the subjects with source rows created or modified since.
+        """
+        subject_identifiers = set()
+        for model, subject_lookup in self.fact_sources:
+            subject_identifiers.update(self.get_model_cls(model).objects.filter(
+                modified__gte=since).order_by().values_list(
+                subject_lookup, flat=True).distinct())
+        return subject_identifiers
+
+    def refresh(self, full=False):
+        """
+        Rebuild all the facts, or only those of the subjects changed since the
+        last refresh, in chunks of refresh_chunk_size subjects. Source rows
+        deleted since are only accounted for by a full rebuild.
+        """
+        watermark, _ = DataQueryWatermark.objects.get_or_create(
+            rule_name=self.watermark_name, scope='all')
+        high_water_mark = get_utcnow()
+        if full or not watermark.watermark:
+            results = self.build()
+        else:
+            subject_identifiers = sorted(
+                self.changed_subjects(since=watermark.watermark))
+            counts = Counter()
+            for index in range(0, len(subject_identifiers), self.refresh_chunk_size):
+                builder = self.__class__(
+                    subject_identifiers=subject_identifiers[
+                        index:index + self.refresh_chunk_size],
+                    chunk_size=self.chunk_size, dry_run=self.dry_run)
+                counts.update(builder.build())
+            results = dict(created=counts.get('created', 0),
+                           updated=counts.get('updated', 0),
+                           deleted=counts.get('deleted', 0))
+        if not self.dry_run:
+            watermark.watermark = high_water_mark
+            watermark.save()
+        return results
+
+
+class SubjectFactsQuery:
+    """
+    Report counts over SubjectFacts, each a single GROUP BY query, e.g.
+
+        facts = SubjectFactsQuery(enrolled=True)
+        facts.row('Males', gender='M')
+        => ['Males', total, site 1, site 2, ...]
+    """
+
+    def __init__(self, **filters):
+        self.filters = filters
+
+    @cached_property
+    def site_ids(self):
+        return list(Site.objects.order_by('id').values_list('id', flat=True))
+
+    @property
+    def queryset(self):
+        return SubjectFacts.objects.filter(**self.filters)
+
+    def filter(self, **filters):
+        return self.__class__(**self.filters, **filters)
+
+    def counts_by(self, *fields, **filters):
+        """
+        Return {(field value, ...): number of subjects}.
+        """
+        counts = self.queryset.filter(**filters).order_by().values(
+            *fields).annotate(total=Count('pk'))
+        return {tuple(count.get(field) for field in fields): count.get('total')
+                for count in counts}
+
+    def counts_by_site(self, **filters):
+        return {site_id: total for (site_id, ), total in self.counts_by(
+            'site_id', **filters).items()}
+
+    def row(self, label=None, **filters):
+        """
+        Return [label, total, *per site count] in site id order.
+        """
+        counts = self.counts_by_site(**filters)
+        totals = [counts.get(site_id, 0) for site_id in self.site_ids]
+        return [label, sum(totals), *totals]
+
+    def ages(self, **filters):
+        return list(self.queryset.filter(
+            enrolment_age__isnull=False, **filters).values_list(
+            'enrolment_age', flat=True))
@@ -0,0 +1,121 @@
+from collections import Counter, namedtuple
+
+from django.apps import apps as django_apps
+from django.utils.functional import cached_property
+from edc_constants.constants import YES
+
+
+VaccinationMismatch = namedtuple(
+    'VaccinationMismatch', 'subject_identifier dose site_id mismatch')
+
+MISSING_HISTORY = 'missing_history'
+PRODUCT_MISMATCH = 'product'
+DATE_MISMATCH = 'date'
+
+
+class VaccinationReconciliation:
+    """
+    Reconciles the vaccination details against the vaccination history.
+
+    Both tables are loaded once as dicts keyed by subject_identifier, then
+    every dose received is compared with the history's product name and date
+    for that dose number in one pass.
+    """
+
+    vaccination_details_model = 'esr21_subject.vaccinationdetails'
+    vaccination_history_model = 'esr21_subject.vaccinationhistory'
+
+    dose_numbers = {
+        'first_dose': 1,
+        'second_dose': 2,
+        'booster_dose': 3,
+    }
+    product_name = 'azd_1222'
+
+    def __init__(self, vaccinations=None):
+        self._vaccinations = vaccinations
+
+    @property
+    def vaccination_details_cls(self):
+        return django_apps.get_model(self.vaccination_details_model)
+
+    @property
+    def vaccination_history_cls(self):
+        return django_apps.get_model(self.vaccination_history_model)
+
+    @property
+    def vaccinations_queryset(self):
+        if self._vaccinations is None:
+            return self.vaccination_details_cls.objects.filter(received_dose=YES)
+        return self._vaccinations
+
+    @cached_property
+    def vaccinations(self):
+        """
+        Return the doses received as {subject_identifier: [(dose,
+        vaccination_date, site_id), ...]}.
+        """
+        by_subject = {}
+        for subject_identifier, dose, vaccination_date, site_id in (
+                self.vaccinations_queryset.order_by('vaccination_date').values_list(
+                    'subject_visit__subject_identifier', 'received_dose_before',
+                    'vaccination_date', 'site_id')):
+            by_subject.setdefault(subject_identifier, []).append(
+                (dose, vaccination_date, site_id))
+        return by_subject
+
+    @cached_property
+    def histories(self):
+        """
+        Return the vaccination history product names and dates per dose number
+        as {subject_identifier: {'dose1_product_name': ..., ...}}.
+        """
+        fields = []
+        for dose_number in self.dose_numbers.values():
+            fields += [f'dose{dose_number}_product_name', f'dose{dose_number}_date']
+        histories = self.vaccination_history_cls.objects.filter(
+            received_vaccine=YES,
+            subject_identifier__in=self.vaccinations_queryset.values(
+                'subject_visit__subject_identifier')).order_by(
+            'created').values('subject_identifier', *fields)
+        # The latest history wins.
+        return {history.get('subject_identifier'): history for history in histories}
+
+    @cached_property
+    def mismatches(self):
+        mismatches = []
+        for subject_identifier, doses in self.vaccinations.items():
+            history = self.histories.get(subject_identifier)
+            if not history:
+                mismatches.append(VaccinationMismatch(
+                    subject_identifier, None, doses[-1][2], MISSING_HISTORY))
+                continue
+            for dose, vaccination_date, site_id in doses:
+                dose_number = self.dose_numbers.get(dose)
+                if not dose_number:
+                    continue
+                if history.get(f'dose{dose_number}_product_name') != self.product_name:
+                    mismatches.append(VaccinationMismatch(
+                        subject_identifier, dose, site_id, PRODUCT_MISMATCH))
+                vaccination_date = vaccination_date.date() if vaccination_date else None
+                if history.get(f'dose{dose_number}_date') != vaccination_date:
+                    mismatches.append(VaccinationMismatch(
+                        subject_identifier, dose, site_id, DATE_MISMATCH))
+        return mismatches
+
+    def counts_by_dose(self):
+        """
+        Return the number of product and date mismatches per dose.
+        """
+        return Counter(mismatch.dose for mismatch in self.mismatches
+                       if mismatch.mismatch != MISSING_HISTORY)
+
+    def counts_by_site(self):
+        return Counter(mismatch.site_id for mismatch in self.mismatches)
+
+    def counts_by_dose_and_site(self):
+        """
+        Return the number of mismatches per (dose, site_id), a dose of None
+        counting the participants missing a vaccination history.
+        """
+        return Counter((mismatch.dose, mismatch.site_id) for mismatch in self.mismatches)
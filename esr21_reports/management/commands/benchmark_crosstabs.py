@@ -0,0 +1,135 @@
+import time
+
+from django.apps import apps as django_apps
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from edc_constants.constants import IND, MALE, NEG, POS
+
+from ...classes import SiteCrosstab
+
+
+class LoopTables:
+    """
+    The report tables as computed before SiteCrosstab, one count query per
+    (metric, site), kept as the benchmark baseline.
+    """
+
+    def __init__(self, site_ids=None):
+        self.site_ids = site_ids
+
+    def model_cls(self, model):
+        return django_apps.get_model(model)
+
+    @property
+    def enrolled_pids(self):
+        return self.model_cls('esr21_subject.vaccinationdetails').objects.filter(
+            received_dose_before='first_dose').values_list(
+            'subject_visit__subject_identifier', flat=True).distinct()
+
+    def row(self, label=None, count=None):
+        totals = [count(site_id) for site_id in self.site_ids]
+        return [label, sum(totals), *totals]
+
+    def hiv_statistics(self):
+        model_cls = self.model_cls('esr21_subject.rapidhivtesting')
+
+        def count(status):
+            return lambda site_id: model_cls.objects.filter((
+                Q(subject_visit__subject_identifier__in=self.enrolled_pids) &
+                Q(site_id=site_id)) & (Q(hiv_result=status) |
+                                       Q(rapid_test_result=status))).count()
+
+        return [self.row('HIV Positive', count(POS)),
+                self.row('HIV Negative', count(NEG)),
+                self.row('Unknown', count(IND))]
+
+    def race_statistics(self):
+        model_cls = self.model_cls('esr21_subject.demographicsdata')
+
+        def count(**filters):
+            return lambda site_id: model_cls.objects.filter(
+                subject_visit__subject_identifier__in=self.enrolled_pids,
+                site_id=site_id, **filters).count()
+
+        return [self.row('Black African', count(ethnicity='Black African')),
+                self.row('Asian', count(ethnicity='Asian')),
+                self.row('Caucasian', count(ethnicity='Caucasian')),
+                self.row('Other Race', count(ethnicity_other__isnull=False))]
+
+    def pregnancy_statistics(self):
+        male_consents = self.model_cls('esr21_subject.informedconsent').objects.filter(
+            gender=MALE).values_list('subject_identifier', flat=True)
+        return self.row('Pregnancies', lambda site_id: self.model_cls(
+            'esr21_subject.pregnancytest').objects.filter(
+            site_id=site_id, subject_visit__subject_identifier__in=self.enrolled_pids,
+            result=POS).exclude(
+            subject_visit__subject_identifier__in=male_consents).count())
+
+    def pregnant_enrollment(self):
+        return self.row('Pregnant Enrollment', lambda site_id: self.model_cls(
+            'esr21_subject.pregnancytest').objects.filter(
+            result=POS, site_id=site_id,
+            subject_visit__subject_identifier__in=self.enrolled_pids).values_list(
+            'subject_visit__subject_identifier', flat=True).distinct().count())
+
+    def dose_at_enrollment(self, label=None, dose=None, history=None):
+        ids = self.model_cls('esr21_subject.vaccinationhistory').objects.filter(
+            history).values_list('subject_identifier', flat=True)
+        return self.row(label, lambda site_id: self.model_cls(
+            'esr21_subject.vaccinationdetails').objects.filter(
+            site_id=site_id, received_dose_before=dose,
+            subject_visit__subject_identifier__in=ids).values_list(
+            'subject_visit__subject_identifier', flat=True).distinct().count())
+
+    def second_dose_at_enrollment(self):
+        return self.dose_at_enrollment(
+            'Second dose at enrollment', 'second_dose',
+            Q(dose_quantity=1) & ~Q(dose1_product_name='azd_1222'))
+
+    def booster_dose_at_enrollment(self):
+        return self.dose_at_enrollment(
+            'Booster dose at enrollment', 'booster_dose',
+            Q(dose_quantity=2) & ~(Q(dose1_product_name='azd_1222')
+                                   | Q(dose2_product_name='azd_1222')))
+
+
+class Command(BaseCommand):
+
+    help = ('Time the site-stratified report tables computed with SiteCrosstab '
+            'against the per-site count query loops')
+
+    tables = ['hiv_statistics', 'race_statistics', 'pregnancy_statistics',
+              'pregnant_enrollment', 'second_dose_at_enrollment',
+              'booster_dose_at_enrollment']
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of timed runs per table, the best one is reported.')
+
+    def best_of(self, repeat=None, func=None):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    def handle(self, *args, **kwargs):
+        repeat = kwargs.get('repeat')
+        crosstab = SiteCrosstab()
+        loops = LoopTables(site_ids=crosstab.site_ids)
+
+        width = max(len(table) for table in self.tables)
+        self.stdout.write(
+            f'{"Table":<{width}}  {"loops (s)":>10}  {"crosstab (s)":>12}  '
+            f'{"speedup":>8}  {"same":>5}\n')
+        for table in self.tables:
+            loop_time, expected = self.best_of(repeat, getattr(loops, table))
+            crosstab_time, result = self.best_of(repeat, getattr(crosstab, table))
+            speedup = loop_time / crosstab_time if crosstab_time else 0
+            self.stdout.write(
+                f'{table:<{width}}  {loop_time:>10.3f}  {crosstab_time:>12.3f}  '
+                f'{speedup:>7.1f}x  {"yes" if result == expected else "NO":>5}\n')
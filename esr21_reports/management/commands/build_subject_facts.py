@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...classes import SubjectFactsBuilder
+
+
+class Command(BaseCommand):
+
+    help = 'Refresh the per-subject report facts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rebuild the facts of all subjects, not only the changed ones.')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Number of rows written per bulk insert/update.')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Compute the facts without writing them.')
+
+    def handle(self, *args, **kwargs):
+        start = time.monotonic()
+        builder = SubjectFactsBuilder(
+            chunk_size=kwargs.get('chunk_size'),
+            dry_run=kwargs.get('dry_run'))
+        results = builder.refresh(full=kwargs.get('full'))
+        self.stdout.write(
+            f'created {results.get("created")}, updated {results.get("updated")}, '
+            f'deleted {results.get("deleted")}\n')
+        self.stdout.write(f'Done in {time.monotonic() - start:.2f}s')
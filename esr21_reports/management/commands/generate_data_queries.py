@@ -1,46 +1,85 @@
-from django.core.management.base import BaseCommand
+import json
 
-from ...classes import QueryGeneration, COVIDRelatedQueries, HIVStatusQueries
+from django.core.management.base import BaseCommand, CommandError
+
+from ...classes import DataQueryRunner
 
 
 class Command(BaseCommand):
 
     help = 'Generate queries'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Re-check all subjects instead of only the subjects with '
+                 'changes since the last run.')
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=1,
+            help='Number of rules to evaluate at the same time.')
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=None,
+            help='Maximum number of seconds a single rule may run for.')
+        parser.add_argument(
+            '--all-sites',
+            action='store_true',
+            help='Evaluate each rule once across all sites instead of for '
+                 'the current SITE_ID only.')
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue the last unfinished run, skipping the rules it '
+                 'completed and resuming the others from their last '
+                 'committed chunk of subjects.')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Number of subjects evaluated and committed at a time.')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Evaluate the rules without writing action items or '
+                 'advancing the watermarks.')
+        parser.add_argument(
+            '--profile',
+            nargs='?',
+            const='-',
+            default=None,
+            metavar='PATH',
+            help='Write a JSON report with the time, SQL queries, rows fetched '
+                 'and action item counts of each rule to PATH, or stdout.')
+
     def handle(self, *args, **kwargs):
-        general_queries = QueryGeneration()
-        hiv_queries = HIVStatusQueries()
-        covid_queries = COVIDRelatedQueries()
-        print("Generating queries for missing first dose")
-        general_queries.first_dose_second_dose_missing
-        print("Generating queries for vaccinated but not eligible participants")
-        general_queries.ineligible_vaccinated_participant
-        print("Generating queries for male with child bearing potential")
-        general_queries.male_child_bearing_potential
-        print("Generating queries with ae date before vaccination")
-        general_queries.ae_data_issues
-        print("Generating queries for missing enrolment forms")
-        general_queries.missing_enrol_forms
-        print("Generating queries for duplicate subject doses")
-        general_queries.duplicate_subject_doses
-        print("Generating queries for female missing pregnancy status")
-        general_queries.female_missing_preg
-        print("Generating ae stop date not resolved")
-        general_queries.ae_not_resolved
-        print("Generating booster dose with missing second dose")
-        general_queries.booster_dose_missing_second_dose
-        print("Generating booster dose with missing vaccination history")
-        general_queries.booster_dose_missing_vaccination_history
-        print('Generating Vaccination History Vaccine Details Mismatch')
-        general_queries.vaccination_history_vaccine_details_mismatch()
-        print('Generating duplicate enrollment forms')
-        general_queries.duplicate_enrolment()
-        print('Generating COVID related queries')
-        covid_queries.symptomaticinfections_missing()
-        covid_queries.pcr_results_missing()
-        covid_queries.no_infections_symptoms_specified()
-        covid_queries.enrolment_covidsymptoms_pcr_missing()
-        print('Generating HIV related queries')
-        hiv_queries.missing_hiv_test_results()
-#         hiv_queries.neg_hiv_status_on_art()
-        print('Done')
+        runner = DataQueryRunner(
+            full=kwargs.get('full'),
+            jobs=kwargs.get('jobs'),
+            timeout=kwargs.get('timeout'),
+            all_sites=kwargs.get('all_sites'),
+            resume=kwargs.get('resume'),
+            chunk_size=kwargs.get('chunk_size'),
+            dry_run=kwargs.get('dry_run'),
+            profile=bool(kwargs.get('profile')),
+            stdout=self.stdout)
+        results = runner.run()
+
+        if kwargs.get('profile'):
+            self.write_report(runner.report(results), kwargs.get('profile'))
+
+        failed = [name for name, result in results.items()
+                  if result.get('status') != 'done']
+        if failed:
+            raise CommandError(f'Rules did not complete: {", ".join(failed)}')
+        self.stdout.write('Done')
+
+    def write_report(self, report, path):
+        if path == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
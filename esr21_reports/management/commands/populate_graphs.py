@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...classes import GraphMaterializer
+
+
+class Command(BaseCommand):
+
+    help = 'Refresh the report snapshot models and dashboard statistics'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Number of rows written per bulk insert/update.')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Compute the snapshots without writing them.')
+
+    def handle(self, *args, **kwargs):
+        start = time.monotonic()
+        materializer = GraphMaterializer(
+            chunk_size=kwargs.get('chunk_size'),
+            dry_run=kwargs.get('dry_run'))
+        results = materializer.materialize()
+
+        width = max(len(model) for model in results)
+        self.stdout.write(
+            f'{"Model":<{width}}  {"created":>9}  {"updated":>9}  {"deleted":>9}\n')
+        for model, counts in results.items():
+            self.stdout.write(
+                f'{model:<{width}}  {counts.get("created"):>9}  '
+                f'{counts.get("updated"):>9}  {counts.get("deleted"):>9}\n')
+        self.stdout.write(f'Done in {time.monotonic() - start:.2f}s')
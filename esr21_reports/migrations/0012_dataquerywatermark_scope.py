@@ -0,0 +1,27 @@
+# Generated by Django 3.1.4 on 2022-07-06 10:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esr21_reports', '0011_dataquerywatermark'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dataquerywatermark',
+            name='rule_name',
+            field=models.CharField(max_length=150, verbose_name='Rule name'),
+        ),
+        migrations.AddField(
+            model_name='dataquerywatermark',
+            name='scope',
+            field=models.CharField(default='all', help_text="Site id the rule was evaluated for, 'all' for all sites.", max_length=25, verbose_name='Scope'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dataquerywatermark',
+            unique_together={('rule_name', 'scope')},
+        ),
+    ]
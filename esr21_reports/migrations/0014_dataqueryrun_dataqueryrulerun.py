@@ -0,0 +1,79 @@
+# Generated by Django 3.1.4 on 2022-07-11 08:05
+
+import _socket
+from django.db import migrations, models
+import django.db.models.deletion
+import django_revision.revision_field
+import edc_base.model_fields.hostname_modification_field
+import edc_base.model_fields.userfield
+import edc_base.model_fields.uuid_auto_field
+import edc_base.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esr21_reports', '0013_exclusionlistentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataQueryRun',
+            fields=[
+                ('created', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('modified', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('user_created', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user created')),
+                ('user_modified', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user modified')),
+                ('hostname_created', models.CharField(blank=True, default=_socket.gethostname, help_text='System field. (modified on create only)', max_length=60)),
+                ('hostname_modified', edc_base.model_fields.hostname_modification_field.HostnameModificationField(blank=True, help_text='System field. (modified on every save)', max_length=50)),
+                ('revision', django_revision.revision_field.RevisionField(blank=True, editable=False, help_text='System field. Git repository tag:branch:commit.', max_length=75, null=True, verbose_name='Revision')),
+                ('device_created', models.CharField(blank=True, max_length=10)),
+                ('device_modified', models.CharField(blank=True, max_length=10)),
+                ('id', edc_base.model_fields.uuid_auto_field.UUIDAutoField(blank=True, editable=False, help_text='System auto field. UUID primary key.', primary_key=True, serialize=False)),
+                ('scope', models.CharField(help_text="Site id the rules were evaluated for, 'all' for all sites.", max_length=25, verbose_name='Scope')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='running', max_length=15, verbose_name='Status')),
+                ('started', models.DateTimeField(default=edc_base.utils.get_utcnow, verbose_name='Started')),
+                ('ended', models.DateTimeField(blank=True, null=True, verbose_name='Ended')),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DataQueryRuleRun',
+            fields=[
+                ('created', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('modified', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('user_created', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user created')),
+                ('user_modified', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user modified')),
+                ('hostname_created', models.CharField(blank=True, default=_socket.gethostname, help_text='System field. (modified on create only)', max_length=60)),
+                ('hostname_modified', edc_base.model_fields.hostname_modification_field.HostnameModificationField(blank=True, help_text='System field. (modified on every save)', max_length=50)),
+                ('revision', django_revision.revision_field.RevisionField(blank=True, editable=False, help_text='System field. Git repository tag:branch:commit.', max_length=75, null=True, verbose_name='Revision')),
+                ('device_created', models.CharField(blank=True, max_length=10)),
+                ('device_modified', models.CharField(blank=True, max_length=10)),
+                ('id', edc_base.model_fields.uuid_auto_field.UUIDAutoField(blank=True, editable=False, help_text='System auto field. UUID primary key.', primary_key=True, serialize=False)),
+                ('rule_name', models.CharField(max_length=150, verbose_name='Rule name')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('timed out', 'Timed out')], default='pending', max_length=15, verbose_name='Status')),
+                ('high_water_mark', models.DateTimeField(blank=True, help_text='Max modified of the input models when the rule started.', null=True, verbose_name='High-water mark')),
+                ('cursor', models.CharField(blank=True, help_text='Last subject identifier of the last committed chunk.', max_length=50, null=True, verbose_name='Cursor')),
+                ('chunks', models.IntegerField(default=0, verbose_name='Chunks committed')),
+                ('created_count', models.IntegerField(default=0)),
+                ('updated_count', models.IntegerField(default=0)),
+                ('unchanged_count', models.IntegerField(default=0)),
+                ('closed_count', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('data_query_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='esr21_reports.dataqueryrun')),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='dataqueryrulerun',
+            unique_together={('data_query_run', 'rule_name')},
+        ),
+    ]
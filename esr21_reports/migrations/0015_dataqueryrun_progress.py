@@ -0,0 +1,32 @@
+# Generated by Django 3.1.4 on 2022-07-13 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esr21_reports', '0014_dataqueryrun_dataqueryrulerun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataqueryrun',
+            name='task_id',
+            field=models.CharField(blank=True, max_length=50, null=True, verbose_name='Celery task id'),
+        ),
+        migrations.AddField(
+            model_name='dataqueryrun',
+            name='subtasks',
+            field=models.IntegerField(default=0, verbose_name='Number of (rule, site) subtasks'),
+        ),
+        migrations.AddField(
+            model_name='dataqueryrulerun',
+            name='scope',
+            field=models.CharField(default='all', help_text="Site id the rule was evaluated for, 'all' for all sites.", max_length=25, verbose_name='Scope'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dataqueryrulerun',
+            unique_together={('data_query_run', 'rule_name', 'scope')},
+        ),
+    ]
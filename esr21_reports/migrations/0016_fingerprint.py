@@ -0,0 +1,23 @@
+# Generated by Django 3.1.4 on 2022-07-15 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esr21_reports', '0015_dataqueryrun_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataquerywatermark',
+            name='fingerprint',
+            field=models.TextField(blank=True, help_text='JSON of the (row count, max modified) of each input model.', null=True, verbose_name='Input models fingerprint'),
+        ),
+        migrations.AddField(
+            model_name='dataqueryrulerun',
+            name='fingerprint',
+            field=models.TextField(blank=True, help_text='Fingerprint of the input models when the rule started.', null=True, verbose_name='Input models fingerprint'),
+        ),
+    ]
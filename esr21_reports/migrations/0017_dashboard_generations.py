@@ -0,0 +1,74 @@
+# Generated by Django 3.1.4 on 2022-07-18 10:12
+
+import _socket
+from django.db import migrations, models
+import django_revision.revision_field
+import edc_base.model_fields.hostname_modification_field
+import edc_base.model_fields.userfield
+import edc_base.model_fields.uuid_auto_field
+import edc_base.utils
+
+
+def publish_existing_statistics(apps, schema_editor):
+    """
+    Keep the latest row of each key as generation 0 and publish it.
+    """
+    DashboardStatistics = apps.get_model('esr21_reports', 'dashboardstatistics')
+    DashboardGeneration = apps.get_model('esr21_reports', 'dashboardgeneration')
+    seen = set()
+    duplicates = []
+    for pk, key in DashboardStatistics.objects.order_by('-pk').values_list(
+            'pk', 'key'):
+        if key in seen:
+            duplicates.append(pk)
+        seen.add(key)
+    DashboardStatistics.objects.filter(pk__in=duplicates).delete()
+    if seen:
+        DashboardGeneration.objects.create(
+            generation=0, published=edc_base.utils.get_utcnow())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esr21_reports', '0016_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardGeneration',
+            fields=[
+                ('created', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('modified', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('user_created', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user created')),
+                ('user_modified', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user modified')),
+                ('hostname_created', models.CharField(blank=True, default=_socket.gethostname, help_text='System field. (modified on create only)', max_length=60)),
+                ('hostname_modified', edc_base.model_fields.hostname_modification_field.HostnameModificationField(blank=True, help_text='System field. (modified on every save)', max_length=50)),
+                ('revision', django_revision.revision_field.RevisionField(blank=True, editable=False, help_text='System field. Git repository tag:branch:commit.', max_length=75, null=True, verbose_name='Revision')),
+                ('device_created', models.CharField(blank=True, max_length=10)),
+                ('device_modified', models.CharField(blank=True, max_length=10)),
+                ('id', edc_base.model_fields.uuid_auto_field.UUIDAutoField(blank=True, editable=False, help_text='System auto field. UUID primary key.', primary_key=True, serialize=False)),
+                ('generation', models.PositiveIntegerField(unique=True, verbose_name='Generation')),
+                ('published', models.DateTimeField(blank=True, help_text='Set once all the statistics of the generation are written.', null=True, verbose_name='Published')),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='dashboardstatistics',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(publish_existing_statistics, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='dashboardstatistics',
+            unique_together={('generation', 'key')},
+        ),
+        migrations.AddIndex(
+            model_name='dashboardstatistics',
+            index=models.Index(fields=['generation', 'key'], name='dashboard_generation_key_idx'),
+        ),
+    ]
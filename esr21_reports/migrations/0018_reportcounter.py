@@ -0,0 +1,44 @@
+# Generated by Django 3.1.4 on 2022-07-20 14:31
+
+import _socket
+from django.db import migrations, models
+import django_revision.revision_field
+import edc_base.model_fields.hostname_modification_field
+import edc_base.model_fields.userfield
+import edc_base.model_fields.uuid_auto_field
+import edc_base.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esr21_reports', '0017_dashboard_generations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportCounter',
+            fields=[
+                ('created', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('modified', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('user_created', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user created')),
+                ('user_modified', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user modified')),
+                ('hostname_created', models.CharField(blank=True, default=_socket.gethostname, help_text='System field. (modified on create only)', max_length=60)),
+                ('hostname_modified', edc_base.model_fields.hostname_modification_field.HostnameModificationField(blank=True, help_text='System field. (modified on every save)', max_length=50)),
+                ('revision', django_revision.revision_field.RevisionField(blank=True, editable=False, help_text='System field. Git repository tag:branch:commit.', max_length=75, null=True, verbose_name='Revision')),
+                ('device_created', models.CharField(blank=True, max_length=10)),
+                ('device_modified', models.CharField(blank=True, max_length=10)),
+                ('id', edc_base.model_fields.uuid_auto_field.UUIDAutoField(blank=True, editable=False, help_text='System auto field. UUID primary key.', primary_key=True, serialize=False)),
+                ('metric', models.CharField(max_length=50, verbose_name='Metric')),
+                ('site_id', models.IntegerField(verbose_name='Site id')),
+                ('series', models.CharField(blank=True, default='', help_text='homologous or heterologous, blank without a vaccination history.', max_length=25, verbose_name='Series')),
+                ('value', models.IntegerField(default=0, verbose_name='Value')),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+                'unique_together': {('metric', 'site_id', 'series')},
+            },
+        ),
+    ]
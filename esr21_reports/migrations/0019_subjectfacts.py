@@ -0,0 +1,63 @@
+# Generated by Django 3.1.4 on 2022-07-22 09:05
+
+import _socket
+from django.db import migrations, models
+import django_revision.revision_field
+import edc_base.model_fields.hostname_modification_field
+import edc_base.model_fields.userfield
+import edc_base.model_fields.uuid_auto_field
+import edc_base.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esr21_reports', '0018_reportcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubjectFacts',
+            fields=[
+                ('created', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('modified', models.DateTimeField(blank=True, default=edc_base.utils.get_utcnow)),
+                ('user_created', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user created')),
+                ('user_modified', edc_base.model_fields.userfield.UserField(blank=True, help_text='Updated by admin.save_model', max_length=50, verbose_name='user modified')),
+                ('hostname_created', models.CharField(blank=True, default=_socket.gethostname, help_text='System field. (modified on create only)', max_length=60)),
+                ('hostname_modified', edc_base.model_fields.hostname_modification_field.HostnameModificationField(blank=True, help_text='System field. (modified on every save)', max_length=50)),
+                ('revision', django_revision.revision_field.RevisionField(blank=True, editable=False, help_text='System field. Git repository tag:branch:commit.', max_length=75, null=True, verbose_name='Revision')),
+                ('device_created', models.CharField(blank=True, max_length=10)),
+                ('device_modified', models.CharField(blank=True, max_length=10)),
+                ('id', edc_base.model_fields.uuid_auto_field.UUIDAutoField(blank=True, editable=False, help_text='System auto field. UUID primary key.', primary_key=True, serialize=False)),
+                ('subject_identifier', models.CharField(max_length=50, unique=True, verbose_name='Subject identifier')),
+                ('site_id', models.IntegerField(help_text='Site of the consent, else of the first vaccination.', null=True, verbose_name='Site id')),
+                ('gender', models.CharField(max_length=5, null=True, verbose_name='Gender')),
+                ('dob', models.DateField(null=True, verbose_name='Date of birth')),
+                ('enrolled', models.BooleanField(default=False, verbose_name='Has a first dose vaccination')),
+                ('enrolment_dose', models.CharField(help_text='first_dose, or second_dose/booster_dose after doses elsewhere.', max_length=25, null=True, verbose_name='Dose enrolled for')),
+                ('enrolment_date', models.DateTimeField(null=True, verbose_name='First vaccination date')),
+                ('enrolment_age', models.PositiveIntegerField(null=True, verbose_name='Age at first vaccination')),
+                ('first_dose_date', models.DateTimeField(null=True)),
+                ('second_dose_date', models.DateTimeField(null=True)),
+                ('booster_dose_date', models.DateTimeField(null=True)),
+                ('dose1_product_name', models.CharField(max_length=25, null=True)),
+                ('dose2_product_name', models.CharField(max_length=25, null=True)),
+                ('dose3_product_name', models.CharField(max_length=25, null=True)),
+                ('series', models.CharField(max_length=25, null=True, verbose_name='Series')),
+                ('cohort', models.CharField(help_text='main or sub.', max_length=10, null=True, verbose_name='Cohort')),
+                ('hiv_status', models.CharField(max_length=10, null=True, verbose_name='HIV status')),
+                ('pregnant', models.BooleanField(default=False, verbose_name='Has a positive pregnancy test')),
+                ('diabetes', models.BooleanField(default=False, verbose_name='Has diabetes')),
+            ],
+            options={
+                'verbose_name_plural': 'Subject facts',
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='subjectfacts',
+            index=models.Index(fields=['site_id', 'enrolled', 'series'], name='subject_facts_site_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2022-07-22 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esr21_reports', '0019_subjectfacts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataqueryrun',
+            name='rule_names',
+            field=models.TextField(blank=True, help_text='Comma separated names of the rules evaluated, sorted.', null=True, verbose_name='Rule names'),
+        ),
+    ]
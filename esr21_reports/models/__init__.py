@@ -2,7 +2,12 @@ from .age_statistics import AgeStatistics
 from .enrollment_statistics import EnrollmentStatistics
 from .screening_statistics import ScreeningStatistics
 from .vaccination_statistics import VaccinationStatistics
-from .dashboard_statistics import DashboardStatistics
+from .dashboard_statistics import DashboardGeneration, DashboardStatistics
 from .vaccination_enrollments import VaccinationEnrollments
 from .demographics_statistics import DemographicsStatistics
 from .adverse_events import AdverseEvents
+from .data_query_watermark import DataQueryWatermark
+from .exclusion_list_entry import ExclusionListEntry
+from .data_query_run import DataQueryRun, DataQueryRuleRun
+from .report_counter import ReportCounter
+from .subject_facts import SubjectFacts
@@ -2,6 +2,37 @@ from django.db import models
 from edc_base.model_mixins import BaseUuidModel
 
 
+class DashboardGeneration(BaseUuidModel):
+    """
+    A generation of DashboardStatistics. The current generation is the
+    latest published one, so publishing a generation (setting published) is
+    the atomic switch of every key to its new value.
+    """
+
+    generation = models.PositiveIntegerField(
+        verbose_name='Generation',
+        unique=True,
+    )
+
+    published = models.DateTimeField(
+        verbose_name='Published',
+        null=True,
+        blank=True,
+        help_text='Set once all the statistics of the generation are written.'
+    )
+
+    class Meta(BaseUuidModel.Meta):
+        pass
+
+
 class DashboardStatistics(BaseUuidModel):
+    generation = models.PositiveIntegerField(default=0)
     key = models.CharField(max_length=50)
     value = models.TextField()
+
+    class Meta:
+        unique_together = ('generation', 'key')
+        indexes = [
+            models.Index(fields=['generation', 'key'],
+                         name='dashboard_generation_key_idx'),
+        ]
@@ -0,0 +1,160 @@
+from django.db import models
+from django.db.models.deletion import CASCADE
+from edc_base.model_mixins import BaseUuidModel
+from edc_base.utils import get_utcnow
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+PENDING = 'pending'
+TIMED_OUT = 'timed out'
+
+RUN_STATUS = (
+    (RUNNING, 'Running'),
+    (DONE, 'Done'),
+    (FAILED, 'Failed'),
+)
+
+RULE_RUN_STATUS = (
+    (PENDING, 'Pending'),
+    (RUNNING, 'Running'),
+    (DONE, 'Done'),
+    (FAILED, 'Failed'),
+    (TIMED_OUT, 'Timed out'),
+)
+
+
+class DataQueryRun(BaseUuidModel):
+    """
+    Ledger of a generate_data_queries run, also the progress record of a
+    run fanned out as Celery subtasks.
+    """
+
+    scope = models.CharField(
+        verbose_name='Scope',
+        max_length=25,
+        help_text='Site id the rules were evaluated for, \'all\' for all sites.'
+    )
+
+    task_id = models.CharField(
+        verbose_name='Celery task id',
+        max_length=50,
+        null=True,
+        blank=True
+    )
+
+    subtasks = models.IntegerField(
+        verbose_name='Number of (rule, site) subtasks',
+        default=0,
+    )
+
+    rule_names = models.TextField(
+        verbose_name='Rule names',
+        null=True,
+        blank=True,
+        help_text='Comma separated names of the rules evaluated, sorted.'
+    )
+
+    status = models.CharField(
+        verbose_name='Status',
+        max_length=15,
+        choices=RUN_STATUS,
+        default=RUNNING,
+    )
+
+    started = models.DateTimeField(
+        verbose_name='Started',
+        default=get_utcnow,
+    )
+
+    ended = models.DateTimeField(
+        verbose_name='Ended',
+        null=True,
+        blank=True
+    )
+
+    class Meta(BaseUuidModel.Meta):
+        pass
+
+
+class DataQueryRuleRun(BaseUuidModel):
+    """
+    Ledger of a rule within a run, with the cursor (last subject identifier)
+    of the last committed chunk of subjects.
+    """
+
+    data_query_run = models.ForeignKey(DataQueryRun, on_delete=CASCADE)
+
+    rule_name = models.CharField(
+        verbose_name='Rule name',
+        max_length=150,
+    )
+
+    scope = models.CharField(
+        verbose_name='Scope',
+        max_length=25,
+        default='all',
+        help_text='Site id the rule was evaluated for, \'all\' for all sites.'
+    )
+
+    status = models.CharField(
+        verbose_name='Status',
+        max_length=15,
+        choices=RULE_RUN_STATUS,
+        default=PENDING,
+    )
+
+    high_water_mark = models.DateTimeField(
+        verbose_name='High-water mark',
+        null=True,
+        blank=True,
+        help_text='Max modified of the input models when the rule started.'
+    )
+
+    fingerprint = models.TextField(
+        verbose_name='Input models fingerprint',
+        null=True,
+        blank=True,
+        help_text='Fingerprint of the input models when the rule started.'
+    )
+
+    cursor = models.CharField(
+        verbose_name='Cursor',
+        max_length=50,
+        null=True,
+        blank=True,
+        help_text='Last subject identifier of the last committed chunk.'
+    )
+
+    chunks = models.IntegerField(
+        verbose_name='Chunks committed',
+        default=0,
+    )
+
+    created_count = models.IntegerField(default=0)
+
+    updated_count = models.IntegerField(default=0)
+
+    unchanged_count = models.IntegerField(default=0)
+
+    closed_count = models.IntegerField(default=0)
+
+    error = models.TextField(
+        null=True,
+        blank=True
+    )
+
+    class Meta(BaseUuidModel.Meta):
+        unique_together = ('data_query_run', 'rule_name', 'scope')
+
+    @property
+    def counts(self):
+        return dict(created=self.created_count,
+                    updated=self.updated_count,
+                    unchanged=self.unchanged_count,
+                    closed=self.closed_count)
+
+    def add_counts(self, counts=None):
+        for name, count in counts.items():
+            field = f'{name}_count'
+            setattr(self, field, getattr(self, field) + count)
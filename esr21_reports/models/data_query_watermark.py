@@ -0,0 +1,37 @@
+from django.db import models
+from edc_base.model_mixins import BaseUuidModel
+
+
+class DataQueryWatermark(BaseUuidModel):
+    """
+    High-water mark (max modified of the rule's input models) of the last
+    successful evaluation of a data query rule.
+    """
+
+    rule_name = models.CharField(
+        verbose_name='Rule name',
+        max_length=150,
+    )
+
+    scope = models.CharField(
+        verbose_name='Scope',
+        max_length=25,
+        default='all',
+        help_text='Site id the rule was evaluated for, \'all\' for all sites.'
+    )
+
+    watermark = models.DateTimeField(
+        verbose_name='High-water mark',
+        null=True,
+        blank=True
+    )
+
+    fingerprint = models.TextField(
+        verbose_name='Input models fingerprint',
+        null=True,
+        blank=True,
+        help_text='JSON of the (row count, max modified) of each input model.'
+    )
+
+    class Meta(BaseUuidModel.Meta):
+        unique_together = ('rule_name', 'scope')
@@ -0,0 +1,26 @@
+from django.db import models
+from edc_base.model_mixins import BaseUuidModel
+
+
+class ExclusionListEntry(BaseUuidModel):
+    """
+    Staging table of the subject identifiers in the exclusion list CSVs, for
+    set-based exclusion in the data query rules.
+    """
+
+    list_name = models.CharField(
+        verbose_name='Exclusion list',
+        max_length=50,
+    )
+
+    subject_identifier = models.CharField(
+        verbose_name='Subject identifier',
+        max_length=50,
+    )
+
+    class Meta(BaseUuidModel.Meta):
+        unique_together = ('list_name', 'subject_identifier')
+        indexes = [
+            models.Index(fields=['subject_identifier', 'list_name'],
+                         name='exclusion_subject_idx'),
+        ]
@@ -0,0 +1,34 @@
+from django.db import models
+from edc_base.model_mixins import BaseUuidModel
+
+
+class ReportCounter(BaseUuidModel):
+    """
+    A headline count maintained incrementally from the esr21_subject save
+    and delete signals, see classes.ReportCounters.
+    """
+
+    metric = models.CharField(
+        verbose_name='Metric',
+        max_length=50,
+    )
+
+    site_id = models.IntegerField(
+        verbose_name='Site id',
+    )
+
+    series = models.CharField(
+        verbose_name='Series',
+        max_length=25,
+        blank=True,
+        default='',
+        help_text='homologous or heterologous, blank without a vaccination history.'
+    )
+
+    value = models.IntegerField(
+        verbose_name='Value',
+        default=0,
+    )
+
+    class Meta(BaseUuidModel.Meta):
+        unique_together = ('metric', 'site_id', 'series')
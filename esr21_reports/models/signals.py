@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from ..classes.dashboard_statistics_store import decoded_statistics
+from ..classes.report_counters import report_counters
+from .dashboard_statistics import DashboardGeneration, DashboardStatistics
+
+
+@receiver(post_save, weak=False, sender=DashboardGeneration,
+          dispatch_uid='dashboard_generation_on_post_save')
+def dashboard_generation_on_post_save(sender, instance, raw, created, **kwargs):
+    """
+    Re-check the current generation on the next read.
+    """
+    decoded_statistics.invalidate()
+
+
+@receiver(post_save, weak=False, sender=DashboardStatistics,
+          dispatch_uid='dashboard_statistics_on_post_save')
+@receiver(post_delete, weak=False, sender=DashboardStatistics,
+          dispatch_uid='dashboard_statistics_on_post_delete')
+def dashboard_statistics_on_post_save(sender, instance, **kwargs):
+    """
+    Drop the decoded values, a statistics row having been changed in place.
+    """
+    decoded_statistics.clear()
+
+
+def counted(sender):
+    return (report_counters.enabled
+            and report_counters.get_source(sender._meta.label_lower) is not None)
+
+
+@receiver(pre_save, weak=False, dispatch_uid='report_counters_on_pre_save')
+@receiver(pre_delete, weak=False, dispatch_uid='report_counters_on_pre_delete')
+def report_counters_on_pre_save(sender, instance, raw=False, **kwargs):
+    """
+    Keep the counter keys of the row as it is before the save or delete.
+    """
+    if not raw and counted(sender) and instance.pk:
+        instance._report_counter_keys = report_counters.keys(
+            model=sender._meta.label_lower, pk=instance.pk)
+
+
+@receiver(post_save, weak=False, dispatch_uid='report_counters_on_post_save')
+def report_counters_on_post_save(sender, instance, raw, created, **kwargs):
+    if not raw and counted(sender):
+        report_counters.on_commit(report_counters.deltas(
+            old_keys=getattr(instance, '_report_counter_keys', None),
+            new_keys=report_counters.keys(
+                model=sender._meta.label_lower, pk=instance.pk)))
+
+
+@receiver(post_delete, weak=False, dispatch_uid='report_counters_on_post_delete')
+def report_counters_on_post_delete(sender, instance, **kwargs):
+    if counted(sender):
+        report_counters.on_commit(report_counters.deltas(
+            old_keys=getattr(instance, '_report_counter_keys', None)))
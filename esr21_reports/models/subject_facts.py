@@ -0,0 +1,102 @@
+from django.db import models
+from edc_base.model_mixins import BaseUuidModel
+
+
+class SubjectFacts(BaseUuidModel):
+    """
+    One row of denormalized report facts per participant, rebuilt by the
+    build_subject_facts command, see classes.SubjectFactsBuilder.
+    """
+
+    subject_identifier = models.CharField(
+        verbose_name='Subject identifier',
+        max_length=50,
+        unique=True,
+    )
+
+    site_id = models.IntegerField(
+        verbose_name='Site id',
+        null=True,
+        help_text='Site of the consent, else of the first vaccination.'
+    )
+
+    gender = models.CharField(
+        verbose_name='Gender',
+        max_length=5,
+        null=True,
+    )
+
+    dob = models.DateField(
+        verbose_name='Date of birth',
+        null=True,
+    )
+
+    enrolled = models.BooleanField(
+        verbose_name='Has a first dose vaccination',
+        default=False,
+    )
+
+    enrolment_dose = models.CharField(
+        verbose_name='Dose enrolled for',
+        max_length=25,
+        null=True,
+        help_text='first_dose, or second_dose/booster_dose after doses elsewhere.'
+    )
+
+    enrolment_date = models.DateTimeField(
+        verbose_name='First vaccination date',
+        null=True,
+    )
+
+    enrolment_age = models.PositiveIntegerField(
+        verbose_name='Age at first vaccination',
+        null=True,
+    )
+
+    first_dose_date = models.DateTimeField(null=True)
+
+    second_dose_date = models.DateTimeField(null=True)
+
+    booster_dose_date = models.DateTimeField(null=True)
+
+    dose1_product_name = models.CharField(max_length=25, null=True)
+
+    dose2_product_name = models.CharField(max_length=25, null=True)
+
+    dose3_product_name = models.CharField(max_length=25, null=True)
+
+    series = models.CharField(
+        verbose_name='Series',
+        max_length=25,
+        null=True,
+    )
+
+    cohort = models.CharField(
+        verbose_name='Cohort',
+        max_length=10,
+        null=True,
+        help_text='main or sub.'
+    )
+
+    hiv_status = models.CharField(
+        verbose_name='HIV status',
+        max_length=10,
+        null=True,
+    )
+
+    pregnant = models.BooleanField(
+        verbose_name='Has a positive pregnancy test',
+        default=False,
+    )
+
+    diabetes = models.BooleanField(
+        verbose_name='Has diabetes',
+        default=False,
+    )
+
+    class Meta(BaseUuidModel.Meta):
+        verbose_name_plural = 'Subject facts'
+        indexes = [
+            models.Index(fields=['site_id', 'enrolled', 'series'],
+                         name='subject_facts_site_idx'),
+        ]
@@ -1,7 +1,15 @@
-from celery import shared_task
+from celery import chord, shared_task
 from celery.signals import worker_process_init
 from celery.utils.log import get_task_logger
+from django.contrib.sites.models import Site
 from django.core.management import call_command
+from edc_base.utils import get_utcnow
+
+from .classes import (
+    DataQueryProgress, DataQueryRunner, SubjectFactsBuilder, data_query_rules,
+    report_counters)
+from .models import DataQueryRun
+from .models.data_query_run import DONE, FAILED
 
 logger = get_task_logger(__name__)
 
@@ -15,3 +23,70 @@ def configure_workers(sender=None, conf=None, **kwargs):
 @shared_task
 def pull_reports_data():
     call_command('populate_graphs')
+
+
+@shared_task(bind=True)
+def generate_data_queries(self, full=False, site_ids=None):
+    """
+    Fan out one subtask per (rule, site) as a chord, the callback closing the
+    run. Returns the id of the DataQueryRun to poll for progress.
+    """
+    site_ids = site_ids or list(Site.objects.order_by('id').values_list('id', flat=True))
+    data_query_run = DataQueryRun.objects.create(
+        scope='all',
+        rule_names=','.join(sorted(rule.name for rule in data_query_rules)),
+        task_id=self.request.id,
+        subtasks=len(data_query_rules) * len(site_ids))
+
+    header = [run_data_query_rule.s(
+        rule_name=rule.name, site_id=site_id,
+        run_id=str(data_query_run.id), full=full)
+        for rule in data_query_rules for site_id in site_ids]
+    chord(header)(finish_data_query_run.s(run_id=str(data_query_run.id)))
+    return str(data_query_run.id)
+
+
+@shared_task
+def run_data_query_rule(rule_name=None, site_id=None, run_id=None, full=False):
+    runner = DataQueryRunner(full=full, site_id=site_id, run_id=run_id)
+    result = runner.timed_run_rule(runner.get_rule(rule_name))
+    if result.get('error'):
+        logger.error(f'{rule_name} (site {site_id}): {result.get("error")}')
+    return dict(rule_name=rule_name, site_id=site_id, **result)
+
+
+@shared_task
+def finish_data_query_run(results, run_id=None):
+    """
+    Chord callback, closes the run and returns the counts aggregated per
+    rule.
+    """
+    data_query_run = DataQueryRun.objects.get(id=run_id)
+    failed = any(result.get('status') != DONE for result in results)
+    data_query_run.status = FAILED if failed else DONE
+    data_query_run.ended = get_utcnow()
+    data_query_run.save()
+    return DataQueryProgress(data_query_run).as_dict()
+
+
+@shared_task
+def reconcile_report_counters():
+    """
+    Verify the delta-maintained report counters against a full recount,
+    correcting and logging the ones that drifted.
+    """
+    corrected = report_counters.reconcile()
+    for (metric, site_id, series), (value, recounted) in corrected.items():
+        logger.warning(
+            f'Report counter {metric} (site {site_id}, {series or "no series"}) '
+            f'was {value}, recounted {recounted}')
+    return len(corrected)
+
+
+@shared_task
+def refresh_subject_facts(full=False):
+    """
+    Refresh the facts of the subjects changed since the last refresh, or of
+    all subjects with full.
+    """
+    return SubjectFactsBuilder().refresh(full=full)
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.urls import path
 
-from .views import (HomeView, PSRTView, GraphsView, LabView)
+from .views import (HomeView, PSRTView, GraphsView, LabView,
+                    DataQueryStatusView)
 
 from .views import line_chart, line_chart_json
 
@@ -16,5 +17,9 @@ urlpatterns = [
     path('lab', LabView.as_view(), name='esr21_lab_report_url'),
     path('chart', line_chart, name='line_chart_url'),
     path('chartJSON', line_chart_json, name='line_chart_json_url'),    
+    path('data-queries/status', DataQueryStatusView.as_view(),
+         name='data_query_status_url'),
+    path('data-queries/<uuid:run_id>/status', DataQueryStatusView.as_view(),
+         name='data_query_status_url'),
 
 ]
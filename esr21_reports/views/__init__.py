@@ -1,3 +1,4 @@
+from .data_query_status_view import DataQueryStatusView
 from .graphs import line_chart, line_chart_json
 from .graphs_report_view import GraphsView
 from .home_view import HomeView
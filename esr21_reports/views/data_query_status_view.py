@@ -0,0 +1,22 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.views.generic import View
+
+from ..classes import DataQueryProgress
+from ..models import DataQueryRun
+
+
+class DataQueryStatusView(LoginRequiredMixin, View):
+    """
+    JSON progress of a data query run, the latest run if no run id is given.
+    """
+
+    def get(self, request, *args, **kwargs):
+        run_id = kwargs.get('run_id')
+        if run_id:
+            data_query_run = DataQueryRun.objects.filter(id=run_id).first()
+        else:
+            data_query_run = DataQueryRun.objects.order_by('-started').first()
+        if not data_query_run:
+            return JsonResponse({'error': 'Data query run not found.'}, status=404)
+        return JsonResponse(DataQueryProgress(data_query_run).as_dict())
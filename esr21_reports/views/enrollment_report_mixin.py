@@ -1,7 +1,9 @@
 from django.apps import apps as django_apps
 from django.contrib.sites.models import Site
 from django.db.models import Q
+from django.utils.functional import cached_property
 from edc_base.view_mixins import EdcBaseViewMixin
+from ..classes import SiteCrosstab
 from ..models import VaccinationEnrollments, ScreeningStatistics
 
 
@@ -53,20 +55,13 @@ class EnrollmentReportMixin(EdcBaseViewMixin):
     def covid_19_results_cls(self):
         return django_apps.get_model(self.covid_19_results_model)
 
+    @cached_property
+    def site_crosstab(self):
+        return SiteCrosstab(site_ids=range(40, 45))
+
     @property
     def pregnant_enrollment(self):
-        ids = self.vaccination_model_cls.objects.filter(
-            received_dose_before='first_dose').values_list(
-            'subject_visit__subject_identifier', flat=True).distinct()
-        totals = []
-        for site_id in range(40, 45):
-            total = self.pregnancy_test_cls.objects.filter(
-                result='POS', site_id=site_id,
-                subject_visit__subject_identifier__in=ids).values_list(
-                    'subject_visit__subject_identifier', flat=True).distinct().count()
-            totals.append(total)
-
-        return ['Pregnant Enrollment', sum(totals), *totals]
+        return self.site_crosstab.pregnant_enrollment()
 
     @property
     def covid_positives(self):
@@ -81,43 +76,11 @@ class EnrollmentReportMixin(EdcBaseViewMixin):
 
     @property
     def second_dose_at_enrollment(self):
-        totals = []
-
-        ids = self.vaccination_history_cls.objects.filter(
-            Q(dose_quantity=1)).exclude(
-            Q(dose1_product_name='azd_1222')).values_list('subject_identifier',
-                                                          flat=True)
-
-        for site_id in range(40, 45):
-            total_second_dose = self.vaccination_model_cls.objects.filter(
-                site_id=site_id,
-                received_dose_before='second_dose',
-                subject_visit__subject_identifier__in=ids).values_list(
-                    'subject_visit__subject_identifier', flat=True).distinct().count()
-            totals.append(total_second_dose)
-
-        return ['Second dose at enrollment', sum(totals), *totals]
+        return self.site_crosstab.second_dose_at_enrollment()
 
     @property
     def booster_dose_at_enrollment(self):
-        totals = []
-
-        ids = self.vaccination_history_cls.objects.filter(
-            dose_quantity=2).exclude(
-                Q(dose1_product_name='azd_1222') | Q(dose2_product_name='azd_1222')).values_list(
-                'subject_identifier', flat=True)
-
-        for site_id in range(40, 45):
-            total_booster = self.vaccination_model_cls.objects.filter(
-                site_id=site_id,
-                received_dose_before='booster_dose',
-                subject_visit__subject_identifier__in=ids
-                ).values_list('subject_visit__subject_identifier',
-                              flat=True).distinct().count()
-
-            totals.append(total_booster)
-
-        return ['Booster dose at enrollment', sum(totals), *totals]
+        return self.site_crosstab.booster_dose_at_enrollment()
 
     @property
     def screening_for_second_dose(self):
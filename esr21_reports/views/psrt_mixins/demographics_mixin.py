@@ -5,7 +5,8 @@ from esr21_subject.models import *
 from dateutil.relativedelta import relativedelta
 from django.contrib.sites.models import Site
 from edc_constants.constants import *
-from django.db.models import Q
+from django.utils.functional import cached_property
+from ...classes import SiteCrosstab, SubjectFactsQuery
 
 
 class DemographicsMixin(EdcBaseViewMixin):
@@ -40,39 +41,27 @@ class DemographicsMixin(EdcBaseViewMixin):
 
         return total_enrolled
 
+    @cached_property
+    def site_crosstab(self):
+        return SiteCrosstab(site_ids=self.site_ids)
+
+    @property
+    def subject_facts(self):
+        return SubjectFactsQuery(enrolled=True)
+
     @property
     def males_statistics(self):
         """
         Males enrolled in the study 
         """
-        males = []
-
-        for site_id in self.site_ids:
-
-            males_consented = InformedConsent.objects.filter(
-                site_id=site_id, gender=MALE, subject_identifier__in=self.enrolled_pids).count()
-            males.append(males_consented)
-
-        males.insert(0, sum(males))
-
-        return ['Males', *males]
+        return self.subject_facts.row('Males', gender=MALE)
 
     @property
     def females_statistics(self):
         """
         Females enrolled in the study
         """
-        females = []
-
-        for site_id in self.site_ids:
-
-            females_consented = InformedConsent.objects.filter(
-                site_id=site_id, gender=FEMALE, subject_identifier__in=self.enrolled_pids).count()
-            females.append(females_consented)
-
-        females.insert(0, sum(females))
-
-        return ['Females', *females]
+        return self.subject_facts.row('Females', gender=FEMALE)
 
     def _get_age_range(self, site_id, lower_limit_age, upper_limit_age=None) -> int:
 
@@ -139,76 +128,11 @@ class DemographicsMixin(EdcBaseViewMixin):
 
     @property
     def hiv_statistics(self):
-        hiv_positive = []
-        hiv_negative = []
-        hiv_unknown = []
-
-        for site_id in self.site_ids:
-
-            status = POS
-            positive = RapidHIVTesting.objects.filter((
-                Q(subject_visit__subject_identifier__in=self.enrolled_pids) &
-                Q(site_id=site_id)) & (Q(hiv_result=status) |
-                                       Q(rapid_test_result=status))).count()
-
-            status = NEG
-            negative = RapidHIVTesting.objects.filter((
-                Q(subject_visit__subject_identifier__in=self.enrolled_pids) &
-                Q(site_id=site_id)) & (Q(hiv_result=status) |
-                                       Q(rapid_test_result=status))).count()
-
-            status = IND
-            unknown = RapidHIVTesting.objects.filter((
-                Q(subject_visit__subject_identifier__in=self.enrolled_pids) &
-                Q(site_id=site_id)) & (Q(hiv_result=status) |
-                                       Q(rapid_test_result=status))).count()
-
-            hiv_positive.append(positive)
-            hiv_negative.append(negative)
-            hiv_unknown.append(unknown)
-
-        hiv_positive.insert(0, sum(hiv_positive))
-        hiv_negative.insert(0, sum(hiv_negative))
-        hiv_unknown.insert(0, sum(hiv_unknown))
-
-        return [['HIV Positive', *hiv_positive],
-                ['HIV Negative', *hiv_negative],
-                ['Unknown', *hiv_unknown]]
+        return self.site_crosstab.hiv_statistics()
 
     @property
     def race_statistics(self):
-        black_african = []
-        asian = []
-        caucasian = []
-        other_race = []
-
-        for site_id in self.site_ids:
-
-            ethnicity_count = DemographicsData.objects.filter(
-                ethnicity='Black African', subject_visit__subject_identifier__in=self.enrolled_pids, site_id=site_id).count()
-            black_african.append(ethnicity_count)
-
-            ethnicity_count = DemographicsData.objects.filter(
-                ethnicity='Asian', subject_visit__subject_identifier__in=self.enrolled_pids, site_id=site_id).count()
-            asian.append(ethnicity_count)
-
-            ethnicity_count = DemographicsData.objects.filter(
-                ethnicity='Caucasian', subject_visit__subject_identifier__in=self.enrolled_pids, site_id=site_id).count()
-            caucasian.append(ethnicity_count)
-
-            ethnicity_count = DemographicsData.objects.filter(
-                ethnicity_other__isnull=False, subject_visit__subject_identifier__in=self.enrolled_pids, site_id=site_id).count()
-            other_race.append(ethnicity_count)
-
-        black_african.insert(0, sum(black_african))
-        asian.insert(0, sum(asian))
-        caucasian.insert(0, sum(caucasian))
-        other_race.insert(0, sum(other_race))
-
-        return [['Black African', *black_african],
-                ['Asian', *asian],
-                ['Caucasian', *caucasian],
-                ['Other Race', *other_race]]
+        return self.site_crosstab.race_statistics()
 
     @property
     def enrolled_pids(self):
@@ -219,35 +143,11 @@ class DemographicsMixin(EdcBaseViewMixin):
 
     @property
     def pregnancy_statistics(self):
-        pregnancies = []
-        for site_id in self.site_ids:
-            male_consents = InformedConsent.objects.filter(
-                gender=MALE).values_list('subject_identifier', flat=True)
-
-            # exclude all males if any exist with pregnancy tests
-            all_pregnancies = PregnancyTest.objects.filter(site_id=site_id, subject_visit__subject_identifier__in=self.enrolled_pids, result=POS)\
-                .exclude(subject_visit__subject_identifier__in=male_consents) \
-                .count()
-            pregnancies.append(all_pregnancies)
-
-        pregnancies.insert(0, sum(pregnancies))
-
-        return ['Pregnancies', *pregnancies]
+        return self.site_crosstab.pregnancy_statistics()
 
     @property
     def diabates_statistics(self):
-
-        diabetes = []
-
-        for site_id in self.site_ids:
-            with_diabetes = MedicalHistory.objects.filter(
-                subject_visit__subject_identifier__in=self.enrolled_pids, diabetes=YES, site_id=site_id,).count()
-
-            diabetes.append(with_diabetes)
-
-        diabetes.insert(0, sum(diabetes))
-
-        return ["Diabetes", *diabetes]
+        return self.subject_facts.row('Diabetes', diabetes=True)
     
     @property
     def demographics_statistics(self):
@@ -1,7 +1,9 @@
 from django.apps import apps as django_apps
-from django.db.models import Q
+from django.db.models import Count
 from edc_base.view_mixins import EdcBaseViewMixin
 
+from ....classes import DateConstraint
+
 
 class AdverseEventSummaryMixin(EdcBaseViewMixin):
     
@@ -16,25 +18,19 @@ class AdverseEventSummaryMixin(EdcBaseViewMixin):
         """
         AE start date is before first dose    
         """
-        ae_stats = []
-        for site_id in self.site_ids:
-            site_aes = 0
-            aes = self.ae_model_cls.objects.filter(site_id=site_id).values_list(
-                'adverse_event__subject_visit__subject_identifier','start_date')
-            for ae in aes:
-                subject_identifier = ae[0]
-                ae_start_date = ae[1]
-                try:
-                    self.vaccination_details_cls.objects.get(
-                        Q(received_dose_before='first_dose') &
-                        Q(subject_visit__subject_identifier=subject_identifier) &
-                        Q(vaccination_date__date__gt=ae_start_date))
-                except self.vaccination_details_cls.DoesNotExist:
-                    pass
-                else:
-                    site_aes += 1
-            ae_stats.append(site_aes)
-              
+        ae_after_first_dose = DateConstraint(
+            model=self.ae_model,
+            date_field='start_date',
+            operator='gte',
+            subject_lookup='adverse_event__subject_visit__subject_identifier',
+            visit_lookup='adverse_event__subject_visit',
+            reference_model='esr21_subject.vaccinationdetails',
+            reference_date_field='vaccination_date__date',
+            reference_filter={'received_dose_before': 'first_dose'})
+        site_aes = dict(ae_after_first_dose.violations().order_by().values_list(
+            'site_id').annotate(total=Count('pk')))
+        ae_stats = [site_aes.get(site_id, 0) for site_id in self.site_ids]
+
         return ["AE start date is before first dose", *ae_stats, sum(ae_stats)]
     
     def get_context_data(self, **kwargs):
@@ -1,7 +1,8 @@
 from django.apps import apps as django_apps
-from django.db.models import Q
 from edc_base.view_mixins import EdcBaseViewMixin
 
+from ....classes import anti_join_rules
+
 class DemographicsSummaryMixin(EdcBaseViewMixin):
     
     demographics_data_model = 'esr21_subject.demographicsdata'
@@ -15,29 +16,8 @@ class DemographicsSummaryMixin(EdcBaseViewMixin):
         """
         Not on demographic data    
         """
-        
-        
-        
-        
-        # enrolled but no demographics
-        no_demographics = []
-
-        for site_id in self.site_ids:
-            
-            site_enrollment_pids = self.vaccination_details_cls.objects.filter(
-                received_dose_before='first_dose',
-                site_id=site_id).values_list(
-            'subject_visit__subject_identifier',flat=True)
-            
-            
-            demographics_pids = self.demographics_data_cls.objects.filter(
-                Q(subject_visit__subject_identifier__in=site_enrollment_pids) &
-                Q(site=site_id)).values_list(
-            'subject_visit__subject_identifier',flat=True)
-                
-            no_demographics_data = list(set(site_enrollment_pids) - set(demographics_pids))
-
-            no_demographics.append(len(no_demographics_data))
+        site_counts = anti_join_rules.get('not_on_demographics').counts_by_site()
+        no_demographics = [site_counts.get(site_id, 0) for site_id in self.site_ids]
 
         return ["Not on demographic data", *no_demographics, sum(no_demographics)]
     
@@ -3,6 +3,8 @@ from django.db.models import Q
 from edc_constants.constants import YES
 from edc_base.view_mixins import EdcBaseViewMixin
 
+from ....classes import anti_join_rules
+
 
 class MedicalHistorySummaryMixin(EdcBaseViewMixin):
     medical_history_model = 'esr21_subject.medicalhistory'
@@ -40,25 +42,9 @@ class MedicalHistorySummaryMixin(EdcBaseViewMixin):
         """
         No HIV result    
         """
-        
-       
-        hiv_results = []
-        for site_id in self.site_ids:
-            site_enrollment_pids = self.vaccination_details_cls.objects.filter(
-                received_dose_before='first_dose',
-                site_id=site_id).values_list(
-            'subject_visit__subject_identifier',flat=True)
-                
-            existing_hiv_results = self.rapid_hiv_cls.objects.filter(Q(site_id=site_id) & Q(
-                subject_visit__subject_identifier__in=site_enrollment_pids)).values_list(
-                    'subject_visit__subject_identifier',flat=True)
-                
-            no_hiv_results = list(set(site_enrollment_pids) - set(existing_hiv_results))  
-            
-            if len(no_hiv_results) > 0:
-                print(no_hiv_results[0]) 
-            hiv_results.append(len(no_hiv_results))
-        
+        site_counts = anti_join_rules.get('no_hiv_results').counts_by_site()
+        hiv_results = [site_counts.get(site_id, 0) for site_id in self.site_ids]
+
         return ['No HIV result', *hiv_results, sum(hiv_results)]
 
     @property
@@ -66,20 +52,8 @@ class MedicalHistorySummaryMixin(EdcBaseViewMixin):
         """
         No medical history form    
         """
-
-        no_medical_histories = []
-        for site_id in self.site_ids:
-            site_enrollment_pids = self.vaccination_details_cls.objects.filter(
-                received_dose_before='first_dose',
-                site_id=site_id).values_list(
-            'subject_visit__subject_identifier',flat=True)
-
-            medical_histories = self.medical_history_cls.objects.filter(Q(site_id=site_id) & Q(
-                subject_visit__subject_identifier__in=site_enrollment_pids)).values_list(
-                    'subject_visit__subject_identifier',flat=True)
- 
-            no_medical_history = list(set(site_enrollment_pids) - set(medical_histories))   
-            no_medical_histories.append(len(no_medical_history))
+        site_counts = anti_join_rules.get('no_medical_history').counts_by_site()
+        no_medical_histories = [site_counts.get(site_id, 0) for site_id in self.site_ids]
 
         return ["No medical history form", *no_medical_histories, sum(no_medical_histories)]
     
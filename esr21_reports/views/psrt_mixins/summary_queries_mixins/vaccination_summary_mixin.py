@@ -2,6 +2,8 @@ from django.apps import apps as django_apps
 from django.db.models import Q
 from edc_base.view_mixins import EdcBaseViewMixin
 
+from ....classes import VaccinationReconciliation
+
 class VaccinationSummaryMixin(EdcBaseViewMixin):
     
     vaccination_details_model = 'esr21_subject.vaccinationdetails'
@@ -53,6 +55,26 @@ class VaccinationSummaryMixin(EdcBaseViewMixin):
 
         return ['Participant vaccinated but ineligible', *not_eligible, sum(not_eligible)]   
 
+    @property
+    def vaccination_history_mismatch_statistics(self):
+        """
+        Vaccination history product name or date not matching the vaccination
+        details, per dose, and vaccinated participants missing a vaccination
+        history.
+        """
+        counts = VaccinationReconciliation().counts_by_dose_and_site()
+        labels = [
+            (None, 'Vaccinated but missing vaccination history'),
+            ('first_dose', 'Vaccination history mismatch for first dose'),
+            ('second_dose', 'Vaccination history mismatch for second dose'),
+            ('booster_dose', 'Vaccination history mismatch for booster dose'),
+        ]
+        mismatch_stats = []
+        for dose, label in labels:
+            site_counts = [counts.get((dose, site_id), 0) for site_id in self.site_ids]
+            mismatch_stats.append([label, *site_counts, sum(site_counts)])
+        return mismatch_stats
+
     # @property
     # def vaccinated_no_icf_statistics(self):
     #     """
@@ -66,5 +88,6 @@ class VaccinationSummaryMixin(EdcBaseViewMixin):
 
         context.update(
             first_dose_second_dose_stats = self.first_dose_second_dose_missing_statistics,
-            ineligible_vaccinated_participants_stats = self.ineligible_vaccinated_participant_statistics)
+            ineligible_vaccinated_participants_stats = self.ineligible_vaccinated_participant_statistics,
+            vaccination_history_mismatch_stats = self.vaccination_history_mismatch_statistics)
         return context
\ No newline at end of file
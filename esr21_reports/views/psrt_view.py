@@ -1,10 +1,10 @@
-import json
 from django.apps import apps as django_apps
+from django.utils.functional import cached_property
 from django.views.generic import TemplateView
 from edc_base.view_mixins import EdcBaseViewMixin
 from edc_navbar import NavbarViewMixin
 
-from esr21_reports.models import DashboardStatistics
+from esr21_reports.classes import DashboardStatisticsStore, report_counters
 from .adverse_events import (
     AdverseEventRecordViewMixin, SeriousAdverseEventRecordViewMixin)
 from .site_helper_mixin import SiteHelperMixin
@@ -23,19 +23,25 @@ class PSRTView(SiteHelperMixin,
     siae_model = 'esr21_subject.specialinterestadverseeventrecord'
     offstudy_model = 'esr21_prn.subjectoffstudy'
     
-    def cache_preprocessor(self, key):
-        statistics = None
-        
-        try:
-            dashboard_statistics = DashboardStatistics.objects.get(key=key)
-        except DashboardStatistics.DoesNotExist:
-            pass
-        else:
-            statistics =  json.loads(dashboard_statistics.value)
-        
-        return statistics
+    statistics_keys = [
+        'ae_statistics', 'sae_statistics', 'pregnancy_statistics',
+        'demographics_statistics', 'screening_statistics',
+        'vaccinated_statistics', 'enrolled_statistics']
 
+    @cached_property
+    def dashboard_statistics(self):
+        """
+        All the statistics of the view from the current generation, in one
+        query, with the live headline counts when the report counters are
+        enabled.
+        """
+        return report_counters.headline_statistics(
+            DashboardStatisticsStore().get_many(self.statistics_keys))
 
+    def cache_preprocessor(self, key):
+        if key in self.statistics_keys:
+            return self.dashboard_statistics.get(key)
+        return DashboardStatisticsStore().get(key)
 
     @property
     def ae_cls(self):